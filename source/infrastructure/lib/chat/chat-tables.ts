@@ -23,6 +23,7 @@ export class ChatTablesConstruct extends Construct {
 
   public readonly byUserIdIndex: string = "byUserId";
   public readonly bySessionIdIndex: string = "bySessionId";
+  public readonly bySessionIdCreateTimeIndex: string = "bySessionIdCreateTime";
   public readonly byTimestampIndex: string = "byTimestamp";
 
   constructor(scope: Construct, id: string) {
@@ -75,6 +76,14 @@ export class ChatTablesConstruct extends Construct {
       indexName: this.bySessionIdIndex,
       partitionKey: { name: "sessionId", type: dynamodb.AttributeType.STRING },
     });
+    // Newest-first history loading for the online chat
+    messagesTable.addGlobalSecondaryIndex({
+      indexName: this.bySessionIdCreateTimeIndex,
+      partitionKey: { name: "sessionId", type: dynamodb.AttributeType.STRING },
+      sortKey: timestampAttr,
+      projectionType: dynamodb.ProjectionType.INCLUDE,
+      nonKeyAttributes: ["role", "content", "entryType", "customMessageId", "additional_kwargs"],
+    });
 
     const promptTable = new DynamoDBTable(this, "Prompt", groupNameAttr2, sortKeyAttr).table;
     const intentionTable = new DynamoDBTable(this, "Intention", groupNameAttr, intentionIdAttr).table;
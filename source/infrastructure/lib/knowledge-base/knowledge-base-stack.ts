@@ -232,6 +232,8 @@ export class KnowledgeBaseStack extends NestedStack implements KnowledgeBaseStac
         "--ETL_OBJECT_TABLE": this.etlObjTableName || "-",
         "--PORTAL_BUCKET": this.uiPortalBucketName,
         "--CHATBOT_TABLE": props.sharedConstructOutputs.chatbotTable.tableName,
+        "--CHUNK_ARTIFACTS": "jsonl",
+        "--INCREMENTAL_UPDATE": "false",
         "--additional-python-modules":
           "langchain==0.3.7,beautifulsoup4==4.12.2,requests-aws4auth==1.2.2,boto3==1.28.84,openai==0.28.1,pyOpenSSL==23.3.0,tenacity==8.2.3,markdownify==0.11.6,mammoth==1.6.0,chardet==5.2.0,python-docx==1.1.0,nltk==3.9.1,pdfminer.six==20221105,smart-open==7.0.4,opensearch-py==2.2.0,lxml==5.2.2,pandas==2.1.2,openpyxl==3.1.5,xlrd==2.0.1,langchain_community==0.3.5",
         // Add multiple extra python files
@@ -257,7 +259,8 @@ export class KnowledgeBaseStack extends NestedStack implements KnowledgeBaseStac
       environment: {
         DEFAULT_EMBEDDING_ENDPOINT:
           props.modelConstructOutputs.defaultEmbeddingModelName,
-        AOS_DOMAIN_ENDPOINT: this.aosDomainEndpoint
+        AOS_DOMAIN_ENDPOINT: this.aosDomainEndpoint,
+        MANIFEST_BUCKET: this.glueResultBucket.bucketName,
       },
     });
     etlLambda.addToRolePolicy(this.iamHelper.glueStatement);
@@ -281,7 +284,9 @@ export class KnowledgeBaseStack extends NestedStack implements KnowledgeBaseStac
             "offline.$": "$.Payload.offline",
             "batchFileNumber.$": "$.Payload.batchFileNumber",
             "batchIndices.$": "$.Payload.batchIndices",
+            "manifestS3Uri.$": "$.Payload.manifestS3Uri",
             "indexType.$": "$.Payload.indexType",
+            "supportedFileTypes.$": "$.Payload.supportedFileTypes",
             "operationType.$": "$.Payload.operationType",
             "embeddingEndpoint.$": "$.Payload.embeddingEndpoint",
             "tableItemId.$": "$.Payload.tableItemId",
@@ -301,10 +306,12 @@ export class KnowledgeBaseStack extends NestedStack implements KnowledgeBaseStac
         "--AOS_ENDPOINT": this.aosDomainEndpoint,
         "--BATCH_FILE_NUMBER.$": "$.batchFileNumber",
         "--BATCH_INDICE.$": 'States.Format(\'{}\', $.batchIndices)',
+        "--MANIFEST_S3_URI.$": "$.manifestS3Uri",
         "--DOCUMENT_LANGUAGE.$": "$.documentLanguage",
         "--EMBEDDING_MODEL_ENDPOINT.$": "$.embeddingEndpoint",
         "--ETL_MODEL_ENDPOINT": props.modelConstructOutputs.defaultKnowledgeBaseModelName || "-",
         "--INDEX_TYPE.$": "$.indexType",
+        "--SUPPORTED_FILE_TYPES.$": "$.supportedFileTypes",
         "--JOB_NAME": glueJob.jobName,
         "--OFFLINE": "true",
         "--OPERATION_TYPE.$": "$.operationType",
@@ -344,7 +351,9 @@ export class KnowledgeBaseStack extends NestedStack implements KnowledgeBaseStac
         "batchFileNumber.$": "$.batchFileNumber",
         // "index" is a special variable within the Map state that represents the current index
         "batchIndices.$": "$$.Map.Item.Index", // Add this if you need to know the index of the current item in the map state
+        "manifestS3Uri.$": "$.manifestS3Uri",
         "indexType.$": "$.indexType",
+        "supportedFileTypes.$": "$.supportedFileTypes",
         "operationType.$": "$.operationType",
         "embeddingEndpoint.$": "$.embeddingEndpoint",
         "tableItemId.$": "$.tableItemId",
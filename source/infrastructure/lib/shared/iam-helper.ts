@@ -89,6 +89,7 @@ export class IAMHelper extends Construct {
       [
         "dynamodb:Query",
         "dynamodb:GetItem",
+        "dynamodb:BatchGetItem",
         "dynamodb:PutItem",
         "dynamodb:UpdateItem",
         "dynamodb:Describe*",
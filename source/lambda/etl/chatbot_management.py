@@ -9,6 +9,8 @@ from boto3.dynamodb.conditions import Attr
 from botocore.paginate import TokenEncoder
 from constant import IndexType, EmbeddingModelType
 from utils.ddb_utils import (
+    CHATBOT_VERSION_ID,
+    bump_chatbot_version,
     initiate_chatbot,
     initiate_index,
     initiate_model
@@ -86,6 +88,8 @@ def create_chatbot(event, group_name):
                 index.get(index_type,{}).get(index_id),
                 create_time
             )
+    # invalidate the chatbot caches of the chat lambdas
+    bump_chatbot_version(chatbot_table, group_name)
     return {
         "chatbotId": chatbot_id,
         "groupName": group_name,
@@ -129,6 +133,8 @@ def __list_chatbot(event, group_name):
         for item in page_items:
             item_json = {}
             chatbot_id = item.get("chatbotId", {"S": ""})["S"]
+            if chatbot_id == CHATBOT_VERSION_ID:
+                continue
             item_json["ChatbotId"] = chatbot_id
             chatbot_model_item = model_table.get_item(
                 Key={
@@ -221,6 +227,7 @@ def __delete_chatbot(event, group_name):
     response = chatbot_table.delete_item(
         Key={"groupName": group_name, "chatbotId": chatbot_id}
     )
+    bump_chatbot_version(chatbot_table, group_name)
     return response
 
 
@@ -359,6 +366,7 @@ def __edit_chatbot(event, group_name):
                 index.get(index_type,{}).get(index_id),
                 update_time
             )
+    bump_chatbot_version(chatbot_table, group_name)
 
     # 3.更新index表
     return {
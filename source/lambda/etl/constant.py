@@ -35,6 +35,29 @@ class IndexType(Enum):
     INTENTION = "intention"
 
 
+# File types ingested for each index type. The ETL lambda lists and shards
+# only these files and passes the list to the Glue job as SUPPORTED_FILE_TYPES.
+SUPPORTED_FILE_TYPES = {
+    IndexType.QD.value: [
+        "pdf",
+        "txt",
+        "docx",
+        "xlsx",
+        "xls",
+        "md",
+        "html",
+        "json",
+        "csv",
+        "png",
+        "jpeg",
+        "jpg",
+        "webp",
+    ],
+    IndexType.QQ.value: ["jsonl", "xlsx", "xls"],
+    IndexType.INTENTION.value: ["jsonl", "xlsx", "xls"],
+}
+
+
 @unique
 class ModelType(Enum):
     EMBEDDING = "embedding_and_rerank"
@@ -1,17 +1,37 @@
+import heapq
+import json
 import logging
 import os
 
 import boto3
+from constant import SUPPORTED_FILE_TYPES
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 s3_client = boto3.client("s3")
 
-supported_file_types = ["pdf", "txt", "doc", "md", "html", "json",
-                        "jsonl", "csv", "png", "jpg", "jpeg", "webp", "xlsx", "xls"]
 default_embedding_endpoint = os.environ.get("DEFAULT_EMBEDDING_ENDPOINT")
 aos_domain_endpoint = os.environ.get("AOS_DOMAIN_ENDPOINT")
+# Bucket of the shard manifests read by the glue jobs, files are sharded by
+# index and every glue job lists the prefix when it is not set
+manifest_bucket = os.environ.get("MANIFEST_BUCKET")
+manifest_prefix = os.environ.get("MANIFEST_PREFIX", "etl-manifests")
+
+# Estimated processing cost per byte of each file type, relative to text.
+# PDFs are converted by the ETL model and images are described by Bedrock.
+file_type_cost_weights = {
+    "pdf": 20,
+    "png": 5,
+    "jpg": 5,
+    "jpeg": 5,
+    "webp": 5,
+    "docx": 2,
+    "xlsx": 2,
+    "xls": 2,
+}
+# Fixed cost of a file in bytes, so that many small files are not free
+file_base_cost = int(os.environ.get("ETL_FILE_BASE_COST", 64 * 1024))
 
 
 def get_job_number(event, file_count):
@@ -23,6 +43,47 @@ def get_job_number(event, file_count):
     return job_number
 
 
+def get_file_cost(file_info):
+    weight = file_type_cost_weights.get(file_info["type"], 1)
+    return file_base_cost + file_info["size"] * weight
+
+
+def shard_files(files, job_number):
+    """Bin-pack the files into shards of about the same processing cost.
+
+    Files are assigned from the most to the least expensive to the shard
+    with the lowest cost so far.
+    """
+    shards = [[] for _ in range(job_number)]
+    shard_costs = [(0, i) for i in range(job_number)]
+    for file_info in sorted(files, key=get_file_cost, reverse=True):
+        cost, i = heapq.heappop(shard_costs)
+        shards[i].append(file_info)
+        heapq.heappush(shard_costs, (cost + get_file_cost(file_info), i))
+    logger.info(
+        f"shard costs: {[cost for cost, _ in sorted(shard_costs, key=lambda x: x[1])]}"
+    )
+    return shards
+
+
+def save_manifest(table_item_id, bucket_name, prefix, shards):
+    if not manifest_bucket or manifest_bucket == "-":
+        return "-"
+    manifest_key = f"{manifest_prefix}/{table_item_id}.json"
+    manifest = {
+        "s3Bucket": bucket_name,
+        "s3Prefix": prefix,
+        "shards": shards,
+    }
+    s3_client.put_object(
+        Bucket=manifest_bucket,
+        Key=manifest_key,
+        Body=json.dumps(manifest).encode("utf-8"),
+        ContentType="application/json",
+    )
+    return f"s3://{manifest_bucket}/{manifest_key}"
+
+
 # Offline lambda function to count the number of files in the S3 bucket
 def lambda_handler(event, context):
     logger.info(f"event:{event}")
@@ -41,12 +102,13 @@ def lambda_handler(event, context):
     embedding_endpoint = event.get(
         "embeddingEndpoint", default_embedding_endpoint)
     table_item_id = event["tableItemId"]
+    supported_file_types = SUPPORTED_FILE_TYPES[index_type]
 
     if "offline" not in event:
         raise ValueError("offline is not in the event")
     elif event["offline"].lower() == "true":
-        # Initialize the file count
-        file_count = 0
+        # Record the files to process in one listing pass
+        files = []
 
         # Paginate through the list of objects in the bucket with the specified prefix
         paginator = s3_client.get_paginator("list_objects_v2")
@@ -61,7 +123,15 @@ def lambda_handler(event, context):
                 if key.endswith("/") or file_type not in supported_file_types:
                     continue
 
-                file_count += 1
+                files.append(
+                    {
+                        "key": key,
+                        "size": obj.get("Size", 0),
+                        "type": file_type,
+                        "etag": obj.get("ETag"),
+                    }
+                )
+        file_count = len(files)
         file_count = 1 if file_count == 0 else file_count
         job_number = get_job_number(event, file_count)
 
@@ -70,6 +140,10 @@ def lambda_handler(event, context):
         # convert the fileCount into an array of numbers "fileIndices": [0, 1, 2, ..., 10], an array from 0 to fileCount-1
         batch_indices = list(range(job_number))
 
+        manifest_s3_uri = save_manifest(
+            table_item_id, bucket_name, prefix, shard_files(files, job_number)
+        )
+
         # This response should match the expected input schema of the downstream tasks in the Step Functions workflow
         return {
             "s3Bucket": bucket_name,
@@ -84,7 +158,9 @@ def lambda_handler(event, context):
             "offline": event["offline"].lower(),
             "batchFileNumber": str(batch_file_number),
             "batchIndices": batch_indices,
+            "manifestS3Uri": manifest_s3_uri,
             "indexType": index_type,
+            "supportedFileTypes": ",".join(supported_file_types),
             "operationType": operation_type,
             "embeddingEndpoint": embedding_endpoint,
             "tableItemId": table_item_id,
@@ -103,9 +179,11 @@ def lambda_handler(event, context):
             "offline": "false",
             "batchFileNumber": "1",
             "batchIndices": "0",
+            "manifestS3Uri": "-",
             "indexId": index_id,
             "embeddingModelType": embedding_model_type,
             "indexType": index_type,
+            "supportedFileTypes": ",".join(supported_file_types),
             "operationType": operation_type,
             "embeddingEndpoint": embedding_endpoint,
             "tableItemId": table_item_id,
@@ -4,6 +4,20 @@ from constant import IndexType, KBType, ModelType, UiStatus
 from utils.embeddings import get_embedding_info
 
 
+# per group item of the chatbot table holding a version that the chatbot
+# management api bumps when it creates, edits or deletes a chatbot, the chat
+# lambdas reload their cached chatbots when it changes
+CHATBOT_VERSION_ID = "__version__"
+
+
+def bump_chatbot_version(chatbot_table, group_name):
+    chatbot_table.update_item(
+        Key={"groupName": group_name, "chatbotId": CHATBOT_VERSION_ID},
+        UpdateExpression="ADD Version :one",
+        ExpressionAttributeValues={":one": 1},
+    )
+
+
 def item_exist(ddb_table, item_key: dict):
     response = ddb_table.get_item(Key=item_key)
     item = response.get("Item")
@@ -5,6 +5,20 @@ from constant import IndexType, KBType, ModelType, Status
 from embeddings import get_embedding_info
 
 
+# per group item of the chatbot table holding the version bumped by the
+# chatbot and index writes below, the chat lambdas reload their cached
+# chatbots when it changes
+CHATBOT_VERSION_ID = "__version__"
+
+
+def bump_chatbot_version(chatbot_table, group_name):
+    chatbot_table.update_item(
+        Key={"groupName": group_name, "chatbotId": CHATBOT_VERSION_ID},
+        UpdateExpression="ADD Version :one",
+        ExpressionAttributeValues={":one": 1},
+    )
+
+
 def create_item_if_not_exist(ddb_table, item_key: dict, body: str):
     response = ddb_table.get_item(Key=item_key)
     item = response.get("Item")
@@ -52,7 +66,10 @@ def initiate_index(
     tag,
     create_time=None,
     description="",
+    chatbot_table=None,
 ):
+    """Create the index item if it does not exist. Pass the chatbot table to
+    make the chat lambdas reload the chatbots of the group."""
     if not create_time:
         create_time = str(datetime.now(timezone.utc))
 
@@ -67,9 +84,11 @@ def initiate_index(
         "status": Status.ACTIVE.value,
     }
 
-    create_item_if_not_exist(
+    is_existed, _ = create_item_if_not_exist(
         index_table, {"groupName": group_name, "indexId": index_id}, db_body
     )
+    if not is_existed and chatbot_table is not None:
+        bump_chatbot_version(chatbot_table, group_name)
 
 
 def initiate_chatbot(
@@ -112,6 +131,8 @@ def initiate_chatbot(
             item["indexIds"][index_type] = {
                 "count": 1, "value": {tag: index_id}}
             chatbot_table.put_item(Item=item)
+    if not is_existed or append_index:
+        bump_chatbot_version(chatbot_table, group_name)
 
 
 def is_chatbot_existed(ddb_table, group_name: str, chatbot_id: str):
@@ -1,8 +1,13 @@
 from __future__ import annotations
 
 import copy
+import hashlib
+import json
+import logging
 import math
 import re
+import threading
+import time
 import traceback
 import uuid
 import warnings
@@ -22,6 +27,8 @@ SCRIPT_SCORING_SEARCH = "script_scoring"
 PAINLESS_SCRIPTING_SEARCH = "painless_scripting"
 MATCH_ALL_QUERY = {"match_all": {}}  # type: Dict
 
+logger = logging.getLogger()
+
 
 def _import_opensearch() -> Any:
     """Import OpenSearch if available, otherwise raise error."""
@@ -41,6 +48,24 @@ def _import_bulk() -> Any:
     return bulk
 
 
+def _import_streaming_bulk() -> Any:
+    """Import streaming_bulk if available, otherwise raise error."""
+    try:
+        from opensearchpy.helpers import streaming_bulk
+    except ImportError:
+        raise ImportError(IMPORT_OPENSEARCH_PY_ERROR)
+    return streaming_bulk
+
+
+def _import_parallel_bulk() -> Any:
+    """Import parallel_bulk if available, otherwise raise error."""
+    try:
+        from opensearchpy.helpers import parallel_bulk
+    except ImportError:
+        raise ImportError(IMPORT_OPENSEARCH_PY_ERROR)
+    return parallel_bulk
+
+
 def _import_not_found_error() -> Any:
     """Import not found error if available, otherwise raise error."""
     try:
@@ -94,6 +119,219 @@ def _is_aoss_enabled(http_auth: Any) -> bool:
     return False
 
 
+# status of the bulk items worth sending again
+RETRYABLE_BULK_STATUS = (429, 500, 502, 503, 504)
+# index settings during a bulk load: no refresh and no replica
+BULK_INDEX_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+# key of the index _meta mapping holding the settings to restore after a bulk
+# load, so that a later session restores them if a job is killed
+BULK_ORIGINAL_SETTINGS_META_KEY = "bulk_ingestion_original_settings"
+
+
+class BulkIngestionSession:
+    """Bulk load session of an index.
+
+    The index is ensured once, and its refreshes and replicas are turned off
+    while loading. The original settings are also stored in the _meta mapping
+    of the index, and are restored with a single refresh when the session is
+    closed. A setting that already has its bulk value, e.g. set by a
+    concurrent or killed session, is restored to the value stored in _meta,
+    or reset to its default for the refresh interval. The settings are not
+    changed for AOSS.
+
+    Actions are sent with streaming_bulk, or parallel_bulk when thread_count
+    is greater than 1. Only the actions that failed with a retryable status
+    are sent again, after an exponential backoff, the errors of the others
+    are collected.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        index_name: str,
+        is_aoss: bool = False,
+        bulk_settings: Optional[Dict] = None,
+        thread_count: int = 1,
+        chunk_size: int = 500,
+        max_chunk_bytes: int = 1 * 1024 * 1024,
+        max_retry_time: int = 3,
+        retry_interval: float = 1.0,
+    ):
+        self.client = client
+        self.index_name = index_name
+        self.is_aoss = is_aoss
+        self.bulk_settings = (
+            BULK_INDEX_SETTINGS if bulk_settings is None else bulk_settings
+        )
+        self.thread_count = thread_count
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_retry_time = max_retry_time
+        self.retry_interval = retry_interval
+        self.indexed_count = 0
+        self.errors = []
+        self._original_settings = {}
+        self._index_ready = False
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "BulkIngestionSession":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def ensure_index(self, mapping: Optional[Dict] = None) -> None:
+        """Create the index if needed and apply the bulk settings, once"""
+        if self._index_ready:
+            return
+        with self._lock:
+            if self._index_ready:
+                return
+            if not self.client.indices.exists(index=self.index_name):
+                self.client.indices.create(index=self.index_name, body=mapping or {})
+            if not self.is_aoss and self.bulk_settings:
+                settings = self.client.indices.get_settings(index=self.index_name)
+                index_settings = next(iter(settings.values()))["settings"]["index"]
+                index_meta = self._get_index_meta()
+                stored_settings = index_meta.get(BULK_ORIGINAL_SETTINGS_META_KEY, {})
+                self._original_settings = {}
+                bulk_settings = {}
+                for key, value in self.bulk_settings.items():
+                    current = index_settings.get(key)
+                    if str(current) != str(value):
+                        self._original_settings[key] = current
+                        bulk_settings[key] = value
+                    elif key in stored_settings:
+                        # left by a concurrent or killed session
+                        self._original_settings[key] = stored_settings[key]
+                    elif key == "refresh_interval":
+                        # reset to the default refresh interval
+                        self._original_settings[key] = None
+                original_settings = {**stored_settings, **self._original_settings}
+                if original_settings != stored_settings:
+                    self._put_index_meta(
+                        {
+                            **index_meta,
+                            BULK_ORIGINAL_SETTINGS_META_KEY: original_settings,
+                        }
+                    )
+                if bulk_settings:
+                    self.client.indices.put_settings(
+                        index=self.index_name, body={"index": bulk_settings}
+                    )
+            self._index_ready = True
+
+    def _get_index_meta(self) -> Dict:
+        mappings = self.client.indices.get_mapping(index=self.index_name)
+        return next(iter(mappings.values()))["mappings"].get("_meta", {})
+
+    def _put_index_meta(self, index_meta: Dict) -> None:
+        self.client.indices.put_mapping(
+            index=self.index_name, body={"_meta": index_meta}
+        )
+
+    def _bulk(self, actions: List[dict]) -> Iterable:
+        kwargs = {
+            "chunk_size": self.chunk_size,
+            "max_chunk_bytes": self.max_chunk_bytes,
+            "raise_on_error": False,
+            "raise_on_exception": False,
+        }
+        if self.thread_count > 1:
+            parallel_bulk = _import_parallel_bulk()
+            return parallel_bulk(
+                self.client, actions, thread_count=self.thread_count, **kwargs
+            )
+        streaming_bulk = _import_streaming_bulk()
+        return streaming_bulk(self.client, actions, **kwargs)
+
+    def ingest(self, actions: List[dict]) -> List[dict]:
+        """Send the actions and return the errors of the ones that failed"""
+        self.ensure_index()
+        errors = []
+        for retry_time in range(self.max_retry_time):
+            last_try = retry_time == self.max_retry_time - 1
+            retry_actions = []
+            indexed_count = 0
+            # the results are yielded in the order of the actions
+            for action, (ok, item) in zip(actions, self._bulk(actions)):
+                if ok:
+                    indexed_count += 1
+                    continue
+                error = next(iter(item.values()))
+                status = error.get("status")
+                # the status is not an int when the request itself failed
+                retryable = status in RETRYABLE_BULK_STATUS or not isinstance(
+                    status, int
+                )
+                if retryable and not last_try:
+                    retry_actions.append(action)
+                else:
+                    errors.append(error)
+            with self._lock:
+                self.indexed_count += indexed_count
+            if not retry_actions:
+                break
+            logger.warning(
+                f"retry {len(retry_actions)} bulk actions on {self.index_name}, "
+                f"attempt {retry_time + 1}"
+            )
+            time.sleep(self.retry_interval * 2**retry_time)
+            actions = retry_actions
+        with self._lock:
+            self.errors += errors
+        return errors
+
+    def close(self) -> None:
+        """Restore the index settings and refresh it"""
+        with self._lock:
+            if not self._index_ready:
+                return
+            self._index_ready = False
+            if self._original_settings:
+                self.client.indices.put_settings(
+                    index=self.index_name, body={"index": self._original_settings}
+                )
+                self._original_settings = {}
+                index_meta = self._get_index_meta()
+                if index_meta.pop(BULK_ORIGINAL_SETTINGS_META_KEY, None) is not None:
+                    self._put_index_meta(index_meta)
+            if not self.is_aoss:
+                self.client.indices.refresh(index=self.index_name)
+
+
+# Chunk metadata read by the context expansion of the retrievers. A chunk
+# whose position in the heading hierarchy changed gets a new id, so it is
+# indexed again even if its text did not change.
+CHUNK_CONTEXT_METADATA_KEYS = ("chunk_id", "heading_hierarchy")
+
+
+def get_chunk_id(
+    file_path: str,
+    text: str,
+    embedding_model: str,
+    metadata: dict = None,
+    occurrence: int = 0,
+) -> str:
+    """Deterministic id of a chunk, from its file, content, context metadata
+    and embedding model.
+
+    Re-ingesting an unchanged chunk upserts the same document instead of
+    adding a duplicate. occurrence tells identical chunks of a file apart.
+    """
+    content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    context = {
+        key: metadata[key]
+        for key in CHUNK_CONTEXT_METADATA_KEYS
+        if metadata and key in metadata
+    }
+    id_str = json.dumps(
+        [file_path, content_hash, embedding_model, context, occurrence],
+        sort_keys=True,
+    )
+    return hashlib.sha256(id_str.encode("utf-8")).hexdigest()
+
+
 def _bulk_ingest_embeddings(
     client: Any,
     index_name: str,
@@ -107,8 +345,13 @@ def _bulk_ingest_embeddings(
     max_chunk_bytes: Optional[int] = 1 * 1024 * 1024,
     is_aoss: bool = False,
     max_retry_time: int = 3,
+    session: Optional[BulkIngestionSession] = None,
 ) -> List[str]:
-    """Bulk Ingest Embeddings into given index."""
+    """Bulk Ingest Embeddings into given index.
+
+    With a session, the index is ensured and refreshed by the session, and
+    a RuntimeError is raised when some embeddings failed to be ingested.
+    """
     if not mapping:
         mapping = dict()
 
@@ -118,10 +361,13 @@ def _bulk_ingest_embeddings(
     return_ids = []
     mapping = mapping
 
-    try:
-        client.indices.get(index=index_name)
-    except not_found_error:
-        client.indices.create(index=index_name, body=mapping)
+    if session is not None:
+        session.ensure_index(mapping)
+    else:
+        try:
+            client.indices.get(index=index_name)
+        except not_found_error:
+            client.indices.create(index=index_name, body=mapping)
 
     for i, text in enumerate(texts):
         metadata = metadatas[i] if metadatas else {}
@@ -142,6 +388,13 @@ def _bulk_ingest_embeddings(
             request["_id"] = _id
         requests.append(request)
         return_ids.append(_id)
+    if session is not None:
+        errors = session.ingest(requests)
+        if errors:
+            raise RuntimeError(
+                f"{len(errors)} of {len(requests)} embeddings failed to be ingested: {errors[0]}"
+            )
+        return return_ids
     retry_time = 0
     while retry_time < max_retry_time:
         try:
@@ -838,6 +1091,7 @@ class OpenSearchVectorSearch(VectorStore):
         vector_field = _get_kwargs_value(kwargs, "vector_field", "vector_field")
         max_chunk_bytes = _get_kwargs_value(kwargs, "max_chunk_bytes", 1 * 1024 * 1024)
         mapping = _get_kwargs_value(kwargs, "mapping", None)
+        session = _get_kwargs_value(kwargs, "session", None)
 
         return _bulk_ingest_embeddings(
             self.client,
@@ -851,6 +1105,7 @@ class OpenSearchVectorSearch(VectorStore):
             mapping=mapping,
             max_chunk_bytes=max_chunk_bytes,
             is_aoss=self.is_aoss,
+            session=session,
         )
 
     def add_texts(
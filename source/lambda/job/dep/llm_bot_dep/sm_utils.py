@@ -1,9 +1,12 @@
 import io
 import json
 import logging
+import os
+import threading
 from typing import Any, Dict, Iterator, List, Mapping, Optional
 
 import boto3
+from botocore.config import Config
 from langchain.callbacks.manager import CallbackManagerForLLMRun
 from langchain_community.embeddings import (
     BedrockEmbeddings,
@@ -23,6 +26,59 @@ from langchain_core.pydantic_v1 import Extra, root_validator
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Runtime clients are shared by all the callers in the process, keep enough
+# pooled connections for the concurrent embedding and rerank calls
+BOTO3_CLIENT_CONFIG = Config(
+    max_pool_connections=int(os.environ.get("BOTO3_MAX_POOL_CONNECTIONS", 50)),
+    tcp_keepalive=True,
+    retries={"max_attempts": 3, "mode": "standard"},
+)
+
+boto3_client_lock = threading.Lock()
+boto3_client_map = {}
+embeddings_lock = threading.Lock()
+embeddings_map = {}
+
+
+def get_boto3_client(
+    service_name: str,
+    region_name: Optional[str] = None,
+    aws_access_key_id: Optional[str] = None,
+    aws_secret_access_key: Optional[str] = None,
+    aws_session_token: Optional[str] = None,
+    profile_name: Optional[str] = None,
+):
+    """Get a long-lived boto3 client keyed by (service, region, credentials)
+
+    Creating a client and doing the TLS handshake on every call is expensive,
+    so clients are created once and reused for the life of the process.
+    """
+    client_key = (
+        service_name,
+        region_name,
+        profile_name,
+        aws_access_key_id,
+        aws_secret_access_key,
+        aws_session_token,
+    )
+    with boto3_client_lock:
+        client = boto3_client_map.get(client_key)
+        if client is None:
+            if profile_name is not None:
+                session = boto3.Session(profile_name=profile_name)
+            else:
+                session = boto3.Session()
+            client = session.client(
+                service_name,
+                region_name=region_name,
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                aws_session_token=aws_session_token,
+                config=BOTO3_CLIENT_CONFIG,
+            )
+            boto3_client_map[client_key] = client
+        return client
+
 
 class vectorContentHandler(EmbeddingsContentHandler):
     content_type = "application/json"
@@ -385,77 +441,121 @@ class SagemakerEndpointChat(BaseChatModel):
         return text
 
 
-def SagemakerEndpointVectorOrCross(
-    prompt: str,
+def get_sagemaker_endpoint_model(
     endpoint_name: str,
     region_name: str,
     model_type: str,
-    stop: List[str],
     target_model=None,
-    **kwargs,
-) -> SagemakerEndpoint:
-    """
-    original class invocation:
-        response = self.client.invoke_endpoint(
-            EndpointName=self.endpoint_name,
-            Body=body,
-            ContentType=content_type,
-            Accept=accepts,
-            **_endpoint_kwargs,
-        )
+):
+    """Get the cached langchain wrapper of a sagemaker endpoint
+
+    Embedding model types return SagemakerEndpointEmbeddings, the others
+    return SagemakerEndpoint.
     """
+    model_key = ("sagemaker", endpoint_name, region_name, model_type, target_model)
+    with embeddings_lock:
+        if model_key in embeddings_map:
+            return embeddings_map[model_key]
+
     if target_model:
         endpoint_kwargs = {"TargetModel": target_model}
     else:
         endpoint_kwargs = None
-    client = boto3.client("sagemaker-runtime", region_name=region_name)
+    client = get_boto3_client("sagemaker-runtime", region_name=region_name)
     if model_type == "vector" or model_type == "bce":
         content_handler = vectorContentHandler()
-        embeddings = SagemakerEndpointEmbeddings(
+        model = SagemakerEndpointEmbeddings(
             client=client,
             endpoint_name=endpoint_name,
             content_handler=content_handler,
             endpoint_kwargs=endpoint_kwargs,
         )
-        query_result = embeddings.embed_query(prompt)
-        return query_result
-    elif model_type == "cross":
-        content_handler = crossContentHandler()
     elif model_type == "m3":
         content_handler = m3ContentHandler()
         model_kwargs = {}
         model_kwargs["batch_size"] = 12
         model_kwargs["max_length"] = 512
         model_kwargs["return_type"] = "dense"
-        embeddings = SagemakerEndpointEmbeddings(
+        model = SagemakerEndpointEmbeddings(
             client=client,
             endpoint_name=endpoint_name,
             content_handler=content_handler,
             model_kwargs=model_kwargs,
             endpoint_kwargs=endpoint_kwargs,
         )
-        query_result = embeddings.embed_query(prompt)
-        return query_result
-    elif model_type == "answer":
-        content_handler = answerContentHandler()
-    elif model_type == "rerank":
-        content_handler = rerankContentHandler()
-    # TODO: replace with SagemakerEndpointStreaming
-    genericModel = SagemakerEndpoint(
-        client=client,
-        endpoint_name=endpoint_name,
-        # region_name = region_name,
-        content_handler=content_handler,
-        endpoint_kwargs=endpoint_kwargs,
+    else:
+        if model_type == "cross":
+            content_handler = crossContentHandler()
+        elif model_type == "answer":
+            content_handler = answerContentHandler()
+        elif model_type == "rerank":
+            content_handler = rerankContentHandler()
+        else:
+            raise ValueError(f"invalid sagemaker model type: {model_type}")
+        # TODO: replace with SagemakerEndpointStreaming
+        model = SagemakerEndpoint(
+            client=client,
+            endpoint_name=endpoint_name,
+            # region_name = region_name,
+            content_handler=content_handler,
+            endpoint_kwargs=endpoint_kwargs,
+        )
+
+    with embeddings_lock:
+        return embeddings_map.setdefault(model_key, model)
+
+
+def get_bedrock_embeddings(
+    model_id: str, region_name: str, normalize: bool = False
+) -> BedrockEmbeddings:
+    """Get the cached BedrockEmbeddings backed by a shared bedrock-runtime client"""
+    model_key = ("bedrock", model_id, region_name, normalize)
+    with embeddings_lock:
+        if model_key in embeddings_map:
+            return embeddings_map[model_key]
+    embeddings = BedrockEmbeddings(
+        client=get_boto3_client("bedrock-runtime", region_name=region_name),
+        model_id=model_id,
+        region_name=region_name,
+        normalize=normalize,
+    )
+    with embeddings_lock:
+        return embeddings_map.setdefault(model_key, embeddings)
+
+
+def SagemakerEndpointVectorOrCross(
+    prompt: str,
+    endpoint_name: str,
+    region_name: str,
+    model_type: str,
+    stop: List[str],
+    target_model=None,
+    **kwargs,
+) -> SagemakerEndpoint:
+    """
+    original class invocation:
+        response = self.client.invoke_endpoint(
+            EndpointName=self.endpoint_name,
+            Body=body,
+            ContentType=content_type,
+            Accept=accepts,
+            **_endpoint_kwargs,
+        )
+    """
+    model = get_sagemaker_endpoint_model(
+        endpoint_name, region_name, model_type, target_model
     )
-    return genericModel(prompt=prompt, stop=stop, **kwargs)
+    if isinstance(model, SagemakerEndpointEmbeddings):
+        query_result = model.embed_query(prompt)
+        return query_result
+    return model(prompt=prompt, stop=stop, **kwargs)
 
 
 def getCustomEmbeddings(
     endpoint_name: str, region_name: str, bedrock_region: str, model_type: str
 ) -> SagemakerEndpointEmbeddings:
-    client = boto3.client("sagemaker-runtime", region_name=region_name)
-    bedrock_client = boto3.client("bedrock-runtime", region_name=bedrock_region)
+    client = get_boto3_client("sagemaker-runtime", region_name=region_name)
+    bedrock_client = get_boto3_client("bedrock-runtime", region_name=bedrock_region)
     embeddings = None
     if model_type == "bedrock":
         content_handler = BedrockEmbeddings()
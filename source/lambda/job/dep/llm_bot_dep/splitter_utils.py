@@ -1,7 +1,8 @@
+import hashlib
+import json
 import logging
 import re
 import traceback
-import uuid
 from typing import Any, List
 
 import boto3
@@ -157,27 +158,41 @@ def parse_string_to_xml_node(xml_string):
         return None
 
 
-def extract_headings(md_content: str):
+def get_id_prefix(*keys) -> str:
+    """Deterministic chunk id prefix, so splitting an unchanged document again
+    gives the same chunk ids and heading hierarchy"""
+    key_str = json.dumps(keys, ensure_ascii=False)
+    return hashlib.sha256(key_str.encode("utf-8")).hexdigest()[:8]
+
+
+def extract_headings(md_content: str, file_path: str = ""):
     """Extract heading hierarchy from Markdown content.
     Args:
         md_content (str): Markdown content.
+        file_path (str): Path of the file, part of the heading ids.
     Returns:
         Json object contains the heading hierarchy
     """
-    header_index = 0
     headers = {}
+    heading_paths = {}
+    # headings with the same path are numbered, instead of numbering all the
+    # headings of the file, so adding a heading does not change the ids of
+    # the headings after it
+    heading_path_count = {}
     lines = md_content.split("\n")
     id_index_dict = {}
     for line in lines:
         match = re.match(r"\s*(#+)(.*)", line)
         if match:
-            header_index += 1
             # print(match.group)
             level = len(match.group(1))
             title = match.group(2).strip()
-            id_prefix = str(uuid.uuid4())[:8]
-            _id = f"${header_index}-{id_prefix}"
             parent = find_parent(headers, level)
+            heading_path = heading_paths.get(parent, []) + [title]
+            id_prefix = get_id_prefix(file_path, heading_path)
+            heading_path_count[id_prefix] = heading_path_count.get(id_prefix, 0) + 1
+            _id = f"${heading_path_count[id_prefix]}-{id_prefix}"
+            heading_paths[_id] = heading_path
             previous = find_previous_with_same_level(headers, level)
             headers[_id] = {
                 "title": title,
@@ -252,7 +267,11 @@ class MarkdownHeaderTextSplitter:
                         same_heading_dict[current_heading]
                     ]
                 else:
-                    id_prefix = str(uuid.uuid4())[:8]
+                    id_prefix = get_id_prefix(
+                        metadata.get("file_path", ""),
+                        current_heading,
+                        same_heading_dict[current_heading],
+                    )
                     metadata["chunk_id"] = f"$0-{id_prefix}"
 
     def _get_current_heading_list(self, current_heading, current_heading_level_map):
@@ -292,7 +311,10 @@ class MarkdownHeaderTextSplitter:
         inside_figure = False
         have_figure = False
         figure_metadata = []
-        heading_hierarchy, id_index_dict = extract_headings(text.page_content.strip())
+        file_path = text.metadata.get("file_path", "")
+        heading_hierarchy, id_index_dict = extract_headings(
+            text.page_content.strip(), file_path
+        )
         if len(lines) > 0:
             current_heading = lines[0]
 
@@ -322,7 +344,9 @@ class MarkdownHeaderTextSplitter:
                         logger.info(
                             f"No standard heading found, check your document with {current_chunk_content}"
                         )
-                        id_prefix = str(uuid.uuid4())[:8]
+                        id_prefix = get_id_prefix(
+                            file_path, current_heading, current_chunk_content
+                        )
                         metadata["chunk_id"] = f"$0-{id_prefix}"
                     if metadata["chunk_id"] in heading_hierarchy:
                         metadata["heading_hierarchy"] = heading_hierarchy[
@@ -390,7 +414,9 @@ class MarkdownHeaderTextSplitter:
                 )
             except KeyError:
                 logger.info(f"No standard heading found")
-                id_prefix = str(uuid.uuid4())[:8]
+                id_prefix = get_id_prefix(
+                    file_path, current_heading, current_chunk_content
+                )
                 metadata["chunk_id"] = f"$0-{id_prefix}"
             if metadata["chunk_id"] in heading_hierarchy:
                 metadata["heading_hierarchy"] = heading_hierarchy[metadata["chunk_id"]]
@@ -2,9 +2,13 @@
 Helper functions for storage intermediate content or log
 """
 
+import atexit
 import datetime
 import json
 import logging
+import os
+import queue
+import threading
 from urllib.parse import urlparse
 from botocore.exceptions import ClientError
 
@@ -13,6 +17,21 @@ from langchain.docstore.document import Document
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# How chunk logs are saved to S3:
+#   object: one object per chunk
+#   jsonl: chunks are appended in the background into one JSONL object per
+#          (file, splitting type), see ChunkArtifactWriter
+#   off: chunk logs are not saved
+CHUNK_ARTIFACTS = os.environ.get("CHUNK_ARTIFACTS", "object")
+# a JSONL object is written once it reaches this size, or when the buffers
+# of all the files reach the max buffer size
+CHUNK_ARTIFACT_PART_BYTES = int(
+    os.environ.get("CHUNK_ARTIFACT_PART_BYTES", 8 * 1024 * 1024))
+CHUNK_ARTIFACT_MAX_BUFFER_BYTES = int(
+    os.environ.get("CHUNK_ARTIFACT_MAX_BUFFER_BYTES", 64 * 1024 * 1024))
+CHUNK_ARTIFACT_QUEUE_SIZE = int(
+    os.environ.get("CHUNK_ARTIFACT_QUEUE_SIZE", 10000))
+
 
 def convert_to_logger(document: Document) -> str:
     # TODO: Convert the document to a logger file format, customize if possible
@@ -60,6 +79,155 @@ def upload_chunk_to_s3(
         logger.error(f"Error uploading logger file to S3: {e}")
 
 
+def get_artifact_prefix(document: Document) -> str:
+    # Extract the filename from the file_path in the metadata
+    file_path = document.metadata.get("file_path", "")
+    # filename = file_path.split('/')[-1].split('.')[0]
+    return file_path.replace("s3://", "").replace("/", "-").replace(".", "-")
+
+
+class ChunkArtifactWriter:
+    """Append chunk logs into one JSONL object per (file, splitting type).
+
+    Chunks are queued and written by a background thread, so saving a chunk
+    does not wait for S3. The queue is bounded and blocks when full. Objects
+    are written once they reach `part_bytes`, when all the buffers reach
+    `max_buffer_bytes`, on `flush` and on `close`. Objects are stored with the
+    same hierarchy as `upload_chunk_to_s3`.
+
+    Each process gets its own thread and buffers. The writer is closed at
+    exit, but pool worker processes do not run exit handlers and must call
+    `flush` themselves.
+    """
+
+    def __init__(
+        self,
+        mode=CHUNK_ARTIFACTS,
+        part_bytes=CHUNK_ARTIFACT_PART_BYTES,
+        max_buffer_bytes=CHUNK_ARTIFACT_MAX_BUFFER_BYTES,
+        queue_size=CHUNK_ARTIFACT_QUEUE_SIZE,
+    ):
+        self.mode = mode
+        self.part_bytes = part_bytes
+        self.max_buffer_bytes = max_buffer_bytes
+        self.queue_size = queue_size
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # first use in this process, or in a forked child
+            self._pid = os.getpid()
+            self._run_id = f"{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S-%f')}-{self._pid}"
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._thread = threading.Thread(
+                target=self._run, name="chunk_artifact_writer", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.close)
+
+    def save(self, s3, document: Document, bucket: str, splitting_type: str):
+        if self.mode == "off":
+            return
+        prefix = get_artifact_prefix(document)
+        if self.mode == "object":
+            logger_file = convert_to_logger(document)
+            upload_chunk_to_s3(s3, logger_file, bucket, prefix, splitting_type)
+            return
+        self._ensure_started()
+        record = json.dumps(
+            {
+                "page_content": document.page_content,
+                "metadata": document.metadata,
+                "created_time": datetime.datetime.now().isoformat(),
+            },
+            ensure_ascii=False,
+            default=str,
+        )
+        self._queue.put(("append", (s3, bucket, prefix, splitting_type), record))
+
+    def flush(self, document_prefix: str = None):
+        """Write the buffered chunks, of one file or of all files, and wait"""
+        if self._pid != os.getpid():
+            return
+        done = threading.Event()
+        self._queue.put(("flush", document_prefix, done))
+        done.wait()
+
+    def close(self):
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._queue.put(("close", None, None))
+        self._thread.join()
+        self._pid = None
+
+    def _write(self, key, lines: list, part: int):
+        s3, bucket, prefix, splitting_type = key
+        # round the timestamp to hours to avoid too many folders
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d-%H")
+        object_key = f"{prefix}/{splitting_type}/{timestamp}/{self._run_id}-{part:04d}.jsonl"
+        try:
+            res = s3.put_object(
+                Bucket=bucket, Key=object_key, Body="\n".join(lines) + "\n"
+            )
+            logger.debug(f"Upload chunk logs to S3: {res}")
+        except Exception as e:
+            logger.error(f"Error uploading chunk logs to S3: {e}")
+
+    def _run(self):
+        # buffered lines and their size, by (s3, bucket, prefix, splitting type)
+        buffers = {}
+        parts = {}
+        buffered_bytes = 0
+
+        def write(key):
+            nonlocal buffered_bytes
+            lines, size = buffers.pop(key)
+            buffered_bytes -= size
+            parts[key] = parts.get(key, 0) + 1
+            self._write(key, lines, parts[key])
+
+        while True:
+            item_type, key, payload = self._queue.get()
+            if item_type == "append":
+                lines, size = buffers.get(key, ([], 0))
+                lines.append(payload)
+                record_size = len(payload.encode("utf-8"))
+                buffers[key] = (lines, size + record_size)
+                buffered_bytes += record_size
+                if buffers[key][1] >= self.part_bytes:
+                    write(key)
+                elif buffered_bytes >= self.max_buffer_bytes:
+                    for buffer_key in list(buffers):
+                        write(buffer_key)
+            elif item_type == "flush":
+                for buffer_key in list(buffers):
+                    if key is None or buffer_key[2] == key:
+                        write(buffer_key)
+                payload.set()
+            else:
+                for buffer_key in list(buffers):
+                    write(buffer_key)
+                return
+
+
+chunk_artifact_writer = ChunkArtifactWriter()
+
+
+def configure_chunk_artifacts(mode: str):
+    """Set how chunk logs are saved: object, jsonl or off"""
+    if mode not in ["object", "jsonl", "off"]:
+        raise ValueError(
+            f"Invalid chunk artifacts mode {mode}. Valid modes: object, jsonl, off")
+    chunk_artifact_writer.mode = mode
+
+
+def flush_chunk_artifacts(document_prefix: str = None):
+    chunk_artifact_writer.flush(document_prefix)
+
+
 def save_content_to_s3(s3, document: Document, res_bucket: str, splitting_type: str):
     """Save content to S3 bucket
 
@@ -68,13 +236,8 @@ def save_content_to_s3(s3, document: Document, res_bucket: str, splitting_type:
         res_bucket (str): Target S3 bucket
         s3 (_type_): S3 client
     """
-    logger_file = convert_to_logger(document)
-    # Extract the filename from the file_path in the metadata
-    file_path = document.metadata.get("file_path", "")
-    # filename = file_path.split('/')[-1].split('.')[0]
-    filename = file_path.replace("s3://", "").replace("/", "-").replace(".", "-")
     # RecursiveCharacterTextSplitter have been rewrite to split based on chunk size & overlap, use separate folder to store the logger file
-    upload_chunk_to_s3(s3, logger_file, res_bucket, filename, splitting_type)
+    chunk_artifact_writer.save(s3, document, res_bucket, splitting_type)
 
 
 def _s3_uri_exist(s3_client, s3_uri: str) -> bool:
@@ -1,22 +1,31 @@
+import collections
 import itertools
 import json
 import logging
+import multiprocessing
 import os
+import queue
 import sys
+import threading
 import traceback
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
 from typing import Generator, Iterable, List
+from urllib.parse import urlparse
 
 import boto3
 import chardet
+from boto3.dynamodb.conditions import Key
 import nltk
 from langchain.docstore.document import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import OpenSearchVectorSearch
 from langchain_community.vectorstores.opensearch_vector_search import (
     OpenSearchVectorSearch,
+    _default_text_mapping,
 )
 from opensearchpy import RequestsHttpConnection
+from opensearchpy.helpers import scan
 from requests_aws4auth import AWS4Auth
 from tenacity import retry, stop_after_attempt, wait_exponential
 
@@ -52,8 +61,16 @@ try:
             "OPERATION_TYPE",
             "PORTAL_BUCKET",
             "BEDROCK_REGION",
+            "SUPPORTED_FILE_TYPES",
         ],
     )
+    # Optional arguments
+    if "--CHUNK_ARTIFACTS" in sys.argv:
+        args.update(getResolvedOptions(sys.argv, ["CHUNK_ARTIFACTS"]))
+    if "--MANIFEST_S3_URI" in sys.argv:
+        args.update(getResolvedOptions(sys.argv, ["MANIFEST_S3_URI"]))
+    if "--INCREMENTAL_UPDATE" in sys.argv:
+        args.update(getResolvedOptions(sys.argv, ["INCREMENTAL_UPDATE"]))
 except Exception as e:
     logger.warning("Running locally")
     import argparse
@@ -73,6 +90,15 @@ except Exception as e:
     parser.add_argument("--embedding_model_type", type=str, required=True)
     parser.add_argument("--index_type", type=str, required=True)
     parser.add_argument("--operation_type", type=str, default="create")
+    parser.add_argument("--chunk_artifacts", type=str, default="jsonl")
+    parser.add_argument("--manifest_s3_uri", type=str, default="-")
+    parser.add_argument("--incremental_update", type=str, default="false")
+    parser.add_argument(
+        "--supported_file_types",
+        type=str,
+        required=True,
+        help="comma separated file types to ingest, e.g. pdf,docx,md",
+    )
     command_line_args = parser.parse_args()
     sys.path.append("dep")
     command_line_args_dict = vars(command_line_args)
@@ -91,7 +117,17 @@ except Exception as e:
 from llm_bot_dep import sm_utils
 from llm_bot_dep.constant import SplittingType
 from llm_bot_dep.loaders.auto import cb_process_object
-from llm_bot_dep.storage_utils import save_content_to_s3
+from llm_bot_dep.opensearch_vector_search import (
+    BULK_INDEX_SETTINGS,
+    BulkIngestionSession,
+    _bulk_ingest_embeddings,
+    get_chunk_id,
+)
+from llm_bot_dep.storage_utils import (
+    configure_chunk_artifacts,
+    flush_chunk_artifacts,
+    save_content_to_s3,
+)
 
 # Adaption to allow nougat to run in AWS Glue with writable /tmp
 os.environ["TRANSFORMERS_CACHE"] = "/tmp/transformers_cache"
@@ -105,6 +141,11 @@ if "BATCH_INDICE" not in args:
 aosEndpoint = args["AOS_ENDPOINT"]
 batchFileNumber = args["BATCH_FILE_NUMBER"]
 batchIndice = args["BATCH_INDICE"]
+# shard manifest written by the ETL lambda, "-" to list and slice the prefix
+manifest_s3_uri = args.get("MANIFEST_S3_URI", "-")
+# update only the changed files and chunks instead of deleting and
+# re-ingesting every file
+incremental_update = str(args.get("INCREMENTAL_UPDATE", "false")).lower() == "true"
 document_language = args["DOCUMENT_LANGUAGE"]
 embedding_model_endpoint = args["EMBEDDING_MODEL_ENDPOINT"]
 etlModelEndpoint = args["ETL_MODEL_ENDPOINT"]
@@ -125,7 +166,12 @@ chatbot_table = args["CHATBOT_TABLE"]
 index_type = args["INDEX_TYPE"]
 # Valid Operation types: "create", "delete", "update", "extract_only"
 operation_type = args["OPERATION_TYPE"]
+# file types of the index type, from the same list the ETL lambda shards by
+supported_file_types = args["SUPPORTED_FILE_TYPES"].split(",")
 aos_secret = args.get("AOS_SECRET_NAME", "opensearch-master-user")
+# chunk logs for debugging: jsonl (batched per file), object (per chunk) or off
+chunk_artifacts = args.get("CHUNK_ARTIFACTS", "jsonl")
+configure_chunk_artifacts(chunk_artifacts)
 
 
 s3_client = boto3.client("s3")
@@ -140,6 +186,23 @@ OBJECT_EXPIRY_TIME = 3600
 credentials = boto3.Session().get_credentials()
 MAX_OS_DOCS_PER_PUT = 8
 
+# Ingestion pipeline stages, fetch -> parse -> split -> embed -> index, each
+# with its own workers and a bounded input queue, so a slow stage throttles
+# the stages before it
+ETL_FETCH_WORKERS = int(os.environ.get("ETL_FETCH_WORKERS", 8))
+ETL_PARSE_WORKERS = int(os.environ.get("ETL_PARSE_WORKERS", os.cpu_count() or 1))
+# "process" parses in a process pool, "thread" in the parse stage threads
+ETL_PARSE_EXECUTOR = os.environ.get("ETL_PARSE_EXECUTOR", "process")
+ETL_SPLIT_WORKERS = int(os.environ.get("ETL_SPLIT_WORKERS", 4))
+ETL_EMBED_WORKERS = int(os.environ.get("ETL_EMBED_WORKERS", 4))
+ETL_INDEX_WORKERS = int(os.environ.get("ETL_INDEX_WORKERS", 2))
+ETL_STAGE_QUEUE_SIZE = int(os.environ.get("ETL_STAGE_QUEUE_SIZE", 16))
+# Drop the index replicas while loading, they are restored when the job ends,
+# or by the next job on the index if this one is killed
+ETL_BULK_DROP_REPLICAS = (
+    os.environ.get("ETL_BULK_DROP_REPLICAS", "true").lower() == "true"
+)
+
 nltk.data.path.append("/tmp/nltk_data")
 
 
@@ -281,7 +344,26 @@ class S3FileProcessor:
 
         return decoded_content
 
-    def iterate_s3_files(self, extract_content=True) -> Generator:
+    def get_file_etag(self, key: str):
+        response = s3_client.head_object(Bucket=self.bucket, Key=key)
+        return response["ETag"]
+
+    def list_manifest_objects(self) -> List[tuple]:
+        """Get the (key, etag) of this job's shard from the shard manifest"""
+        if not hasattr(self, "_manifest_objects"):
+            manifest_url = urlparse(manifest_s3_uri)
+            response = s3_client.get_object(
+                Bucket=manifest_url.netloc, Key=manifest_url.path.lstrip("/")
+            )
+            manifest = json.loads(response["Body"].read())
+            shard = manifest["shards"][int(batchIndice)]
+            self._manifest_objects = [
+                (file_info["key"], file_info.get("etag")) for file_info in shard
+            ]
+        return self._manifest_objects
+
+    def list_batch_objects(self) -> Generator:
+        """List the prefix and get the (key, etag) of this job's batch by index"""
         current_indice = 0
         for page in self.paginator.paginate(
             Bucket=self.bucket, Prefix=self.prefix
@@ -305,19 +387,31 @@ class S3FileProcessor:
                     # Exit this nested loop
                     break
                 else:
-                    logger.info("Processing object: %s", key)
                     current_indice += 1
-
-                    if extract_content:
-                        file_content = self.get_file_content(key)
-                        yield self.process_file(key, file_type, file_content)
-                    else:
-                        yield file_type, "", {"bucket": self.bucket, "key": key}
+                    yield key, obj.get("ETag")
 
             if current_indice >= (int(batchIndice) + 1) * int(batchFileNumber):
                 # Exit the outer loop
                 break
 
+    def iterate_s3_files(self, extract_content=True) -> Generator:
+        if manifest_s3_uri and manifest_s3_uri != "-":
+            objects = self.list_manifest_objects()
+        else:
+            objects = self.list_batch_objects()
+
+        for key, etag in objects:
+            file_type = key.split(".")[-1].lower()  # Extract file extension
+            if file_type not in self.supported_file_types:
+                continue
+            logger.info("Processing object: %s", key)
+
+            if extract_content:
+                file_content = self.get_file_content(key)
+                yield self.process_file(key, file_type, file_content)
+            else:
+                yield file_type, "", {"bucket": self.bucket, "key": key, "etag": etag}
+
 
 class BatchChunkDocumentProcessor:
     """
@@ -511,11 +605,15 @@ class OpenSearchIngestionWorker:
         self.docsearch = docsearch
         self.embedding_model_endpoint = embedding_model_endpoint
 
+    def aos_ingestion(self, documents: List[Document]) -> None:
+        texts, embeddings_vectors, metadatas = self.embed_documents(documents)
+        self.index_documents(texts, embeddings_vectors, metadatas)
+
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=4, max=10),
     )
-    def aos_ingestion(self, documents: List[Document]) -> None:
+    def embed_documents(self, documents: List[Document]):
         texts = [doc.page_content for doc in documents]
         metadatas = [doc.metadata for doc in documents]
         embeddings_vectors = self.docsearch.embedding_function.embed_documents(
@@ -535,17 +633,71 @@ class OpenSearchIngestionWorker:
                 metadata_list.append(metadata)
             embeddings_vectors = embeddings_vectors_list
             metadatas = metadata_list
-        self.docsearch._OpenSearchVectorSearch__add(
-            texts, embeddings_vectors, metadatas=metadatas
+        return texts, embeddings_vectors, metadatas
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+    )
+    def index_documents(
+        self, texts, embeddings_vectors, metadatas, ids=None, session=None
+    ) -> None:
+        if session is None:
+            self.docsearch._OpenSearchVectorSearch__add(
+                texts, embeddings_vectors, metadatas=metadatas, ids=ids
+            )
+            return
+        # the same mapping as OpenSearchVectorSearch, the index is created
+        # and refreshed once by the session
+        _bulk_ingest_embeddings(
+            self.docsearch.client,
+            self.docsearch.index_name,
+            embeddings_vectors,
+            texts,
+            metadatas=metadatas,
+            ids=ids,
+            mapping=_default_text_mapping(len(embeddings_vectors[0])),
+            is_aoss=self.docsearch.is_aoss,
+            session=session,
+        )
+
+    def create_session(self) -> BulkIngestionSession:
+        bulk_settings = dict(BULK_INDEX_SETTINGS)
+        if not ETL_BULK_DROP_REPLICAS:
+            bulk_settings.pop("number_of_replicas")
+        return BulkIngestionSession(
+            self.docsearch.client,
+            self.docsearch.index_name,
+            is_aoss=self.docsearch.is_aoss,
+            bulk_settings=bulk_settings,
         )
 
+    def get_chunk_ids(self, s3_path: str) -> set:
+        """Get the ids of the indexed chunks of a file"""
+        if not self.docsearch.client.indices.exists(
+            index=self.docsearch.index_name
+        ):
+            return set()
+        query = {
+            "query": {"term": {"metadata.file_path.keyword": s3_path}},
+            "_source": False,
+        }
+        return {
+            hit["_id"]
+            for hit in scan(
+                self.docsearch.client,
+                index=self.docsearch.index_name,
+                query=query,
+            )
+        }
+
 
 class OpenSearchDeleteWorker:
     def __init__(self, docsearch: OpenSearchVectorSearch):
         self.docsearch = docsearch
         self.index_name = self.docsearch.index_name
 
-    def aos_deletion(self, document_ids) -> None:
+    def aos_deletion(self, document_ids, refresh=True) -> None:
         bulk_delete_requests = []
 
         # Check if self.index_name exists
@@ -559,84 +711,398 @@ class OpenSearchDeleteWorker:
                 )
 
             self.docsearch.client.bulk(
-                index=self.index_name, body=bulk_delete_requests, refresh=True
+                index=self.index_name, body=bulk_delete_requests, refresh=refresh
             )
             logger.info("Deleted %d documents", len(document_ids))
             return
 
+    def refresh(self) -> None:
+        if self.docsearch.client.indices.exists(index=self.index_name):
+            self.docsearch.client.indices.refresh(index=self.index_name)
+
+
+class FileTask:
+    """
+    Tracks one file through the ingestion pipeline.
+
+    Every item of the file queued in or processed by a stage holds a
+    reference. When the last one is released, the status of the file is
+    written to the etl object table, FAILED if any stage failed for it.
+    """
+
+    def __init__(self, bucket: str, key: str, file_type: str, etag: str = None):
+        self.bucket = bucket
+        self.key = key
+        self.file_type = file_type
+        self.etag = etag
+        self.create_time = str(datetime.now(timezone.utc))
+        self.error = None
+        self.skipped = False
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self._pending += 1
+
+    def release(self):
+        with self._lock:
+            self._pending -= 1
+            finished = self._pending == 0
+        if finished:
+            self.report_status()
+
+    def fail(self, error: Exception):
+        if self.error is None:
+            self.error = error
+            logger.error(
+                "Error processing object %s: %s",
+                self.bucket + "/" + self.key,
+                error,
+            )
+
+    @property
+    def s3_path(self):
+        return f"s3://{self.bucket}/{self.key}"
+
+    def report_status(self):
+        input_body = {
+            "s3Path": self.s3_path,
+            "s3Bucket": self.bucket,
+            "s3Prefix": self.key,
+            "executionId": table_item_id,
+            "createTime": self.create_time,
+            "status": "SUCCEED",
+        }
+        if self.error is not None:
+            input_body["status"] = "FAILED"
+            input_body["detail"] = str(self.error)
+        elif self.etag is not None:
+            # the version of the file in the index, for incremental updates
+            input_body["etag"] = self.etag
+            input_body["indexId"] = aos_index_name
+            input_body["embeddingEndpoint"] = embedding_model_endpoint
+            if self.skipped:
+                input_body["detail"] = "Unchanged since the last ingestion"
+        etl_object_table.put_item(Item=input_body)
+
+
+def get_ingested_etag(s3_path: str):
+    """Get the ETag of the file last ingested into this index with this embedding model"""
+    ingested_items = []
+    query_kwargs = {"KeyConditionExpression": Key("s3Path").eq(s3_path)}
+    while True:
+        response = etl_object_table.query(**query_kwargs)
+        ingested_items += [
+            item
+            for item in response["Items"]
+            if item.get("status") == "SUCCEED"
+            and item.get("etag")
+            and item.get("indexId") == aos_index_name
+            and item.get("embeddingEndpoint") == embedding_model_endpoint
+        ]
+        if "LastEvaluatedKey" not in response:
+            break
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    if not ingested_items:
+        return None
+    return max(ingested_items, key=lambda item: item["createTime"])["etag"]
+
+
+class PipelineStage:
+    """
+    A pipeline stage run by a pool of threads.
+
+    Args:
+        name (str): The stage name, used for the thread names.
+        fn (callable): Called with (file_task, item), returns an iterable of
+            items for the next stage.
+        workers (int): The number of worker threads.
+        queue_size (int): The size of the input queue, `put` blocks when it is full.
+        next_stage (PipelineStage, optional): The stage receiving the outputs.
+    """
+
+    _close = object()
+
+    def __init__(self, name, fn, workers, queue_size, next_stage=None):
+        self.name = name
+        self.fn = fn
+        self.next_stage = next_stage
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = [
+            threading.Thread(
+                target=self._run, name=f"{name}_{i}", daemon=True
+            )
+            for i in range(max(workers, 1))
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def put(self, file_task: FileTask, item):
+        file_task.acquire()
+        self._queue.put((file_task, item))
+
+    def close(self):
+        """Wait for the queued items to be processed, then close the next stage"""
+        for _ in self._threads:
+            self._queue.put(self._close)
+        for thread in self._threads:
+            thread.join()
+        if self.next_stage is not None:
+            self.next_stage.close()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is self._close:
+                return
+            file_task, item = task
+            try:
+                # skip the rest of a file once a stage failed for it
+                if file_task.error is None:
+                    for output in self.fn(file_task, item) or []:
+                        if self.next_stage is not None:
+                            self.next_stage.put(file_task, output)
+            except Exception as e:
+                file_task.fail(e)
+                traceback.print_exc()
+            finally:
+                file_task.release()
+
+
+def _init_parse_process():
+    """Give each parse process its own clients"""
+    global s3_client, smr_client
+    s3_client = boto3.client("s3")
+    smr_client = boto3.client("sagemaker-runtime")
+
+
+def parse_object(file_type: str, file_content, kwargs: dict) -> List[Document]:
+    kwargs = {**kwargs, "smr_client": smr_client}
+    try:
+        return list(cb_process_object(s3_client, file_type, file_content, **kwargs))
+    finally:
+        # parse processes exit without running exit handlers
+        if multiprocessing.parent_process() is not None:
+            flush_chunk_artifacts()
+
 
 def ingestion_pipeline(
     s3_files_iterator,
     batch_chunk_processor,
     ingestion_worker,
     extract_only=False,
+    file_processor=None,
+    incremental=False,
 ):
-    for file_type, file_content, kwargs in s3_files_iterator:
-        input_body = {
-            "s3Path": f"s3://{kwargs['bucket']}/{kwargs['key']}",
-            "s3Bucket": kwargs["bucket"],
-            "s3Prefix": kwargs["key"],
-            "executionId": table_item_id,
-            "createTime": kwargs["create_time"],
-            "status": "SUCCEED",
-        }
-        try:
-            # The res is list[Document] type
-            res = cb_process_object(
-                s3_client, file_type, file_content, **kwargs
+    """
+    Ingest files through the staged pipeline.
+
+    Args:
+        s3_files_iterator: Yields (file_type, _, {"bucket", "key"}) for the files to ingest.
+        batch_chunk_processor (BatchChunkDocumentProcessor): Splits parsed documents into batches of chunks.
+        ingestion_worker (OpenSearchIngestionWorker): Embeds and indexes the batches.
+        extract_only (bool, optional): Stop after the chunks are saved to S3. Defaults to False.
+        file_processor (S3FileProcessor): Fetches the files.
+        incremental (bool, optional): Skip the files unchanged since their last
+            ingestion, embed only the new chunks of the changed files and
+            delete their vanished chunks. Defaults to False.
+    """
+    delete_worker = None
+    if incremental:
+        delete_worker = OpenSearchDeleteWorker(ingestion_worker.docsearch)
+    # one bulk load session for the whole job, instead of checking the index
+    # and refreshing it for every batch
+    session = None
+    if not extract_only:
+        session = ingestion_worker.create_session()
+
+    parse_executor = None
+    if ETL_PARSE_EXECUTOR == "process":
+        # the pool starts its processes on demand, after the pipeline threads
+        # are running, so they are forked from a single-threaded forkserver
+        # instead of from this process
+        parse_executor = ProcessPoolExecutor(
+            max_workers=ETL_PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_init_parse_process,
+        )
+
+    def fetch(file_task: FileTask, _):
+        if incremental:
+            if file_task.etag is None:
+                file_task.etag = file_processor.get_file_etag(file_task.key)
+            if file_task.etag == get_ingested_etag(file_task.s3_path):
+                logger.info("Skipping unchanged object: %s", file_task.s3_path)
+                file_task.skipped = True
+                return []
+        file_content = file_processor.get_file_content(file_task.key)
+        processed = file_processor.process_file(
+            file_task.key, file_task.file_type, file_content
+        )
+        if processed is None:
+            # unknown file type, already reported as FAILED
+            file_task.fail(ValueError(f"Unknown file type: {file_task.file_type}"))
+            return []
+        file_type, file_content, kwargs = processed
+        file_task.create_time = kwargs["create_time"]
+        return [(file_type, file_content, kwargs)]
+
+    def parse(file_task: FileTask, item):
+        file_type, file_content, kwargs = item
+        if parse_executor is None:
+            res = cb_process_object(s3_client, file_type, file_content, **kwargs)
+        else:
+            # clients can not be sent to the parse processes
+            kwargs = {k: v for k, v in kwargs.items() if k != "smr_client"}
+            res = parse_executor.submit(
+                parse_object, file_type, file_content, kwargs
+            ).result()
+        return [(file_type, res)]
+
+    def split(file_task: FileTask, item):
+        file_type, res = item
+        for document in res:
+            save_content_to_s3(
+                s3_client,
+                document,
+                res_bucket,
+                SplittingType.SEMANTIC.value,
             )
-            for document in res:
+
+        gen_chunk_flag = False if file_type in ["csv", "xlsx", "xls"] else True
+        batches = batch_chunk_processor.batch_generator(res, gen_chunk_flag)
+
+        new_chunks = []
+        # identical chunks of the file get their own ids instead of being
+        # merged into one document
+        occurrences = collections.Counter()
+        for batch in batches:
+            if len(batch) == 0:
+                continue
+
+            for document in batch:
+                if "complete_heading" in document.metadata:
+                    document.page_content = (
+                        document.metadata["complete_heading"]
+                        + " "
+                        + document.page_content
+                    )
+
                 save_content_to_s3(
                     s3_client,
                     document,
                     res_bucket,
-                    SplittingType.SEMANTIC.value,
+                    SplittingType.CHUNK.value,
                 )
 
-            gen_chunk_flag = False if file_type in ["csv", "xlsx", "xls"] else True
-            batches = batch_chunk_processor.batch_generator(res, gen_chunk_flag)
+            if extract_only:
+                continue
+            ids = []
+            for document in batch:
+                chunk_key = get_chunk_id(
+                    file_task.s3_path,
+                    document.page_content,
+                    embedding_model_endpoint,
+                    document.metadata,
+                )
+                ids.append(
+                    get_chunk_id(
+                        file_task.s3_path,
+                        document.page_content,
+                        embedding_model_endpoint,
+                        document.metadata,
+                        occurrences[chunk_key],
+                    )
+                )
+                occurrences[chunk_key] += 1
+            if incremental:
+                new_chunks += zip(ids, batch)
+            else:
+                yield batch, ids
+
+        if incremental:
+            yield from get_changed_batches(file_task, new_chunks)
+
+    def get_changed_batches(file_task: FileTask, chunks):
+        """Delete the vanished chunks of a file and batch its new chunks"""
+        indexed_ids = ingestion_worker.get_chunk_ids(file_task.s3_path)
+        vanished_ids = list(indexed_ids - {chunk_id for chunk_id, _ in chunks})
+        for i in range(0, len(vanished_ids), batch_chunk_processor.batch_size):
+            delete_worker.aos_deletion(
+                vanished_ids[i : i + batch_chunk_processor.batch_size],
+                refresh=False,
+            )
+        new_chunks = [
+            (chunk_id, document)
+            for chunk_id, document in chunks
+            if chunk_id not in indexed_ids
+        ]
+        logger.info(
+            "Object %s: %d new chunks, %d unchanged, %d deleted",
+            file_task.s3_path,
+            len(new_chunks),
+            len(chunks) - len(new_chunks),
+            len(vanished_ids),
+        )
+        for i in range(0, len(new_chunks), batch_chunk_processor.batch_size):
+            ids, batch = zip(*new_chunks[i : i + batch_chunk_processor.batch_size])
+            yield list(batch), list(ids)
 
-            for batch in batches:
-                if len(batch) == 0:
-                    continue
+    def embed(file_task: FileTask, item):
+        batch, ids = item
+        return [(*ingestion_worker.embed_documents(batch), ids)]
 
-                for document in batch:
-                    if "complete_heading" in document.metadata:
-                        document.page_content = (
-                            document.metadata["complete_heading"]
-                            + " "
-                            + document.page_content
-                        )
-                    else:
-                        document.page_content = document.page_content
-
-                    save_content_to_s3(
-                        s3_client,
-                        document,
-                        res_bucket,
-                        SplittingType.CHUNK.value,
-                    )
+    def index(file_task: FileTask, item):
+        ingestion_worker.index_documents(*item, session=session)
 
-                if not extract_only:
-                    ingestion_worker.aos_ingestion(batch)
-        except Exception as e:
-            logger.error(
-                "Error processing object %s: %s",
-                kwargs["bucket"] + "/" + kwargs["key"],
-                e,
+    queue_size = ETL_STAGE_QUEUE_SIZE
+    index_stage = PipelineStage("index", index, ETL_INDEX_WORKERS, queue_size)
+    embed_stage = PipelineStage(
+        "embed", embed, ETL_EMBED_WORKERS, queue_size, index_stage
+    )
+    split_stage = PipelineStage(
+        "split", split, ETL_SPLIT_WORKERS, queue_size,
+        None if extract_only else embed_stage,
+    )
+    parse_stage = PipelineStage(
+        "parse", parse, ETL_PARSE_WORKERS, queue_size, split_stage
+    )
+    fetch_stage = PipelineStage(
+        "fetch", fetch, ETL_FETCH_WORKERS, queue_size, parse_stage
+    )
+    stages = [fetch_stage, parse_stage, split_stage]
+    if not extract_only:
+        stages += [embed_stage, index_stage]
+    for stage in stages:
+        stage.start()
+
+    try:
+        for file_type, _, kwargs in s3_files_iterator:
+            file_task = FileTask(
+                kwargs["bucket"], kwargs["key"], file_type, kwargs.get("etag")
             )
-            input_body = {
-                "s3Path": f"s3://{kwargs['bucket']}/{kwargs['key']}",
-                "s3Bucket": kwargs["bucket"],
-                "s3Prefix": kwargs["key"],
-                "executionId": table_item_id,
-                "createTime": kwargs["create_time"],
-                "status": "FAILED",
-                "detail": str(e),
-            }
-            traceback.print_exc()
-        finally:
-            etl_object_table.put_item(Item=input_body)
+            # the listing holds a reference until the file is queued
+            file_task.acquire()
+            try:
+                fetch_stage.put(file_task, None)
+            finally:
+                file_task.release()
+    finally:
+        fetch_stage.close()
+        if parse_executor is not None:
+            parse_executor.shutdown()
+        if session is not None:
+            session.close()
+            logger.info(
+                "Indexed %d chunks, %d failed",
+                session.indexed_count,
+                len(session.errors),
+            )
+        flush_chunk_artifacts()
 
 
 def delete_pipeline(s3_files_iterator, document_generator, delete_worker):
@@ -648,7 +1114,7 @@ def delete_pipeline(s3_files_iterator, document_generator, delete_worker):
             for batch in batches:
                 if len(batch) == 0:
                     continue
-                delete_worker.aos_deletion(batch)
+                delete_worker.aos_deletion(batch, refresh=False)
 
         except Exception as e:
             logger.error(
@@ -657,6 +1123,8 @@ def delete_pipeline(s3_files_iterator, document_generator, delete_worker):
                 e,
             )
             traceback.print_exc()
+    # refresh once, instead of after every batch of deletions
+    delete_worker.refresh()
 
 
 def create_processors_and_workers(
@@ -679,8 +1147,9 @@ def create_processors_and_workers(
     """
 
     if operation_type in ["create", "extract_only"]:
+        # the files are fetched by the ingestion pipeline
         s3_files_iterator = file_processor.iterate_s3_files(
-            extract_content=True
+            extract_content=False
         )
         batch_processor = BatchChunkDocumentProcessor(
             chunk_size=1024, chunk_overlap=30, batch_size=10
@@ -707,26 +1176,6 @@ def main():
         "Running in offline mode with consideration for large file size..."
     )
 
-    if index_type == "qq" or index_type == "intention":
-        supported_file_types = ["jsonl", "xlsx", "xls"]
-    else:
-        # Default is qd
-        supported_file_types = [
-            "pdf",
-            "txt",
-            "docx",
-            "xlsx",
-            "xls",
-            "md",
-            "html",
-            "json",
-            "csv",
-            "png",
-            "jpeg",
-            "jpg",
-            "webp",
-        ]
-
     file_processor = S3FileProcessor(s3_bucket, s3_prefix, supported_file_types)
 
     if operation_type == "extract_only":
@@ -754,13 +1203,27 @@ def main():
     )
 
     if operation_type == "create":
-        ingestion_pipeline(s3_files_iterator, batch_processor, worker)
+        ingestion_pipeline(
+            s3_files_iterator, batch_processor, worker,
+            file_processor=file_processor,
+        )
     elif operation_type == "extract_only":
         ingestion_pipeline(
-            s3_files_iterator, batch_processor, worker, extract_only=True
+            s3_files_iterator, batch_processor, worker, extract_only=True,
+            file_processor=file_processor,
         )
     elif operation_type == "delete":
         delete_pipeline(s3_files_iterator, batch_processor, worker)
+    elif operation_type == "update" and incremental_update:
+        s3_files_iterator, batch_processor, worker = (
+            create_processors_and_workers(
+                "create", docsearch, embedding_model_endpoint, file_processor
+            )
+        )
+        ingestion_pipeline(
+            s3_files_iterator, batch_processor, worker,
+            file_processor=file_processor, incremental=True,
+        )
     elif operation_type == "update":
         # Delete the documents first
         delete_pipeline(s3_files_iterator, batch_processor, worker)
@@ -771,7 +1234,10 @@ def main():
                 "create", docsearch, embedding_model_endpoint, file_processor
             )
         )
-        ingestion_pipeline(s3_files_iterator, batch_processor, worker)
+        ingestion_pipeline(
+            s3_files_iterator, batch_processor, worker,
+            file_processor=file_processor,
+        )
     else:
         raise ValueError(
             "Invalid operation type. Valid types: create, delete, update, extract_only"
@@ -15,6 +15,7 @@ from opensearchpy import RequestsHttpConnection
 
 sys.path.append("../dep")
 from llm_bot_dep import storage_utils
+from llm_bot_dep.opensearch_vector_search import BulkIngestionSession
 
 storage_utils.save_content_to_s3 = lambda *args: None
 aos_injection_mp_worker_num = 16
@@ -92,18 +93,30 @@ def process_run(process_id, task_queue):
     global embedding_size
     gen = batch_generator(task_queue_gen(task_queue))
     should_start = True
+    session = None
     for batch_data in gen:
         if should_start:
             next(batch_data)
             should_start = False
+            # one bulk load session per process, the index is not checked
+            # and refreshed for every batch
+            session = BulkIngestionSession(
+                opensearch_obj.client,
+                opensearch_obj.index_name,
+                is_aoss=opensearch_obj.is_aoss,
+            )
 
         local_ingestion_multithread.bulk_add(
             opensearch_obj,
             batch_data,
             max_chunk_bytes=1 * 1024 * 1024,
             embedding_size=embedding_size,
+            session=session,
         )
 
+    if session is not None:
+        session.close()
+
     print(f"process: {process_id} finished")
 
 
@@ -111,6 +111,8 @@ def __bulk_add(
     m = kwargs.get("m", 16)
     vector_field = kwargs.get("vector_field", "vector_field")
     max_chunk_bytes = kwargs.get("max_chunk_bytes", 1 * 1024 * 1024)
+    # bulk load session ensuring and refreshing the index once
+    session = kwargs.get("session")
 
     _validate_aoss_with_engines(self.is_aoss, engine)
 
@@ -127,11 +129,14 @@ def __bulk_add(
     return_ids = []
     mapping = mapping
 
-    with index_create_lock:
-        try:
-            self.client.indices.get(index=index_name)
-        except not_found_error:
-            self.client.indices.create(index=index_name, body=mapping)
+    if session is not None:
+        session.ensure_index(mapping)
+    else:
+        with index_create_lock:
+            try:
+                self.client.indices.get(index=index_name)
+            except not_found_error:
+                self.client.indices.create(index=index_name, body=mapping)
 
     def request_generator():
         for i, datum in enumerate(data):
@@ -156,6 +161,14 @@ def __bulk_add(
             return_ids.append(_id)
             yield request
 
+    if session is not None:
+        # failed documents are retried and collected by the session, do not
+        # retry the whole batch
+        errors = session.ingest(list(request_generator()))
+        if errors:
+            logger.error(f"{len(errors)} documents failed to be indexed: {errors[0]}")
+        return return_ids
+
     bulk(
         self.client,
         request_generator(),
@@ -6,6 +6,7 @@ from dotenv import load_dotenv
 sys.path.append('../online')
 sys.path.append('../etl')
 import sfn_handler
+from constant import SUPPORTED_FILE_TYPES
 from common_logic.common_utils import s3_utils
 
 try:
@@ -65,6 +66,7 @@ for s3_prefix, workspace_id, index_type, local_file, op_type in zip(s3_prefix_li
         command = f"""python3 glue-job-script.py --batch_indice {i} --batch_file_number {batch_file_number} \
             --s3_prefix {s3_prefix} --s3_bucket {s3_bucket} \
             --index_type {index_type} --embedding_model_endpoint {embedding_model_endpoint} \
+            --supported_file_types {",".join(SUPPORTED_FILE_TYPES[index_type])} \
             --operation_type={op_type} --chatbot_id={chatbot_id} --index_id {index_id} --embedding_model_type bce"""
         print(command)
         os.system(command)
\ No newline at end of file
@@ -19,6 +19,7 @@ except:
 from common_logic.common_utils import s3_utils
 import boto3
 import sfn_handler
+from constant import SUPPORTED_FILE_TYPES
 # run multiple process ingestion
 
 dynamodb = boto3.resource("dynamodb")
@@ -112,6 +113,7 @@ for file in files:
         command = f"""{sys.executable} glue-job-script.py --batch_indice {i} --batch_file_number {batch_file_number} \
             --s3_prefix "{s3_prefix}" --s3_bucket {s3_bucket} \
             --index_type {index_type} --embedding_model_endpoint {embedding_model_endpoint} \
+            --supported_file_types {",".join(SUPPORTED_FILE_TYPES[index_type])} \
             --operation_type={op_type} --chatbot_id={chatbot_id} --index_id {index_id} --embedding_model_type {embedding_model_type}"""
         print(command)
         os.system(command)
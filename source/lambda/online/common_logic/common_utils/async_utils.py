@@ -0,0 +1,55 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+ASYNC_MAX_WORKERS = int(os.environ.get("ASYNC_MAX_WORKERS", 32))
+
+# Bounded executor for the blocking calls (OpenSearch, SageMaker, Bedrock)
+# made by the retrieval and rerank pipeline, shared by the whole container
+executor = ThreadPoolExecutor(
+    max_workers=ASYNC_MAX_WORKERS, thread_name_prefix="async_utils"
+)
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """Get the long-lived event loop, running in a daemon thread"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(executor)
+            threading.Thread(
+                target=loop.run_forever, name="async_utils_loop", daemon=True
+            ).start()
+            _loop = loop
+        return _loop
+
+
+async def run_in_executor(func, *args, **kwargs):
+    """Run a blocking function in the shared executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+
+def run_coroutine_sync(coro):
+    """Run a coroutine to completion from sync code.
+
+    Unlike asyncio.run, no event loop is created per call, and it also works
+    when the caller is already running inside an event loop.
+    """
+    loop = get_event_loop()
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        coro.close()
+        raise RuntimeError(
+            "run_coroutine_sync cannot be called from the shared event loop, await the coroutine instead"
+        )
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
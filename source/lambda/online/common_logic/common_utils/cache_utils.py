@@ -0,0 +1,118 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def get_hash_key(*parts) -> str:
+    """Stable cache key for json serializable parts.
+
+    Raises TypeError when a part can not be serialized, e.g. a live object.
+    """
+    parts_str = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(parts_str.encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    """Thread-safe in-memory cache whose entries expire after `ttl` seconds.
+
+    Lives as long as the lambda container, so it is shared by all the
+    invocations served by a warm container.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expire_at, value = item
+            if expire_at < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_if(self, predicate):
+        """Drop every entry whose key matches the predicate"""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class LRUCache:
+    """Thread-safe in-memory cache holding at most `maxsize` entries.
+
+    The least recently used entry is evicted first. Hits and misses are
+    counted so the cache efficiency can be logged.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
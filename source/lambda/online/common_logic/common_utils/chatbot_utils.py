@@ -1,3 +1,4 @@
+import copy
 import logging
 import os
 from datetime import datetime
@@ -5,14 +6,59 @@ from typing import List
 
 import boto3
 
+from .cache_utils import TTLCache
 from .chatbot import Chatbot
 
 
+# Chatbot items are cached per container, keyed by (chatbot table, group name, chatbot id)
+CHATBOT_CACHE_TTL = float(os.environ.get("CHATBOT_CACHE_TTL", 300))
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_ITEM_LIMIT = 100
+# per group item of the chatbot table holding the version bumped by every
+# chatbot, index and embedding model write of the chatbot management API
+CHATBOT_VERSION_ID = "__version__"
+# the version read is reused for this many seconds, so that the chatbot
+# lookups of one request read it once
+CHATBOT_VERSION_CHECK_INTERVAL = float(
+    os.environ.get("CHATBOT_VERSION_CHECK_INTERVAL", 1))
+
+chatbot_cache = TTLCache(ttl=CHATBOT_CACHE_TTL)
+# (chatbot table, group name) -> version read from the chatbot table
+chatbot_version_cache = TTLCache(ttl=CHATBOT_VERSION_CHECK_INTERVAL)
+# (chatbot table, group name) -> version of the cached chatbots
+chatbot_versions = {}
+
+
+def batch_get_items(dynamodb, table, keys: List[dict]):
+    """Get items from one table with BatchGetItem, retrying unprocessed keys
+
+    Args:
+        dynamodb: boto3 dynamodb resource
+        table: boto3 dynamodb Table
+        keys (List[dict]): primary keys of the items, duplicates are allowed
+
+    Returns:
+        List of the items found
+    """
+    unique_keys = list({tuple(sorted(key.items())): key for key in keys}.values())
+    items = []
+    for i in range(0, len(unique_keys), BATCH_GET_ITEM_LIMIT):
+        request_items = {
+            table.name: {"Keys": unique_keys[i: i + BATCH_GET_ITEM_LIMIT]}
+        }
+        while request_items:
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            items.extend(response.get("Responses", {}).get(table.name, []))
+            request_items = response.get("UnprocessedKeys")
+    return items
+
+
 class ChatbotManager:
-    def __init__(self, chatbot_table, index_table, model_table):
+    def __init__(self, chatbot_table, index_table, model_table, dynamodb=None):
         self.chatbot_table = chatbot_table
         self.index_table = index_table
         self.model_table = model_table
+        self.dynamodb = dynamodb or boto3.resource("dynamodb")
 
     @classmethod
     def from_environ(cls):
@@ -23,40 +69,119 @@ class ChatbotManager:
         chatbot_table = dynamodb.Table(chatbot_table_name)
         model_table = dynamodb.Table(model_table_name)
         index_table = dynamodb.Table(index_table_name)
-        chatbot_manager = cls(chatbot_table, index_table, model_table)
+        chatbot_manager = cls(chatbot_table, index_table, model_table, dynamodb)
         return chatbot_manager
 
-    def get_chatbot(self, group_name: str, chatbot_id: str):
-        """Get chatbot from chatbot id and add index, model, etc. data
+    def _cache_key(self, group_name: str, chatbot_id: str):
+        return (self.chatbot_table.name, group_name, chatbot_id)
+
+    def invalidate_chatbot(self, group_name: str = None, chatbot_id: str = None):
+        """Drop cached chatbots, all of them when no group name is given
 
         Args:
             group_name (str): group name
-            chatbot_id (str): chatbot id
-
-        Returns:
-            Chatbot instance
+            chatbot_id (str): chatbot id, all chatbots of the group when omitted
         """
+        if group_name is None:
+            chatbot_cache.clear()
+        elif chatbot_id is None:
+            chatbot_cache.invalidate_if(lambda key: key[1] == group_name)
+        else:
+            chatbot_cache.invalidate(self._cache_key(group_name, chatbot_id))
+
+    def get_chatbot_version(self, group_name: str):
+        version_key = (self.chatbot_table.name, group_name)
+        version = chatbot_version_cache.get(version_key)
+        if version is None:
+            response = self.chatbot_table.get_item(
+                Key={"groupName": group_name, "chatbotId": CHATBOT_VERSION_ID},
+                ConsistentRead=True,
+            )
+            version = int(response.get("Item", {}).get("Version", 0))
+            chatbot_version_cache.set(version_key, version)
+        return version
+
+    def _check_chatbot_version(self, group_name: str):
+        """Drop the cached chatbots of a group changed by the management API"""
+        version_key = (self.chatbot_table.name, group_name)
+        version = self.get_chatbot_version(group_name)
+        if chatbot_versions.get(version_key) != version:
+            self.invalidate_chatbot(group_name)
+            chatbot_versions[version_key] = version
+
+    def _load_chatbot_content(self, group_name: str, chatbot_id: str):
         chatbot_response = self.chatbot_table.get_item(
             Key={"groupName": group_name, "chatbotId": chatbot_id}
         )
         chatbot_content = chatbot_response.get("Item")
         if not chatbot_content:
-            return Chatbot.from_dynamodb_item({})
+            return None
+
+        index_ids = [
+            index_id
+            for index_item in chatbot_content.get("indexIds").values()
+            for index_id in index_item.get("value").values()
+        ]
+        index_contents = {
+            item["indexId"]: item
+            for item in batch_get_items(
+                self.dynamodb,
+                self.index_table,
+                [{"groupName": group_name, "indexId": index_id}
+                    for index_id in index_ids],
+            )
+        }
+        embedding_model_ids = [
+            index_content.get("modelIds").get("embedding")
+            for index_content in index_contents.values()
+            if index_content.get("modelIds").get("embedding")
+        ]
+        model_contents = {
+            item["modelId"]: item
+            for item in batch_get_items(
+                self.dynamodb,
+                self.model_table,
+                [{"groupName": group_name, "modelId": model_id}
+                    for model_id in embedding_model_ids],
+            )
+        }
+
         for index_type, index_item in chatbot_content.get("indexIds").items():
             for tag, index_id in index_item.get("value").items():
-                index_content = self.index_table.get_item(
-                    Key={"groupName": group_name, "indexId": index_id}
-                ).get("Item")
+                index_content = copy.deepcopy(index_contents.get(index_id))
                 embedding_model_id = index_content.get(
                     "modelIds").get("embedding")
                 if embedding_model_id:
-                    model_content = self.model_table.get_item(
-                        Key={"groupName": group_name,
-                             "modelId": embedding_model_id}
-                    ).get("Item")
-                    index_content["modelIds"]["embedding"] = model_content
+                    index_content["modelIds"]["embedding"] = copy.deepcopy(
+                        model_contents.get(embedding_model_id)
+                    )
                 chatbot_content["indexIds"][index_type]["value"][tag] = index_content
+        return chatbot_content
+
+    def get_chatbot(self, group_name: str, chatbot_id: str):
+        """Get chatbot from chatbot id and add index, model, etc. data
+
+        Chatbots are cached in the container for CHATBOT_CACHE_TTL seconds,
+        and reloaded when the chatbot version of the group changes. Call
+        invalidate_chatbot to force a reload.
+
+        Args:
+            group_name (str): group name
+            chatbot_id (str): chatbot id
+
+        Returns:
+            Chatbot instance
+        """
+        self._check_chatbot_version(group_name)
+        cache_key = self._cache_key(group_name, chatbot_id)
+        chatbot_content = chatbot_cache.get(cache_key)
+        if chatbot_content is None:
+            chatbot_content = self._load_chatbot_content(group_name, chatbot_id)
+            if not chatbot_content:
+                return Chatbot.from_dynamodb_item({})
+            chatbot_cache.set(cache_key, chatbot_content)
 
-        chatbot = Chatbot.from_dynamodb_item(chatbot_content)
+        # callers may modify the chatbot, keep the cached item untouched
+        chatbot = Chatbot.from_dynamodb_item(copy.deepcopy(chatbot_content))
 
         return chatbot
@@ -1,16 +1,36 @@
 import json
 import math
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List
 
 import boto3
+from boto3.dynamodb.types import TypeSerializer
 from botocore.exceptions import ClientError
 from langchain.schema import BaseChatMessageHistory
 from langchain.schema.messages import BaseMessage
 from common_logic.common_utils.chatbot_utils import ChatbotManager
+from common_logic.common_utils.logger_utils import get_logger
 from .constant import MessageType, IndexType, INDEX_DESC
 
+logger = get_logger("ddb_utils")
 client = boto3.resource("dynamodb")
+type_serializer = TypeSerializer()
+
+# a round is a question and its answer
+MESSAGES_PER_ROUND = 2
+HISTORY_MESSAGE_ATTRIBUTES = [
+    "messageId",
+    "role",
+    "content",
+    "createTimestamp",
+    "entryType",
+    "customMessageId",
+    "additional_kwargs",
+]
+
+
+def to_iso_timestamp(dt: datetime):
+    return dt.isoformat() + "Z"
 
 
 class DynamoDBChatMessageHistory(BaseChatMessageHistory):
@@ -32,6 +52,7 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
         self.group_name = group_name
         self.chatbot_id = chatbot_id
         self.MESSAGE_BY_SESSION_ID_INDEX_NAME = "bySessionId"
+        self.MESSAGE_BY_SESSION_ID_CREATE_TIME_INDEX_NAME = "bySessionIdCreateTime"
 
     @property
     def session(self):
@@ -44,11 +65,9 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
     @property
     def messages(self):
         """Retrieve the messages from DynamoDB"""
-        response = {}
+        items = []
         try:
-            response = self.messages_table.query(
-                KeyConditionExpression="sessionId = :session_id",
-                ExpressionAttributeValues={":session_id": self.session_id},
+            items = self._query_session_messages(
                 IndexName=self.MESSAGE_BY_SESSION_ID_INDEX_NAME,
             )
         except ClientError as error:
@@ -56,28 +75,78 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
                 print("No record found for session id: %s", self.session_id)
             else:
                 print(error)
-
-        items = response.get("Items", [])
         items = sorted(items, key=lambda x: x["createTimestamp"])
 
         return items
 
     @property
     def messages_as_langchain(self):
-        response = {}
+        return self.get_messages_as_langchain()
+
+    def _query_session_messages(self, limit=None, **query_kwargs):
+        """Query the messages of the session, following LastEvaluatedKey.
+
+        With limit, stop once that many items are loaded.
+        """
+        items = []
+        query_kwargs = {
+            "KeyConditionExpression": "sessionId = :session_id",
+            "ExpressionAttributeValues": {":session_id": self.session_id},
+            **query_kwargs,
+        }
+        while limit is None or len(items) < limit:
+            if limit is not None:
+                query_kwargs["Limit"] = limit - len(items)
+            response = self.messages_table.query(**query_kwargs)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                break
+            query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        return items
+
+    def load_recent_messages(self, max_messages=None):
+        """Load the newest messages of the session, oldest first.
+
+        The newest max_messages are read newest first from the index sorted
+        by createTimestamp, with only the attributes used by the chat history.
+        Tables deployed without that index fall back to loading the whole
+        session.
+        """
+        if max_messages is None:
+            return self.messages
+        if max_messages <= 0:
+            return []
         try:
-            response = self.messages_table.query(
-                KeyConditionExpression="sessionId = :session_id",
-                ExpressionAttributeValues={":session_id": self.session_id},
-                IndexName=self.MESSAGE_BY_SESSION_ID_INDEX_NAME,
+            items = self._query_session_messages(
+                limit=max_messages,
+                IndexName=self.MESSAGE_BY_SESSION_ID_CREATE_TIME_INDEX_NAME,
+                ExpressionAttributeNames={
+                    f"#{name}": name for name in HISTORY_MESSAGE_ATTRIBUTES
+                },
+                ProjectionExpression=", ".join(
+                    f"#{name}" for name in HISTORY_MESSAGE_ATTRIBUTES
+                ),
+                ScanIndexForward=False,
             )
         except ClientError as error:
-            if error.response["Error"]["Code"] == "ResourceNotFoundException":
-                print("No record found for session id: %s", self.session_id)
-            else:
+            if error.response["Error"]["Code"] != "ValidationException":
                 print(error)
-        items = response.get("Items", [])
-        items = sorted(items, key=lambda x: x["createTimestamp"])
+                return []
+            logger.warning(
+                f"Index {self.MESSAGE_BY_SESSION_ID_CREATE_TIME_INDEX_NAME} not available: {error}")
+            return self.messages[-max_messages:]
+        return items[::-1]
+
+    def get_messages_as_langchain(self, max_rounds=None):
+        """Get the chat history as langchain message dicts, oldest first
+
+        :param max_rounds: number of newest question and answer rounds to
+            load, all the messages of the session by default
+        """
+        max_messages = (
+            max_rounds * MESSAGES_PER_ROUND if max_rounds is not None else None
+        )
+        items = self.load_recent_messages(max_messages)
         ret = []
 
         for item in items:
@@ -136,6 +205,34 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
                 }
             )
 
+    def build_message_item(
+        self,
+        message_id,
+        message_type,
+        custom_message_id,
+        entry_type,
+        message_content,
+        input_message_id="",
+        additional_kwargs=None,
+        current_timestamp=None,
+    ) -> dict:
+        current_timestamp = current_timestamp or to_iso_timestamp(
+            datetime.utcnow())
+        additional_kwargs = additional_kwargs or {}
+        return {
+            "messageId": message_id,
+            "sessionId": self.session_id,
+            "chatbotId": self.chatbot_id,
+            "role": message_type,
+            "customMessageId": custom_message_id,
+            "inputMessageId": input_message_id,
+            "entryType": entry_type,
+            "content": message_content,
+            "createTimestamp": current_timestamp,
+            "lastModifiedTimestamp": current_timestamp,
+            "additional_kwargs": json.dumps(additional_kwargs),
+        }
+
     def add_message(
         self,
         message_id,
@@ -147,28 +244,113 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
         additional_kwargs=None,
     ) -> None:
         """Append the message to the record in DynamoDB"""
-        current_timestamp = datetime.utcnow().isoformat() + "Z"
-        additional_kwargs = additional_kwargs or {}
-
         try:
             self.messages_table.put_item(
-                Item={
-                    "messageId": message_id,
-                    "sessionId": self.session_id,
-                    "chatbotId": self.chatbot_id,
-                    "role": message_type,
-                    "customMessageId": custom_message_id,
-                    "inputMessageId": input_message_id,
-                    "entryType": entry_type,
-                    "content": message_content,
-                    "createTimestamp": current_timestamp,
-                    "lastModifiedTimestamp": current_timestamp,
-                    "additional_kwargs": json.dumps(additional_kwargs),
-                }
+                Item=self.build_message_item(
+                    message_id,
+                    message_type,
+                    custom_message_id,
+                    entry_type,
+                    message_content,
+                    input_message_id,
+                    additional_kwargs,
+                )
             )
         except ClientError as err:
             print(f"Error adding message: {err}")
 
+    def add_chat_round(
+        self,
+        message_id,
+        custom_message_id,
+        entry_type,
+        query,
+        answer,
+        additional_kwargs=None,
+        query_timestamp=None,
+    ) -> None:
+        """Write a question and its answer with a single transaction.
+
+        The two message items and the session upsert go out in one
+        TransactWriteItems call. The session is upserted with if_not_exists,
+        so it is not read before being written.
+
+        :param query_timestamp: epoch seconds when the question was received,
+            defaults to now
+        """
+        query_time = (
+            datetime.utcfromtimestamp(query_timestamp)
+            if query_timestamp is not None
+            else datetime.utcnow()
+        )
+        # the answer must sort after its question
+        answer_time = max(
+            datetime.utcnow(), query_time + timedelta(microseconds=1))
+        user_item = self.build_message_item(
+            f"user_{message_id}",
+            MessageType.HUMAN_MESSAGE_TYPE,
+            custom_message_id,
+            entry_type,
+            query,
+            additional_kwargs=additional_kwargs,
+            current_timestamp=to_iso_timestamp(query_time),
+        )
+        ai_item = self.build_message_item(
+            f"ai_{message_id}",
+            MessageType.AI_MESSAGE_TYPE,
+            custom_message_id,
+            entry_type,
+            answer,
+            input_message_id=f"user_{message_id}",
+            additional_kwargs=additional_kwargs,
+            current_timestamp=to_iso_timestamp(answer_time),
+        )
+        transact_items = [
+            {
+                "Put": {
+                    "TableName": self.messages_table.name,
+                    "Item": {
+                        k: type_serializer.serialize(v) for k, v in item.items()
+                    },
+                }
+            }
+            for item in (user_item, ai_item)
+        ]
+        session_values = {
+            ":t": ai_item["lastModifiedTimestamp"],
+            ":s": user_item["createTimestamp"],
+            ":q": query,
+            ":c": self.chatbot_id,
+            ":ct": self.client_type,
+        }
+        transact_items.append(
+            {
+                "Update": {
+                    "TableName": self.sessions_table.name,
+                    "Key": {
+                        "sessionId": type_serializer.serialize(self.session_id),
+                        "userId": type_serializer.serialize(self.user_id),
+                    },
+                    "UpdateExpression": (
+                        "SET lastModifiedTimestamp = :t, latestQuestion = :q, "
+                        "chatbotId = if_not_exists(chatbotId, :c), "
+                        "clientType = if_not_exists(clientType, :ct), "
+                        "startTime = if_not_exists(startTime, :s), "
+                        "createTimestamp = if_not_exists(createTimestamp, :s)"
+                    ),
+                    "ExpressionAttributeValues": {
+                        k: type_serializer.serialize(v)
+                        for k, v in session_values.items()
+                    },
+                }
+            }
+        )
+        try:
+            client.meta.client.transact_write_items(
+                TransactItems=transact_items)
+        except ClientError as err:
+            logger.error(f"Error adding chat round: {err}")
+
     def add_user_message(
         self,
         message_id,
@@ -1,3 +1,4 @@
+import contextvars
 import enum
 import functools
 import importlib
@@ -8,9 +9,8 @@ from typing import Any, Dict, Optional, Callable, Union
 import threading
 
 import requests
-from common_logic.common_utils.constant import StreamMessageType
 from common_logic.common_utils.logger_utils import get_logger
-from common_logic.common_utils.websocket_utils import is_websocket_request, send_to_ws_client
+from common_logic.common_utils.websocket_utils import is_websocket_request, trace_sink
 from pydantic import BaseModel, Field, model_validator
 
 
@@ -19,11 +19,14 @@ from .exceptions import LambdaInvokeError
 logger = get_logger("lambda_invoke_utils")
 # thread_local = threading.local()
 thread_local = threading.local()
-CURRENT_STATE = None
+# state of the node running in the current context, so that parallel
+# nodes and the tools they call each see their own state
+CURRENT_STATE = contextvars.ContextVar("current_state", default=None)
 
 __FUNC_NAME_MAP = {
     "query_preprocess": "Preprocess for Multi-round Conversation",
     "intention_detection": "Intention Detection",
+    "speculative_intention_detection": "Speculative Intention Detection",
     "agent": "Agent",
     "tools_choose_and_results_generation": "Tool Calling",
     "results_evaluation": "Result Evaluation",
@@ -36,31 +39,31 @@ class StateContext:
 
     def __init__(self, state):
         self.state = state
+        self.token = None
 
     @classmethod
     def get_current_state(cls):
-        # print("thread id",threading.get_ident(),'parent id',threading.)
-        # state = getattr(thread_local,'state',None)
-        state = CURRENT_STATE
+        state = CURRENT_STATE.get()
         assert state is not None, "There is not a valid state in current context"
         return state
 
     @classmethod
     def set_current_state(cls, state):
-        global CURRENT_STATE
-        assert CURRENT_STATE is None, "Parallel node executions are not alowed"
-        CURRENT_STATE = state
+        return CURRENT_STATE.set(state)
 
     @classmethod
-    def clear_state(cls):
-        global CURRENT_STATE
-        CURRENT_STATE = None
+    def clear_state(cls, token=None):
+        if token is not None:
+            CURRENT_STATE.reset(token)
+        else:
+            CURRENT_STATE.set(None)
 
     def __enter__(self):
-        self.set_current_state(self.state)
+        self.token = self.set_current_state(self.state)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.clear_state()
+        self.clear_state(self.token)
+        self.token = None
 
 
 class LAMBDA_INVOKE_MODE(enum.Enum):
@@ -252,7 +255,12 @@ def chatbot_lambda_call_wrapper(fn):
             _is_main_lambda_inner = True
 
         # run
-        ret = fn(event, context=context)
+        try:
+            ret = fn(event, context=context)
+        finally:
+            # do not leave traces buffered while the container is frozen
+            if _is_main_lambda_inner and stream:
+                trace_sink.flush(ws_connection_id)
         # save response to body
         # TODO
         if current_lambda_invoke_mode == LAMBDA_INVOKE_MODE.API_GW.value:
@@ -280,6 +288,7 @@ def send_trace(
 ) -> None:
     """
     Send trace information either to a WebSocket client or log it.
+    WebSocket traces go through the trace sink and never block the caller.
     """
     if current_stream_use is None:
         current_stream_use = _current_stream_use
@@ -292,14 +301,7 @@ def send_trace(
 
     if enable_trace:
         if current_stream_use and ws_connection_id is not None:
-            send_to_ws_client(
-                message={
-                    "message_type": StreamMessageType.MONITOR,
-                    "message": trace_info,
-                    "created_time": time.time(),
-                },
-                ws_connection_id=ws_connection_id,
-            )
+            trace_sink.send(ws_connection_id, trace_info)
             if not is_running_local():
                 logger.info(trace_info)
         else:
@@ -5,6 +5,7 @@ import json
 from pydantic import BaseModel, Field
 from collections import defaultdict
 from common_logic.common_utils.constant import LLMModelType, LLMTaskType
+from common_logic.common_utils.cache_utils import TTLCache
 import copy
 from common_logic.common_utils.constant import SceneType, MessageType
 
@@ -12,6 +13,10 @@ ddb_prompt_table_name = os.environ.get("PROMPT_TABLE_NAME", "")
 dynamodb_resource = boto3.resource("dynamodb")
 ddb_prompt_table = dynamodb_resource.Table(ddb_prompt_table_name)
 
+PROMPT_CACHE_TTL = int(os.environ.get("PROMPT_CACHE_TTL", 300))
+# per group item holding the version bumped by every prompt write
+PROMPT_VERSION_SORT_KEY = "__version__"
+
 
 # export models to front
 EXPORT_MODEL_IDS = [
@@ -56,6 +61,10 @@ class PromptTemplate(BaseModel):
 class PromptTemplateManager:
     def __init__(self) -> None:
         self.prompt_templates = defaultdict(dict)
+        # (group_name, sort_key) -> prompt item, {} if the item does not exist
+        self.prompt_item_cache = TTLCache(PROMPT_CACHE_TTL)
+        # group_name -> prompt version of the cached items
+        self.prompt_versions = {}
 
     def get_prompt_template_id(self, model_id, task_type):
         return f"{model_id}__{task_type}"
@@ -96,12 +105,78 @@ class PromptTemplateManager:
             raise KeyError(
                 f'prompt_template_id: {prompt_template_id}, prompt_name: {prompt_name}')
 
-    def get_prompt_templates_from_ddb(self, group_name: str, model_id: str, task_type: str, chatbot_id: str = "admin", scene: str = "common"):
+    def get_prompt_sort_key(self, model_id: str, chatbot_id: str = "admin", scene: str = "common"):
+        return f"{model_id}__{scene}__{chatbot_id}"
+
+    def get_prompt_version(self, group_name: str):
         response = ddb_prompt_table.get_item(
-            Key={"GroupName": group_name,
-                 "SortKey": f"{model_id}__{scene}__{chatbot_id}"}
+            Key={"GroupName": group_name, "SortKey": PROMPT_VERSION_SORT_KEY},
+            ConsistentRead=True,
+        )
+        return int(response.get("Item", {}).get("Version", 0))
+
+    def bump_prompt_version(self, group_name: str):
+        """Mark the prompt items of a group as changed, called on every prompt write"""
+        ddb_prompt_table.update_item(
+            Key={"GroupName": group_name, "SortKey": PROMPT_VERSION_SORT_KEY},
+            UpdateExpression="ADD Version :one",
+            ExpressionAttributeValues={":one": 1},
         )
-        return response.get("Item", {}).get("Prompt", {}).get(task_type, {})
+        self.invalidate_prompt_templates(group_name)
+
+    def invalidate_prompt_templates(self, group_name: str):
+        self.prompt_item_cache.invalidate_if(lambda key: key[0] == group_name)
+        self.prompt_versions.pop(group_name, None)
+
+    def preload_prompt_templates(self, group_name: str, chatbot_ids: list):
+        """Load the prompt items of all the models, scenes and task types of some chatbots
+
+        Only the group prompt version is read when the cached items are still
+        current. Otherwise all the prompt items of the group are loaded with one
+        query.
+        """
+        version = self.get_prompt_version(group_name)
+        if self.prompt_versions.get(group_name) != version:
+            self.invalidate_prompt_templates(group_name)
+        if all(
+            self.prompt_item_cache.get((group_name, "__preloaded__", chatbot_id))
+            for chatbot_id in chatbot_ids
+        ):
+            return
+
+        query_kwargs = {
+            "KeyConditionExpression": "GroupName = :group_name",
+            "ExpressionAttributeValues": {":group_name": group_name},
+        }
+        items = []
+        while True:
+            response = ddb_prompt_table.query(**query_kwargs)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                break
+            query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        # set before the items so that the markers expire first
+        for chatbot_id in chatbot_ids:
+            self.prompt_item_cache.set(
+                (group_name, "__preloaded__", chatbot_id), True)
+        for item in items:
+            if item["SortKey"] != PROMPT_VERSION_SORT_KEY:
+                self.prompt_item_cache.set((group_name, item["SortKey"]), item)
+        self.prompt_versions[group_name] = version
+
+    def get_prompt_templates_from_ddb(self, group_name: str, model_id: str, task_type: str, chatbot_id: str = "admin", scene: str = "common"):
+        sort_key = self.get_prompt_sort_key(model_id, chatbot_id, scene)
+        item = self.prompt_item_cache.get((group_name, sort_key))
+        if item is None and self.prompt_item_cache.get((group_name, "__preloaded__", chatbot_id)):
+            # all the prompt items of the chatbot are cached, so it does not exist
+            item = {}
+        if item is None:
+            response = ddb_prompt_table.get_item(
+                Key={"GroupName": group_name, "SortKey": sort_key}
+            )
+            item = response.get("Item", {})
+            self.prompt_item_cache.set((group_name, sort_key), item)
+        return item.get("Prompt", {}).get(task_type, {})
 
     def get_all_templates(self, allow_model_ids=EXPORT_MODEL_IDS):
         assert isinstance(allow_model_ids, list), allow_model_ids
@@ -138,6 +213,8 @@ register_prompt_template = prompt_template_manager.register_prompt_template
 register_prompt_templates = prompt_template_manager.register_prompt_templates
 get_all_templates = prompt_template_manager.get_all_templates
 get_prompt_templates_from_ddb = prompt_template_manager.get_prompt_templates_from_ddb
+preload_prompt_templates = prompt_template_manager.preload_prompt_templates
+bump_prompt_version = prompt_template_manager.bump_prompt_version
 
 
 #### rag template #######
@@ -3,16 +3,16 @@ import logging
 import time
 import traceback
 from common_logic.common_utils.ddb_utils import DynamoDBChatMessageHistory
-from common_logic.common_utils.websocket_utils import send_to_ws_client
+from common_logic.common_utils.websocket_utils import (
+    WebsocketClientError,
+    WebsocketStreamSender,
+    trace_sink,
+)
 from common_logic.common_utils.constant import StreamMessageType
 from common_logic.common_utils.logger_utils import get_logger
 logger = get_logger("response_utils")
 
 
-class WebsocketClientError(Exception):
-    pass
-
-
 def write_chat_history_to_ddb(
         query: str,
         answer: str,
@@ -21,17 +21,16 @@ def write_chat_history_to_ddb(
         custom_message_id,
         entry_type,
         additional_kwargs=None,
+        query_timestamp=None,
 ):
-    ddb_obj.add_user_message(
-        f"user_{message_id}", custom_message_id, entry_type, query, additional_kwargs
-    )
-    ddb_obj.add_ai_message(
-        f"ai_{message_id}",
+    ddb_obj.add_chat_round(
+        message_id,
         custom_message_id,
         entry_type,
+        query,
         answer,
-        input_message_id=f"user_{message_id}",
-        additional_kwargs=additional_kwargs
+        additional_kwargs=additional_kwargs,
+        query_timestamp=query_timestamp,
     )
 
 
@@ -48,7 +47,8 @@ def api_response(event_body: dict, response: dict):
         message_id=event_body['message_id'],
         custom_message_id=event_body['custom_message_id'],
         entry_type=event_body['entry_type'],
-        additional_kwargs=response.get("ddb_additional_kwargs", {})
+        additional_kwargs=response.get("ddb_additional_kwargs", {}),
+        query_timestamp=event_body["request_timestamp"],
     )
 
     return {
@@ -76,16 +76,19 @@ def stream_response(event_body: dict, response: dict):
         answer = iter([answer])
 
     ddb_history_obj = event_body["ddb_history_obj"]
+    answer_str = ""
+    sender = WebsocketStreamSender(
+        ws_connection_id,
+        message_id=f"ai_{message_id}",
+        custom_message_id=custom_message_id,
+    )
 
     try:
-        send_to_ws_client(message={
+        sender.send({
             "message_type": StreamMessageType.START,
             "message_id": f"ai_{message_id}",
             "custom_message_id": custom_message_id,
-        },
-            ws_connection_id=ws_connection_id
-        )
-        answer_str = ""
+        })
 
         for i, chunk in enumerate(answer):
             if i == 0 and log_first_token_time:
@@ -94,19 +97,7 @@ def stream_response(event_body: dict, response: dict):
                 logger.info(
                     f"{custom_message_id} running time of first token whole {entry_type} entry: {first_token_time-request_timestamp}s"
                 )
-            send_to_ws_client(message={
-                "message_type": StreamMessageType.CHUNK,
-                "message_id": f"ai_{message_id}",
-                "custom_message_id": custom_message_id,
-                "message": {
-                    "role": "assistant",
-                    "content": chunk,
-                    # "knowledge_sources": sources,
-                },
-                "chunk_id": i,
-            },
-                ws_connection_id=ws_connection_id
-            )
+            sender.send_chunk(chunk)
             answer_str += chunk
 
         if log_first_token_time:
@@ -116,16 +107,6 @@ def stream_response(event_body: dict, response: dict):
 
         logger.info(f"answer: {answer_str}")
 
-        write_chat_history_to_ddb(
-            query=event_body['query'],
-            answer=answer_str,
-            ddb_obj=ddb_history_obj,
-            message_id=message_id,
-            custom_message_id=custom_message_id,
-            entry_type=entry_type,
-            additional_kwargs=response.get("ddb_additional_kwargs", {})
-        )
-
         # Send source and contexts
         if response:
             context_msg = {
@@ -188,20 +169,36 @@ def stream_response(event_body: dict, response: dict):
                     context_msg["ddb_additional_kwargs"].setdefault(
                         "figure", []).extend(md_images)
 
-            send_to_ws_client(
-                message=context_msg,
-                ws_connection_id=ws_connection_id
-            )
+            sender.send(context_msg)
+
+        # send the traces of the request before END, unless they are held
+        # until the answer is sent
+        if not trace_sink.after_end:
+            trace_sink.flush(ws_connection_id)
 
         # send end
-        send_to_ws_client(
-            {
-                "message_type": StreamMessageType.END,
-                "message_id": f"ai_{message_id}",
-                "custom_message_id": custom_message_id,
-            },
-            ws_connection_id=ws_connection_id
-        )
+        sender.send({
+            "message_type": StreamMessageType.END,
+            "message_id": f"ai_{message_id}",
+            "custom_message_id": custom_message_id,
+        })
+
+        # persisted while the sender flushes the answer to the client. END is
+        # already queued, so a failure is only logged, not sent as ERROR
+        try:
+            write_chat_history_to_ddb(
+                query=event_body['query'],
+                answer=answer_str,
+                ddb_obj=ddb_history_obj,
+                message_id=message_id,
+                custom_message_id=custom_message_id,
+                entry_type=entry_type,
+                additional_kwargs=response.get("ddb_additional_kwargs", {}),
+                query_timestamp=request_timestamp,
+            )
+        except Exception:
+            logger.error(
+                f"Error writing chat history: {traceback.format_exc()}")
     except WebsocketClientError:
         error = traceback.format_exc()
         logger.info(error)
@@ -210,15 +207,17 @@ def stream_response(event_body: dict, response: dict):
         # bedrock error
         error = traceback.format_exc()
         logger.info(error)
-        send_to_ws_client(
-            {
+        if sender.error is None:
+            sender.send({
                 "message_type": StreamMessageType.ERROR,
                 "message_id": f"ai_{message_id}",
                 "custom_message_id": custom_message_id,
                 "message": {"content": error},
-            },
-            ws_connection_id=ws_connection_id
-        )
+            })
+    finally:
+        # flush the pending chunks and END/ERROR before returning
+        sender.close()
+        trace_sink.flush(ws_connection_id)
     return answer_str
 
 
@@ -1,10 +1,28 @@
 import json
+import os
+import queue
+import threading
+import time
 
 import boto3
+from common_logic.common_utils.constant import StreamMessageType
 from common_logic.common_utils.logger_utils import get_logger
 
 logger = get_logger("websocket_utils")
 
+# chunks produced within the window are sent as one CHUNK message
+WS_COALESCE_WINDOW = float(os.environ.get("WS_COALESCE_WINDOW", 0.04))
+WS_COALESCE_MAX_BYTES = int(os.environ.get("WS_COALESCE_MAX_BYTES", 8192))
+WS_SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", 1024))
+# trace messages are batched and sent in the background, when the buffer is
+# full new traces are dropped
+TRACE_FLUSH_INTERVAL = float(os.environ.get("TRACE_FLUSH_INTERVAL", 0.2))
+TRACE_FLUSH_BYTES = int(os.environ.get("TRACE_FLUSH_BYTES", 16384))
+TRACE_QUEUE_SIZE = int(os.environ.get("TRACE_QUEUE_SIZE", 1000))
+TRACE_FLUSH_TIMEOUT = float(os.environ.get("TRACE_FLUSH_TIMEOUT", 2))
+# hold the traces of a request until its answer is sent
+TRACE_AFTER_END = os.environ.get("TRACE_AFTER_END", "false").lower() == "true"
+
 ws_client = None
 
 
@@ -41,3 +59,236 @@ def send_to_ws_client(message: dict, ws_connection_id):
         ConnectionId=ws_connection_id,
         Data=json.dumps(message).encode("utf-8"),
     )
+
+
+class WebsocketStreamSender:
+    """Send the messages of one streamed answer from a background thread.
+
+    Chunks put within `window` seconds of each other, up to `max_bytes`, are
+    coalesced into one CHUNK message, so generation does not wait for a
+    post_to_connection round trip per token. Messages are sent in the order
+    they are put, and other messages (CONTEXT, END, ERROR) flush the pending
+    chunks first. The first chunk is sent at once to keep the first token
+    latency. The queue is bounded, so a slow connection throttles the producer.
+    """
+
+    _close = object()
+
+    def __init__(
+        self,
+        ws_connection_id,
+        message_id,
+        custom_message_id,
+        window=WS_COALESCE_WINDOW,
+        max_bytes=WS_COALESCE_MAX_BYTES,
+        queue_size=WS_SEND_QUEUE_SIZE,
+    ):
+        self.ws_connection_id = ws_connection_id
+        self.message_id = message_id
+        self.custom_message_id = custom_message_id
+        self.window = window
+        self.max_bytes = max_bytes
+        self.error = None
+        self._chunk_id = 0
+        self._closed = False
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(
+            target=self._run, name="ws_sender", daemon=True)
+        self._thread.start()
+
+    def send(self, message: dict):
+        if self.error is not None:
+            raise WebsocketClientError(self.error)
+        self._queue.put(("message", message))
+
+    def send_chunk(self, content: str):
+        if self.error is not None:
+            raise WebsocketClientError(self.error)
+        self._queue.put(("chunk", content))
+
+    def close(self):
+        """Flush the pending messages and stop the sender thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(self._close)
+        self._thread.join()
+
+    def _post(self, message: dict):
+        if self.error is not None:
+            return
+        try:
+            send_to_ws_client(message, self.ws_connection_id)
+        except Exception as e:
+            # drop the rest of the stream, the producer sees the error
+            self.error = f"failed to send to {self.ws_connection_id}: {e}"
+            logger.error(self.error)
+
+    def _post_chunk(self, content: str):
+        self._post(
+            {
+                "message_type": StreamMessageType.CHUNK,
+                "message_id": self.message_id,
+                "custom_message_id": self.custom_message_id,
+                "message": {
+                    "role": "assistant",
+                    "content": content,
+                },
+                "chunk_id": self._chunk_id,
+            }
+        )
+        self._chunk_id += 1
+
+    def _coalesce(self, content: str):
+        """Collect the chunks following `content` within the window.
+
+        Returns the coalesced content and the first item that is not part of it.
+        """
+        contents = [content]
+        size = len(content.encode("utf-8"))
+        deadline = time.monotonic() + self.window
+        while size < self.max_bytes:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is self._close or item[0] != "chunk":
+                return "".join(contents), item
+            contents.append(item[1])
+            size += len(item[1].encode("utf-8"))
+        return "".join(contents), None
+
+    def _run(self):
+        next_item = None
+        while True:
+            item = next_item if next_item is not None else self._queue.get()
+            next_item = None
+            if item is self._close:
+                return
+            item_type, payload = item
+            if item_type == "message":
+                self._post(payload)
+            elif self._chunk_id == 0:
+                self._post_chunk(payload)
+            else:
+                content, next_item = self._coalesce(payload)
+                self._post_chunk(content)
+
+
+class WebsocketTraceSink:
+    """Send MONITOR trace messages from a background thread.
+
+    `send` never blocks: traces are buffered and the traces of a connection
+    are sent as one MONITOR message every `flush_interval` seconds, or once
+    `flush_bytes` are buffered. When the buffer is full new traces are
+    dropped. With `after_end`, the traces of a connection are held until
+    `flush` is called for it, after the answer has been sent.
+    """
+
+    def __init__(
+        self,
+        flush_interval=TRACE_FLUSH_INTERVAL,
+        flush_bytes=TRACE_FLUSH_BYTES,
+        queue_size=TRACE_QUEUE_SIZE,
+        after_end=TRACE_AFTER_END,
+    ):
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.queue_size = queue_size
+        self.after_end = after_end
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="ws_trace_sink", daemon=True)
+                self._thread.start()
+
+    def send(self, ws_connection_id, trace_info: str):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(("trace", ws_connection_id, trace_info))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, ws_connection_id, timeout=TRACE_FLUSH_TIMEOUT):
+        """Send the buffered traces of a connection and wait until they are sent"""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        try:
+            self._queue.put(("flush", ws_connection_id, done), timeout=timeout)
+        except queue.Full:
+            logger.warning(f"trace sink is full, skip flush for {ws_connection_id}")
+            return
+        if not done.wait(timeout):
+            logger.warning(f"timed out flushing traces for {ws_connection_id}")
+
+    def _post(self, ws_connection_id, traces: list):
+        if not traces:
+            return
+        try:
+            send_to_ws_client(
+                message={
+                    "message_type": StreamMessageType.MONITOR,
+                    "message": "".join(traces),
+                    "created_time": time.time(),
+                },
+                ws_connection_id=ws_connection_id,
+            )
+        except Exception as e:
+            logger.error(f"failed to send traces to {ws_connection_id}: {e}")
+
+    def _run(self):
+        # traces waiting to be sent, by connection
+        pending = {}
+        pending_bytes = 0
+        flush_at = None
+        while True:
+            timeout = None
+            if flush_at is not None:
+                timeout = max(flush_at - time.monotonic(), 0)
+            try:
+                item_type, ws_connection_id, payload = self._queue.get(
+                    timeout=timeout)
+            except queue.Empty:
+                item_type = None
+
+            if item_type == "flush":
+                traces = pending.pop(ws_connection_id, [])
+                pending_bytes -= sum(len(t.encode("utf-8")) for t in traces)
+                self._post(ws_connection_id, traces)
+                payload.set()
+                continue
+
+            if item_type == "trace":
+                traces = pending.setdefault(ws_connection_id, [])
+                if self.after_end:
+                    if len(traces) < self.queue_size:
+                        traces.append(payload)
+                    else:
+                        self.dropped += 1
+                    continue
+                traces.append(payload)
+                pending_bytes += len(payload.encode("utf-8"))
+                if flush_at is None:
+                    flush_at = time.monotonic() + self.flush_interval
+                if pending_bytes < self.flush_bytes:
+                    continue
+
+            # flush interval elapsed or buffer full
+            for connection_id, traces in pending.items():
+                self._post(connection_id, traces)
+            pending = {}
+            pending_bytes = 0
+            flush_at = None
+
+
+trace_sink = WebsocketTraceSink()
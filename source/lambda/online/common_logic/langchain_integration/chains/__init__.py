@@ -1,7 +1,12 @@
+import os
 from typing import Any
+from common_logic.common_utils.cache_utils import LRUCache, get_hash_key
 from common_logic.common_utils.constant import LLMTaskType
+from common_logic.common_utils.time_utils import get_china_now
 from ..model_config import MODEL_CONFIGS
 
+CHAIN_POOL_SIZE = int(os.environ.get("CHAIN_POOL_SIZE", 64))
+
 
 class LLMChainMeta(type):
     def __new__(cls, name, bases, attrs):
@@ -15,6 +20,9 @@ class LLMChainMeta(type):
 
 class LLMChain(metaclass=LLMChainMeta):
     model_map = {}
+    # chains reused across invocations in a warm container, keyed by model,
+    # task and chain kwargs
+    chain_pool = LRUCache(CHAIN_POOL_SIZE)
 
     @classmethod
     def get_chain_id(cls):
@@ -24,13 +32,37 @@ class LLMChain(metaclass=LLMChainMeta):
     def _get_chain_id(model_id, intent_type):
         return f"{model_id}__{intent_type}"
 
+    @staticmethod
+    def get_chain_pool_key(model_id, intent_type, model_kwargs, kwargs):
+        try:
+            # system prompts embed the current date
+            return get_hash_key(
+                model_id,
+                intent_type,
+                model_kwargs,
+                kwargs,
+                get_china_now().strftime("%Y-%m-%d"),
+            )
+        except (TypeError, ValueError):
+            # kwargs holding live objects, e.g. tools, are built every time
+            return None
+
     @classmethod
     def get_chain(cls, model_id, intent_type, model_kwargs=None, **kwargs):
         # dynamic import
         _load_module(intent_type)
-        return cls.model_map[cls._get_chain_id(model_id, intent_type)].create_chain(
+        pool_key = cls.get_chain_pool_key(
+            model_id, intent_type, model_kwargs, kwargs)
+        if pool_key is not None:
+            chain = cls.chain_pool.get(pool_key)
+            if chain is not None:
+                return chain
+        chain = cls.model_map[cls._get_chain_id(model_id, intent_type)].create_chain(
             model_kwargs=model_kwargs, **kwargs
         )
+        if pool_key is not None:
+            cls.chain_pool.set(pool_key, chain)
+        return chain
 
     @classmethod
     def model_id_to_class_name(cls, model_id: str, intent_type: str) -> str:
@@ -211,10 +243,16 @@ def _import_auto_evaluation_chain():
     )
 
 
+_loaded_intent_types = set()
+
+
 def _load_module(intent_type):
+    if intent_type in _loaded_intent_types:
+        return
     assert intent_type in CHAIN_MODULE_LOAD_FN_MAP, (
         intent_type, CHAIN_MODULE_LOAD_FN_MAP)
     CHAIN_MODULE_LOAD_FN_MAP[intent_type]()
+    _loaded_intent_types.add(intent_type)
 
 
 CHAIN_MODULE_LOAD_FN_MAP = {
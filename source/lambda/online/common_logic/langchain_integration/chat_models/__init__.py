@@ -1,9 +1,14 @@
 """
 chat models build in command pattern
 """
+import os
+
+from common_logic.common_utils.cache_utils import LRUCache
 from common_logic.common_utils.constant import LLMModelType,ModelProvider
 from ..model_config import MODEL_CONFIGS
 
+MODEL_POOL_SIZE = int(os.environ.get("MODEL_POOL_SIZE", 32))
+
 
 class ModeMixins:
     @staticmethod
@@ -44,6 +49,9 @@ class Model(ModeMixins, metaclass=ModelMeta):
     any_tool_choice_value = "any"
     model_map = {}
     model_provider: ModelProvider = ModelProvider.BEDROCK
+    # chat model instances reused across invocations in a warm container,
+    # keyed by model, model kwargs, region and credentials
+    model_pool = LRUCache(MODEL_POOL_SIZE)
 
     @classmethod
     def create_model(cls, model_kwargs=None, **kwargs):
@@ -130,10 +138,16 @@ def _import_dmaa_models():
         
 
 
+_loaded_model_ids = set()
+
+
 def _load_module(model_id):
+    if model_id in _loaded_model_ids:
+        return
     assert model_id in MODEL_MODULE_LOAD_FN_MAP, (
         model_id, MODEL_MODULE_LOAD_FN_MAP)
     MODEL_MODULE_LOAD_FN_MAP[model_id]()
+    _loaded_model_ids.add(model_id)
 
 
 MODEL_MODULE_LOAD_FN_MAP = {
@@ -1,3 +1,4 @@
+import hashlib
 import os
 import boto3
 from langchain_aws.chat_models import ChatBedrockConverse as _ChatBedrockConverse
@@ -6,6 +7,7 @@ from common_logic.common_utils.constant import (
     LLMModelType,
     ModelProvider
 )
+from common_logic.common_utils.cache_utils import get_hash_key
 from common_logic.common_utils.logger_utils import (
     get_logger, 
     llm_messages_print_decorator
@@ -48,6 +50,21 @@ class BedrockBaseModel(Model):
         br_aws_secret_access_key = os.environ.get(
             "BEDROCK_AWS_SECRET_ACCESS_KEY", "")
 
+        # the client and its wrapped converse methods are built once per
+        # model config, rotated keys get a new entry
+        pool_key = get_hash_key(
+            cls.model_id,
+            cls.model_provider,
+            model_kwargs,
+            region_name,
+            credentials_profile_name,
+            br_aws_access_key_id,
+            hashlib.sha256(br_aws_secret_access_key.encode("utf-8")).hexdigest(),
+        )
+        llm = cls.model_pool.get(pool_key)
+        if llm is not None:
+            return llm
+
         if br_aws_access_key_id != "" and br_aws_secret_access_key != "":
             logger.info(
                 f"Bedrock Using AWS AKSK from environment variables. Key ID: {br_aws_access_key_id}")
@@ -75,6 +92,7 @@ class BedrockBaseModel(Model):
         llm.client.converse_stream = llm_messages_print_decorator(
             llm.client.converse_stream)
         llm.client.converse = llm_messages_print_decorator(llm.client.converse)
+        cls.model_pool.set(pool_key, llm)
         return llm
 
 
@@ -1,5 +1,4 @@
 from langchain.schema.runnable import RunnableLambda, RunnablePassthrough
-from langchain.retrievers.merger_retriever import MergerRetriever
 from langchain_community.retrievers import AmazonKnowledgeBasesRetriever
 from langchain.retrievers import (
     ContextualCompressionRetriever,
@@ -12,10 +11,13 @@ from common_logic.langchain_integration.retrievers.utils.context_utils import (
     retriever_results_format,
 )
 from common_logic.langchain_integration.retrievers.utils.aos_retrievers import (
-    QueryDocumentBM25Retriever,
+    QueryDocumentHybridRetriever,
     QueryDocumentKNNRetriever,
     QueryQuestionRetriever,
 )
+from common_logic.langchain_integration.retrievers.utils.parallel_retrievers import (
+    ParallelMergerRetriever,
+)
 from common_logic.common_utils.chatbot_utils import ChatbotManager
 import boto3
 import sys
@@ -61,19 +63,10 @@ def get_bedrock_kb_retrievers(knowledge_base_id_list, top_k: int):
 
 
 def get_custom_qd_retrievers(config: dict, using_bm25=False):
-    qd_retriever = QueryDocumentKNNRetriever(**config)
-
     if using_bm25:
-        bm25_retrievert = QueryDocumentBM25Retriever(
-            **{
-                "index_name": config["index_name"],
-                "using_whole_doc": config.get("using_whole_doc", False),
-                "context_num": config["context_num"],
-                "enable_debug": config.get("enable_debug", False),
-            }
-        )
-        return [qd_retriever, bm25_retrievert]
-    return [qd_retriever]
+        # knn and bm25 share one msearch and one context expansion
+        return [QueryDocumentHybridRetriever(**config)]
+    return [QueryDocumentKNNRetriever(**config)]
 
 
 def get_custom_qq_retrievers(config: dict):
@@ -82,7 +75,7 @@ def get_custom_qq_retrievers(config: dict):
 
 
 def get_whole_chain(retriever_list, reranker_config):
-    lotr = MergerRetriever(retrievers=retriever_list)
+    lotr = ParallelMergerRetriever(retrievers=retriever_list)
     if len(reranker_config):
         default_reranker_config = {
             "enable_debug": False,
@@ -115,9 +108,7 @@ def get_custom_retrievers(retriever):
     return retriever_dict[retriever["index_type"]](retriever)
 
 
-def lambda_handler(event, context=None):
-    logger.info(f"Retrieval event: {event}")
-    event_body = event
+def get_event_chain(event_body):
     retriever_list = []
     for retriever in event_body["retrievers"]:
         if not kb_enabled:
@@ -135,7 +126,21 @@ def lambda_handler(event, context=None):
         whole_chain = get_whole_chain(retriever_list, reranker_config)
     else:
         whole_chain = RunnablePassthrough.assign(docs=lambda x: [])
-    docs = whole_chain.invoke({"query": event_body["query"], "debug_info": {}})
+    return whole_chain
+
+
+def lambda_handler(event, context=None):
+    logger.info(f"Retrieval event: {event}")
+    whole_chain = get_event_chain(event)
+    docs = whole_chain.invoke({"query": event["query"], "debug_info": {}})
+    return {"code": 0, "result": docs}
+
+
+async def alambda_handler(event, context=None):
+    """Async variant of lambda_handler for callers already running in an event loop"""
+    logger.info(f"Retrieval event: {event}")
+    whole_chain = get_event_chain(event)
+    docs = await whole_chain.ainvoke({"query": event["query"], "debug_info": {}})
     return {"code": 0, "result": docs}
 
 
@@ -1,17 +1,21 @@
-import asyncio
 import json
 import logging
 import os
 import traceback
+from array import array
 from typing import Any, Dict, List, Union
 
 import boto3
+from common_logic.common_utils.async_utils import run_in_executor
+from common_logic.common_utils.cache_utils import LRUCache
 from common_logic.common_utils.time_utils import timeit
-from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
 from langchain.docstore.document import Document
 from langchain.schema.retriever import BaseRetriever
-from langchain_community.embeddings import BedrockEmbeddings
-from sm_utils import SagemakerEndpointVectorOrCross
+from sm_utils import SagemakerEndpointVectorOrCross, get_bedrock_embeddings
 
 from .aos_utils import LLMBotOpenSearchClient
 
@@ -23,40 +27,24 @@ kb_enabled = os.environ["KNOWLEDGE_BASE_ENABLED"].lower() == "true"
 kb_type = json.loads(os.environ["KNOWLEDGE_BASE_TYPE"])
 intelli_agent_kb_enabled = kb_type.get(
     "intelliAgentKb", {}).get("enabled", False)
-aos_endpoint = os.environ.get("AOS_ENDPOINT", "")
-aos_domain_name = os.environ.get("AOS_DOMAIN_NAME", "smartsearch")
-aos_secret = os.environ.get("AOS_SECRET_NAME", "opensearch-master-user")
-sm_client = boto3.client("secretsmanager")
 bedrock_region = os.environ.get("BEDROCK_REGION", "us-east-1")
-try:
-    master_user = sm_client.get_secret_value(SecretId=aos_secret)[
-        "SecretString"
-    ]
-    if not aos_endpoint:
-        opensearch_client = boto3.client("opensearch")
-        response = opensearch_client.describe_domain(
-            DomainName=aos_domain_name
-        )
-        aos_endpoint = response["DomainStatus"]["Endpoint"]
-    cred = json.loads(master_user)
-    username = cred.get("username")
-    password = cred.get("password")
-    auth = (username, password)
-    aos_client = LLMBotOpenSearchClient(aos_endpoint, auth)
-except sm_client.exceptions.ResourceNotFoundException:
-    logger.info(f"Secret '{aos_secret}' not found in Secrets Manager")
-    aos_client = LLMBotOpenSearchClient(aos_endpoint)
-except sm_client.exceptions.InvalidRequestException:
-    logger.info("InvalidRequestException. It might caused by getting secret value from a deleting secret")
-    logger.info("Fallback to authentication with IAM")
-    aos_client = LLMBotOpenSearchClient(aos_endpoint)
-except Exception as e:
-    logger.error(f"Error retrieving secret '{aos_secret}': {str(e)}")
-    raise
+# the endpoint and credentials are resolved on the first search, once per
+# container, and the pooled client is shared with the other OpenSearch users
+aos_client = LLMBotOpenSearchClient()
 
 DEFAULT_TEXT_FIELD_NAME = "text"
 DEFAULT_VECTOR_FIELD_NAME = "vector_field"
 DEFAULT_SOURCE_FIELD_NAME = "source"
+CHUNK_ID_FIELD_NAME = "metadata.chunk_id.keyword"
+
+# Hybrid retrieval fusion parameters
+HYBRID_FUSION_METHOD = os.environ.get("HYBRID_FUSION_METHOD", "rrf")
+HYBRID_RRF_K = int(os.environ.get("HYBRID_RRF_K", 60))
+HYBRID_KNN_WEIGHT = float(os.environ.get("HYBRID_KNN_WEIGHT", 0.5))
+
+# Query embeddings shared by qq match, intention detection and rag retrieval
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", 1024))
+query_embedding_cache = LRUCache(maxsize=EMBEDDING_CACHE_SIZE)
 
 
 def remove_redundancy_debug_info(results):
@@ -69,33 +57,77 @@ def remove_redundancy_debug_info(results):
     return filtered_results
 
 
-@timeit
-def get_similarity_embedding(
+def get_query_embedding(
     query: str,
     embedding_model_endpoint: str,
     target_model: str,
-    model_type: str = "vector",
-) -> List[List[float]]:
+    model_type: str,
+    prompt_prefix: str = "",
+    normalize: bool = False,
+) -> List[float]:
+    """
+    Embed the query, reusing the embeddings of recent identical queries
+
+    :param query: query text
+    :param embedding_model_endpoint: sagemaker endpoint or bedrock model id
+    :param target_model: target model of the sagemaker endpoint
+    :param model_type: embedding model type
+    :param prompt_prefix: instruction prepended to the query
+    :param normalize: whether to normalize bedrock embeddings
+
+    :return: query embedding
+    """
+    cache_key = (
+        embedding_model_endpoint,
+        target_model,
+        model_type,
+        prompt_prefix,
+        normalize,
+        " ".join(query.split()),
+    )
+    cached_embedding = query_embedding_cache.get(cache_key)
+    if cached_embedding is not None:
+        logger.info(
+            f"query embedding cache hit, stats: {query_embedding_cache.stats()}")
+        return list(cached_embedding)
+
     if model_type.lower() == "bedrock":
-        embeddings = BedrockEmbeddings(
+        embeddings = get_bedrock_embeddings(
             model_id=embedding_model_endpoint,
             region_name=bedrock_region,
-            normalize=True
+            normalize=normalize
         )
-        response = embeddings.embed_query(query)
+        response = embeddings.embed_query(prompt_prefix + query)
     else:
-        query_similarity_embedding_prompt = query
         response = SagemakerEndpointVectorOrCross(
-            prompt=query_similarity_embedding_prompt,
+            prompt=prompt_prefix + query,
             endpoint_name=embedding_model_endpoint,
             model_type=model_type,
             stop=None,
             region_name=None,
             target_model=target_model,
         )
+    # store as a flat double array to bound the memory of the cache
+    query_embedding_cache.set(cache_key, array("d", response))
     return response
 
 
+@timeit
+def get_similarity_embedding(
+    query: str,
+    embedding_model_endpoint: str,
+    target_model: str,
+    model_type: str = "vector",
+) -> List[List[float]]:
+    return get_query_embedding(
+        query,
+        embedding_model_endpoint,
+        target_model,
+        model_type,
+        normalize=model_type.lower() == "bedrock",
+    )
+
+
 @timeit
 def get_relevance_embedding(
     query: str,
@@ -105,35 +137,26 @@ def get_relevance_embedding(
     model_type: str = "vector",
 ):
     if model_type == "bedrock":
-        embeddings = BedrockEmbeddings(
-            model_id=embedding_model_endpoint, region_name=bedrock_region)
-        response = embeddings.embed_query(query)
-    else:
-        if model_type == "vector":
-            if query_lang == "zh":
-                query_relevance_embedding_prompt = (
-                    "为这个句子生成表示以用于检索相关文章：" + query
-                )
-            elif query_lang == "en":
-                query_relevance_embedding_prompt = (
-                    "Represent this sentence for searching relevant passages: " + query
-                )
-            else:
-                query_relevance_embedding_prompt = query
-        elif model_type == "m3" or model_type == "bce":
-            query_relevance_embedding_prompt = query
+        prompt_prefix = ""
+    elif model_type == "vector":
+        if query_lang == "zh":
+            prompt_prefix = "为这个句子生成表示以用于检索相关文章："
+        elif query_lang == "en":
+            prompt_prefix = "Represent this sentence for searching relevant passages: "
         else:
-            raise ValueError(f"invalid embedding model type: {model_type}")
-        response = SagemakerEndpointVectorOrCross(
-            prompt=query_relevance_embedding_prompt,
-            endpoint_name=embedding_model_endpoint,
-            model_type=model_type,
-            region_name=None,
-            stop=None,
-            target_model=target_model,
-        )
+            prompt_prefix = ""
+    elif model_type == "m3" or model_type == "bce":
+        prompt_prefix = ""
+    else:
+        raise ValueError(f"invalid embedding model type: {model_type}")
 
-    return response
+    return get_query_embedding(
+        query,
+        embedding_model_endpoint,
+        target_model,
+        model_type,
+        prompt_prefix=prompt_prefix,
+    )
 
 
 def get_filter_list(parsed_query: dict):
@@ -174,6 +197,62 @@ def get_faq_content(source, index_name):
     return ""
 
 
+def _order_siblings(heading_ids, heading_hierarchies):
+    """Order headings of the same level by their previous/next links"""
+    heading_id_set = set(heading_ids)
+    ordered = []
+    for heading_id in heading_ids:
+        if heading_hierarchies[heading_id].get("previous") in heading_id_set:
+            continue
+        while heading_id in heading_id_set and heading_id not in ordered:
+            ordered.append(heading_id)
+            heading_id = heading_hierarchies[heading_id].get("next")
+    # headings off a broken chain keep their order
+    ordered += [h for h in heading_ids if h not in ordered]
+    return ordered
+
+
+def get_heading_order(heading_hierarchies):
+    """Position of each heading of a file in the document.
+
+    The chunk ids do not carry the position of their heading, so the order
+    is rebuilt from the heading hierarchy, depth first. Headings without a
+    parent appear from the deepest to the top level, as a top level heading
+    would be the parent of a deeper heading after it.
+    """
+    roots = [
+        heading_id
+        for heading_id, hierarchy in heading_hierarchies.items()
+        if hierarchy.get("parent") not in heading_hierarchies
+    ]
+    levels = sorted(
+        {heading_hierarchies[h].get("level", 0) for h in roots}, reverse=True
+    )
+    order = {}
+
+    def visit(heading_id):
+        if heading_id in order:
+            return
+        order[heading_id] = len(order)
+        children = [
+            child
+            for child in heading_hierarchies[heading_id].get("child") or []
+            if child in heading_hierarchies
+        ]
+        for child in _order_siblings(children, heading_hierarchies):
+            visit(child)
+
+    for level in levels:
+        level_roots = [
+            h for h in roots if heading_hierarchies[h].get("level", 0) == level
+        ]
+        for heading_id in _order_siblings(level_roots, heading_hierarchies):
+            visit(heading_id)
+    for heading_id in sorted(heading_hierarchies):
+        visit(heading_id)
+    return order
+
+
 def get_doc(file_path, index_name):
     opensearch_query_response = aos_client.search(
         index_name=index_name,
@@ -184,6 +263,7 @@ def get_doc(file_path, index_name):
     )
     chunk_list = []
     chunk_id_set = set()
+    heading_hierarchies = {}
     for r in opensearch_query_response["hits"]["hits"]:
         try:
             if "chunk_id" not in r["_source"]["metadata"] or not r["_source"][
@@ -192,8 +272,12 @@ def get_doc(file_path, index_name):
                 continue
             chunk_id = r["_source"]["metadata"]["chunk_id"]
             content_type = r["_source"]["metadata"]["content_type"]
-            chunk_group_id = int(chunk_id.split("-")[0].strip("$"))
+            heading_id = "-".join(chunk_id.split("-")[:-1])
             chunk_section_id = int(chunk_id.split("-")[-1])
+            if "heading_hierarchy" in r["_source"]["metadata"]:
+                heading_hierarchies[heading_id] = r["_source"]["metadata"][
+                    "heading_hierarchy"
+                ]
             if (chunk_id, content_type) in chunk_id_set:
                 continue
         except Exception as e:
@@ -203,174 +287,167 @@ def get_doc(file_path, index_name):
         chunk_list.append(
             (
                 chunk_id,
-                chunk_group_id,
+                heading_id,
                 content_type,
                 chunk_section_id,
                 r["_source"]["text"],
             )
         )
-    sorted_chunk_list = sorted(chunk_list, key=lambda x: (x[1], x[2], x[3]))
+    # chunks without a heading come first
+    heading_order = get_heading_order(heading_hierarchies)
+    sorted_chunk_list = sorted(
+        chunk_list, key=lambda x: (heading_order.get(x[1], -1), x[2], x[3])
+    )
     chunk_text_list = [x[4] for x in sorted_chunk_list]
     return "\n".join(chunk_text_list)
 
 
-def get_child_context(chunk_id, index_name, window_size):
-    next_content_list = []
-    previous_content_list = []
-    previous_pos = 0
-    next_pos = 0
-    chunk_id_prefix = "-".join(chunk_id.split("-")[:-1])
-    section_id = int(chunk_id.split("-")[-1])
-    previous_section_id = section_id
-    next_section_id = section_id
-    while previous_pos < window_size:
-        previous_section_id -= 1
-        if previous_section_id < 1:
-            break
-        previous_chunk_id = f"{chunk_id_prefix}-{previous_section_id}"
-        opensearch_query_response = aos_client.search(
-            index_name=index_name,
-            query_type="basic",
-            query_term=previous_chunk_id,
-            field="metadata.chunk_id",
-            size=1,
-        )
-        if len(opensearch_query_response["hits"]["hits"]) > 0:
-            r = opensearch_query_response["hits"]["hits"][0]
-            previous_content_list.insert(0, r["_source"]["text"])
-            previous_pos += 1
-        else:
-            break
-    while next_pos < window_size:
-        next_section_id += 1
-        next_chunk_id = f"{chunk_id_prefix}-{next_section_id}"
-        opensearch_query_response = aos_client.search(
-            index_name=index_name,
-            query_type="basic",
-            query_term=next_chunk_id,
-            field="metadata.chunk_id",
-            size=1,
-        )
-        if len(opensearch_query_response["hits"]["hits"]) > 0:
-            r = opensearch_query_response["hits"]["hits"][0]
-            next_content_list.insert(0, r["_source"]["text"])
-            next_pos += 1
-        else:
-            break
-    return [previous_content_list, next_content_list]
+def get_sibling_chunk_ids(chunk_id, window_size):
+    """
+    Compute the chunk ids surrounding a chunk in the same section
 
+    :param chunk_id: chunk id in the form of {prefix}-{section_id}
+    :param window_size: number of chunks to take on each side
 
-def get_sibling_context(chunk_id, index_name, window_size):
-    next_content_list = []
-    previous_content_list = []
-    previous_pos = 0
-    next_pos = 0
+    :return: previous chunk ids (nearest first) and next chunk ids (nearest first)
+    """
     chunk_id_prefix = "-".join(chunk_id.split("-")[:-1])
-    section_id = int(chunk_id.split("-")[-1])
-    previous_section_id = section_id
-    next_section_id = section_id
-    while previous_pos < window_size:
-        previous_section_id -= 1
-        if previous_section_id < 1:
-            break
-        previous_chunk_id = f"{chunk_id_prefix}-{previous_section_id}"
-        opensearch_query_response = aos_client.search(
-            index_name=index_name,
-            query_type="basic",
-            query_term=previous_chunk_id,
-            field="metadata.chunk_id",
-            size=1,
-        )
-        if len(opensearch_query_response["hits"]["hits"]) > 0:
-            r = opensearch_query_response["hits"]["hits"][0]
-            previous_content_list.insert(0, r["_source"]["text"])
-            previous_pos += 1
-        else:
-            break
-    while next_pos < window_size:
-        next_section_id += 1
-        next_chunk_id = f"{chunk_id_prefix}-{next_section_id}"
-        opensearch_query_response = aos_client.search(
-            index_name=index_name,
-            query_type="basic",
-            query_term=next_chunk_id,
-            field="metadata.chunk_id",
-            size=1,
-        )
-        if len(opensearch_query_response["hits"]["hits"]) > 0:
-            r = opensearch_query_response["hits"]["hits"][0]
-            next_content_list.insert(0, r["_source"]["text"])
-            next_pos += 1
-        else:
+    try:
+        section_id = int(chunk_id.split("-")[-1])
+    except ValueError:
+        return [], []
+    previous_chunk_ids = [
+        f"{chunk_id_prefix}-{section_id - offset}"
+        for offset in range(1, window_size + 1)
+        if section_id - offset >= 1
+    ]
+    next_chunk_ids = [
+        f"{chunk_id_prefix}-{section_id + offset}"
+        for offset in range(1, window_size + 1)
+    ]
+    return previous_chunk_ids, next_chunk_ids
+
+
+def get_chunks_by_id(chunk_ids, index_name):
+    """
+    Fetch chunks by chunk id with a single terms query
+
+    :param chunk_ids: chunk ids to fetch
+    :param index_name: Target Index Name
+
+    :return: dict mapping chunk id to the _source of its first hit
+    """
+    chunk_ids = list(dict.fromkeys(chunk_ids))
+    if not chunk_ids:
+        return {}
+    opensearch_query_response = aos_client.search(
+        index_name=index_name,
+        query_type="terms",
+        query_term=chunk_ids,
+        field=CHUNK_ID_FIELD_NAME,
+        size=len(chunk_ids) * 2,
+    )
+    chunk_dict = {}
+    if not opensearch_query_response:
+        return chunk_dict
+    for r in opensearch_query_response["hits"]["hits"]:
+        chunk_id = r["_source"]["metadata"].get("chunk_id")
+        if chunk_id is not None and chunk_id not in chunk_dict:
+            chunk_dict[chunk_id] = r["_source"]
+    return chunk_dict
+
+
+def _take_contiguous_chunks(chunk_ids, chunk_dict):
+    content_list = []
+    for chunk_id in chunk_ids:
+        if chunk_id not in chunk_dict:
             break
-    return [previous_content_list, next_content_list]
+        content_list.append(chunk_dict[chunk_id]["text"])
+    return content_list
 
 
-def get_context(aos_hit, index_name, window_size):
-    previous_content_list = []
-    next_content_list = []
-    if "chunk_id" not in aos_hit["_source"]["metadata"]:
-        return previous_content_list, next_content_list
-    chunk_id = aos_hit["_source"]["metadata"]["chunk_id"]
-    inner_previous_content_list, inner_next_content_list = get_sibling_context(
-        chunk_id, index_name, window_size
+@timeit
+def get_batch_context(aos_hits, index_name, window_size):
+    """
+    Get the previous and next context of every aos hit
+
+    The sibling windows of all hits are fetched with one terms query. Hits
+    whose sibling window is incomplete fall back to walking the heading
+    hierarchy, which advances every pending walk by one step per query.
+
+    :param aos_hits: hits from aos response
+    :param index_name: Target Index Name
+    :param window_size: number of chunks to take on each side
+
+    :return: list of [previous_content_list, next_content_list] for each hit
+    """
+    context_list = [[[], []] for _ in aos_hits]
+    if not window_size:
+        return context_list
+
+    sibling_windows = {}
+    for hit_index, aos_hit in enumerate(aos_hits):
+        metadata = aos_hit["_source"]["metadata"]
+        if "chunk_id" not in metadata:
+            continue
+        sibling_windows[hit_index] = get_sibling_chunk_ids(
+            metadata["chunk_id"], window_size
+        )
+    chunk_dict = get_chunks_by_id(
+        [
+            chunk_id
+            for previous_chunk_ids, next_chunk_ids in sibling_windows.values()
+            for chunk_id in previous_chunk_ids + next_chunk_ids
+        ],
+        index_name,
     )
-    if (
-        len(inner_previous_content_list) == window_size
-        and len(inner_next_content_list) == window_size
-    ):
-        return inner_previous_content_list, inner_next_content_list
 
-    if "heading_hierarchy" not in aos_hit["_source"]["metadata"]:
-        return [previous_content_list, next_content_list]
-    if "previous" in aos_hit["_source"]["metadata"]["heading_hierarchy"]:
-        previous_chunk_id = aos_hit["_source"]["metadata"]["heading_hierarchy"][
-            "previous"
-        ]
-        previous_pos = 0
-        while (
-            previous_chunk_id
-            and previous_chunk_id.startswith("$")
-            and previous_pos < window_size
-        ):
-            opensearch_query_response = aos_client.search(
-                index_name=index_name,
-                query_type="basic",
-                query_term=previous_chunk_id,
-                field="metadata.chunk_id",
-                size=1,
-            )
-            if len(opensearch_query_response["hits"]["hits"]) > 0:
-                r = opensearch_query_response["hits"]["hits"][0]
-                previous_chunk_id = r["_source"]["metadata"]["heading_hierarchy"][
-                    "previous"
-                ]
-                previous_content_list.insert(0, r["_source"]["text"])
-                previous_pos += 1
-            else:
-                break
-    if "next" in aos_hit["_source"]["metadata"]["heading_hierarchy"]:
-        next_chunk_id = aos_hit["_source"]["metadata"]["heading_hierarchy"]["next"]
-        next_pos = 0
-        while (
-            next_chunk_id and next_chunk_id.startswith(
-                "$") and next_pos < window_size
+    hierarchy_walks = {}
+    for hit_index, (previous_chunk_ids, next_chunk_ids) in sibling_windows.items():
+        previous_content_list = _take_contiguous_chunks(
+            previous_chunk_ids, chunk_dict)
+        next_content_list = _take_contiguous_chunks(next_chunk_ids, chunk_dict)
+        if (
+            len(previous_content_list) == window_size
+            and len(next_content_list) == window_size
         ):
-            opensearch_query_response = aos_client.search(
-                index_name=index_name,
-                query_type="basic",
-                query_term=next_chunk_id,
-                field="metadata.chunk_id",
-                size=1,
+            context_list[hit_index] = [
+                previous_content_list[::-1], next_content_list]
+            continue
+        metadata = aos_hits[hit_index]["_source"]["metadata"]
+        if "heading_hierarchy" not in metadata:
+            continue
+        hierarchy_walks[hit_index] = {
+            "previous": metadata["heading_hierarchy"].get("previous"),
+            "next": metadata["heading_hierarchy"].get("next"),
+        }
+
+    for _ in range(window_size):
+        pending_chunk_ids = {}
+        for hit_index, walk in hierarchy_walks.items():
+            for direction, chunk_id in walk.items():
+                if chunk_id and chunk_id.startswith("$"):
+                    pending_chunk_ids[(hit_index, direction)] = chunk_id
+        if not pending_chunk_ids:
+            break
+        chunk_dict = get_chunks_by_id(pending_chunk_ids.values(), index_name)
+        for (hit_index, direction), chunk_id in pending_chunk_ids.items():
+            chunk = chunk_dict.get(chunk_id)
+            if chunk is None:
+                hierarchy_walks[hit_index][direction] = None
+                continue
+            hierarchy_walks[hit_index][direction] = (
+                chunk["metadata"].get("heading_hierarchy", {}).get(direction)
             )
-            if len(opensearch_query_response["hits"]["hits"]) > 0:
-                r = opensearch_query_response["hits"]["hits"][0]
-                next_chunk_id = r["_source"]["metadata"]["heading_hierarchy"]["next"]
-                next_content_list.append(r["_source"]["text"])
-                next_pos += 1
+            if direction == "previous":
+                context_list[hit_index][0].insert(0, chunk["text"])
             else:
-                break
-    return [previous_content_list, next_content_list]
+                context_list[hit_index][1].append(chunk["text"])
+    return context_list
+
+
+def get_context(aos_hit, index_name, window_size):
+    return get_batch_context([aos_hit], index_name, window_size)[0]
 
 
 def get_parent_content(previous_chunk_id, next_chunk_id, index_name):
@@ -407,6 +484,72 @@ def get_parent_content(previous_chunk_id, next_chunk_id, index_name):
     return [previous_content_list, next_content_list]
 
 
+def reciprocal_rank_fusion(hit_lists, weights, rrf_k=HYBRID_RRF_K):
+    """
+    Fuse ranked hit lists with reciprocal rank fusion, deduped by _id
+
+    :param hit_lists: list of aos hits of each search, best first
+    :param weights: weight of each search
+    :param rrf_k: rank constant, larger values flatten the rank contribution
+
+    :return: fused hits, best first, with the fused score as fusion_score
+    """
+    fused_scores = {}
+    fused_hits = {}
+    for hits, weight in zip(hit_lists, weights):
+        for rank, hit in enumerate(hits):
+            fused_hits.setdefault(hit["_id"], hit)
+            fused_scores[hit["_id"]] = fused_scores.get(hit["_id"], 0.0) + (
+                weight / (rrf_k + rank + 1)
+            )
+    return _sort_fused_hits(fused_hits, fused_scores)
+
+
+def weighted_score_fusion(hit_lists, weights):
+    """
+    Fuse hit lists by a weighted sum of min-max normalized scores, deduped by _id
+
+    :param hit_lists: list of aos hits of each search
+    :param weights: weight of each search
+
+    :return: fused hits, best first, with the fused score as fusion_score
+    """
+    fused_scores = {}
+    fused_hits = {}
+    for hits, weight in zip(hit_lists, weights):
+        if not hits:
+            continue
+        scores = [hit["_score"] for hit in hits]
+        min_score = min(scores)
+        score_range = max(scores) - min_score
+        for hit in hits:
+            normalized_score = (
+                (hit["_score"] - min_score) / score_range if score_range else 1.0
+            )
+            fused_hits.setdefault(hit["_id"], hit)
+            fused_scores[hit["_id"]] = (
+                fused_scores.get(hit["_id"], 0.0) + weight * normalized_score
+            )
+    return _sort_fused_hits(fused_hits, fused_scores)
+
+
+def _sort_fused_hits(fused_hits, fused_scores):
+    # _score is left as the score of the first search that found the hit,
+    # fused scores are not on the scale of the score thresholds
+    results = []
+    for hit_id in sorted(fused_scores, key=fused_scores.get, reverse=True):
+        hit = dict(fused_hits[hit_id])
+        hit["fusion_score"] = fused_scores[hit_id]
+        results.append(hit)
+    return results
+
+
+fusion_methods = {
+    "rrf": reciprocal_rank_fusion,
+    "weighted": weighted_score_fusion,
+}
+
+
 def organize_faq_results(
     response, index_name, source_field="file_path", text_field="text"
 ):
@@ -479,6 +622,21 @@ class QueryQuestionRetriever(BaseRetriever):
     model_type: str = "vector"
     enable_debug: bool = False
 
+    @property
+    def embedding_key(self):
+        """Retrievers with the same key share the same query embedding"""
+        return (
+            "similarity",
+            self.embedding_model_endpoint,
+            self.target_model,
+            self.model_type,
+        )
+
+    def embed_query(self, query: str):
+        return get_similarity_embedding(
+            query, self.embedding_model_endpoint, self.target_model, self.model_type
+        )
+
     @timeit
     def _get_relevant_documents(
         self, question: Dict, *, run_manager: CallbackManagerForRetrieverRun
@@ -486,9 +644,9 @@ class QueryQuestionRetriever(BaseRetriever):
         query = question["query"]
         debug_info = question["debug_info"]
         opensearch_knn_results = []
-        query_repr = get_similarity_embedding(
-            query, self.embedding_model_endpoint, self.target_model, self.model_type
-        )
+        query_repr = question.get("query_embeddings", {}).get(self.embedding_key)
+        if query_repr is None:
+            query_repr = self.embed_query(query)
         opensearch_knn_response = aos_client.search(
             index_name=self.index_name,
             query_type="knn",
@@ -522,6 +680,13 @@ class QueryQuestionRetriever(BaseRetriever):
             )
         return docs
 
+    async def _aget_relevant_documents(
+        self, question: Dict, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return await run_in_executor(
+            self._get_relevant_documents, question, run_manager=run_manager.get_sync()
+        )
+
 
 class QueryDocumentKNNRetriever(BaseRetriever):
     index_name: str
@@ -538,21 +703,25 @@ class QueryDocumentKNNRetriever(BaseRetriever):
     enable_debug: bool = False
     lang: str = "zh"
 
-    async def __ainvoke_get_context(self, aos_hit, window_size, loop):
-        return await loop.run_in_executor(
-            None, get_context, aos_hit, self.index_name, window_size
+    @property
+    def embedding_key(self):
+        """Retrievers with the same key share the same query embedding"""
+        return (
+            "relevance",
+            self.embedding_model_endpoint,
+            self.target_model,
+            self.model_type,
+            self.lang,
+        )
 
+    def embed_query(self, query: str):
+        return get_relevance_embedding(
+            query,
+            self.lang,
+            self.embedding_model_endpoint,
+            self.target_model,
+            self.model_type,
         )
-    async def __spawn_task(self, aos_hits, context_size):
-        loop = asyncio.get_event_loop()
-        task_list = []
-        for aos_hit in aos_hits:
-            if context_size:
-                task = asyncio.create_task(
-                    self.__ainvoke_get_context(aos_hit, context_size, loop)
-                )
-                task_list.append(task)
-        return await asyncio.gather(*task_list)
 
     @timeit
     def organize_results(
@@ -592,8 +761,8 @@ class QueryDocumentKNNRetriever(BaseRetriever):
                     if doc:
                         result["doc"] = doc
             else:
-                response_list = asyncio.run(
-                    self.__spawn_task(aos_hits, context_size))
+                response_list = get_batch_context(
+                    aos_hits, aos_index, context_size)
                 for context, result in zip(response_list, results):
                     result["doc"] = "\n".join(
                         context[0] + [result["content"]] + context[1])
@@ -627,21 +796,25 @@ class QueryDocumentKNNRetriever(BaseRetriever):
         # if "query_lang" in question and question["query_lang"] != self.lang and "translated_text" in question:
         #     query = question["translated_text"]
         debug_info = question["debug_info"]
-        query_repr = get_relevance_embedding(
-            query,
-            self.lang,
-            self.embedding_model_endpoint,
-            self.target_model,
-            self.model_type,
-        )
+        query_repr = question.get("query_embeddings", {}).get(self.embedding_key)
+        if query_repr is None:
+            query_repr = self.embed_query(query)
         # question["colbert"] = query_repr["colbert_vecs"][0]
         filter = get_filter_list(question)
         # Get AOS KNN results.
         opensearch_knn_results = self.__get_knn_results(query_repr, filter)
-        final_results = opensearch_knn_results
+        doc_list = self.build_documents(opensearch_knn_results)
+        if self.enable_debug:
+            debug_info[f"qd-knn-recall-{self.index_name}"] = (
+                remove_redundancy_debug_info(opensearch_knn_results)
+            )
+
+        return doc_list
+
+    def build_documents(self, results):
         doc_list = []
         content_set = set()
-        for result in final_results:
+        for result in results:
             if result["doc"] in content_set:
                 continue
             content_set.add(result["content"])
@@ -663,11 +836,108 @@ class QueryDocumentKNNRetriever(BaseRetriever):
             doc_list.append(
                 Document(page_content=result["doc"], metadata=result_metadata)
             )
+        return doc_list
+
+    async def _aget_relevant_documents(
+        self, question: Dict, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return await run_in_executor(
+            self._get_relevant_documents, question, run_manager=run_manager.get_sync()
+        )
+
+
+class QueryDocumentHybridRetriever(QueryDocumentKNNRetriever):
+    """
+    Retrieve documents with KNN and BM25 in one msearch round trip
+
+    Hits of both searches are fused client side and deduped by _id, so a
+    chunk found by both searches is expanded with its context only once.
+    Documents are ordered by the fused score, but their score stays the KNN
+    score, like the other qd retrievers, so the score thresholds and the
+    merge reranker apply. A hit found only by BM25 gets the lowest KNN score,
+    which is an upper bound of its KNN score.
+    """
+
+    # defaults to top_k
+    bm25_top_k: Union[int, None] = None
+    fusion_method: str = HYBRID_FUSION_METHOD
+    knn_weight: float = HYBRID_KNN_WEIGHT
+    rrf_k: int = HYBRID_RRF_K
+
+    @timeit
+    def __get_hybrid_results(self, query, query_repr, filter):
+        knn_response, bm25_response = aos_client.multi_search(
+            self.index_name,
+            [
+                {
+                    "query_type": "knn",
+                    "query_term": query_repr,
+                    "field": self.vector_field,
+                    "size": self.top_k,
+                    "filter": filter,
+                },
+                {
+                    "query_type": "fuzzy",
+                    "query_term": query,
+                    "field": self.text_field,
+                    "size": self.bm25_top_k or self.top_k,
+                    "filter": filter,
+                },
+            ],
+        )
+        hit_lists = []
+        for search_name, response in (("knn", knn_response), ("bm25", bm25_response)):
+            if response and "error" in response:
+                logger.error(
+                    f"{search_name} search on {self.index_name} failed: {response['error']}")
+                response = None
+            hit_lists.append(response["hits"]["hits"] if response else [])
+        weights = [self.knn_weight, 1 - self.knn_weight]
+        if self.fusion_method == "rrf":
+            fused_hits = reciprocal_rank_fusion(hit_lists, weights, self.rrf_k)
+        else:
+            fused_hits = fusion_methods[self.fusion_method](hit_lists, weights)
+
+        search_scores = {}
+        for search_name, hits in zip(("knn", "bm25"), hit_lists):
+            for hit in hits:
+                search_scores.setdefault(hit["_id"], {})[
+                    f"{search_name}_score"] = hit["_score"]
+        knn_hits = hit_lists[0]
+        min_knn_score = min((hit["_score"] for hit in knn_hits), default=0.0)
+        for hit in fused_hits:
+            search_scores[hit["_id"]]["fusion_score"] = hit["fusion_score"]
+            hit["_score"] = search_scores[hit["_id"]].get(
+                "knn_score", min_knn_score)
+        results = self.organize_results(
+            {"hits": {"hits": fused_hits}},
+            self.index_name,
+            self.source_field,
+            self.text_field,
+            self.using_whole_doc,
+            self.context_num,
+        )
+        for hit, result in zip(fused_hits, results):
+            result["data"] = search_scores[hit["_id"]]
+        return results
+
+    @timeit
+    def _get_relevant_documents(
+        self, question: Dict, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        query = question["query"]
+        debug_info = question["debug_info"]
+        query_repr = question.get("query_embeddings", {}).get(self.embedding_key)
+        if query_repr is None:
+            query_repr = self.embed_query(query)
+        filter = get_filter_list(question)
+        opensearch_hybrid_results = self.__get_hybrid_results(
+            query, query_repr, filter)
+        doc_list = self.build_documents(opensearch_hybrid_results)
         if self.enable_debug:
-            debug_info[f"qd-knn-recall-{self.index_name}"] = (
-                remove_redundancy_debug_info(opensearch_knn_results)
+            debug_info[f"qd-hybrid-recall-{self.index_name}"] = (
+                remove_redundancy_debug_info(opensearch_hybrid_results)
             )
-
         return doc_list
 
 
@@ -682,22 +952,6 @@ class QueryDocumentBM25Retriever(BaseRetriever):
     enable_debug: Any
     config: Dict = {"run_name": "BM25"}
 
-    async def __ainvoke_get_context(self, aos_hit, window_size, loop):
-        return await loop.run_in_executor(
-            None, get_context, aos_hit, self.index_name, window_size
-        )
-
-    async def __spawn_task(self, aos_hits, context_size):
-        loop = asyncio.get_event_loop()
-        task_list = []
-        for aos_hit in aos_hits:
-            if context_size:
-                task = asyncio.create_task(
-                    self.__ainvoke_get_context(aos_hit, context_size, loop)
-                )
-                task_list.append(task)
-        return await asyncio.gather(*task_list)
-
     @timeit
     def organize_results(
         self,
@@ -755,8 +1009,8 @@ class QueryDocumentBM25Retriever(BaseRetriever):
                 if doc:
                     result["doc"] = doc
         else:
-            response_list = asyncio.run(
-                self.__spawn_task(aos_hits, context_size))
+            response_list = get_batch_context(
+                aos_hits, aos_index, context_size)
             for context, result in zip(response_list, results):
                 result["doc"] = "\n".join(
                     context[0] + [result["doc"]] + context[1])
@@ -830,6 +1084,13 @@ class QueryDocumentBM25Retriever(BaseRetriever):
             )
         return doc_list
 
+    async def _aget_relevant_documents(
+        self, question: Dict, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return await run_in_executor(
+            self._get_relevant_documents, question, run_manager=run_manager.get_sync()
+        )
+
 
 def index_results_format(docs: list, threshold=-1):
     results = []
@@ -1,22 +1,161 @@
+import json
+import logging
 import os
 import threading
+import time
 
 import boto3
 from opensearchpy import OpenSearch, RequestsHttpConnection
 from requests_aws4auth import AWS4Auth
 
+logger = logging.getLogger("aos_utils")
+logger.setLevel(logging.INFO)
+
 open_search_client_lock = threading.Lock()
 
-credentials = boto3.Session().get_credentials()
+AOS_ENDPOINT = os.environ.get("AOS_ENDPOINT", "")
+AOS_DOMAIN_NAME = os.environ.get("AOS_DOMAIN_NAME", "smartsearch")
+AOS_SECRET_NAME = os.environ.get("AOS_SECRET_NAME", "opensearch-master-user")
+AOS_PORT = int(os.environ.get("AOS_PORT", 443))
+# retrievers search concurrently through the shared client
+AOS_POOL_MAXSIZE = int(os.environ.get("AOS_POOL_MAXSIZE", 20))
+# the endpoint and master user are resolved again in the background after
+# this many seconds, failed refreshes are retried after the retry interval
+AOS_CONNECTION_TTL = float(os.environ.get("AOS_CONNECTION_TTL", 3600))
+AOS_CONNECTION_RETRY_INTERVAL = float(
+    os.environ.get("AOS_CONNECTION_RETRY_INTERVAL", 60))
 
-region = boto3.Session().region_name
-awsauth = AWS4Auth(
-    credentials.access_key,
-    credentials.secret_key,
-    region,
-    "es",
-    session_token=credentials.token,
-)
+
+def get_iam_auth():
+    session = boto3.Session()
+    return AWS4Auth(
+        refreshable_credentials=session.get_credentials(),
+        region=session.region_name,
+        service="es",
+    )
+
+
+def create_opensearch_client(host, auth):
+    return OpenSearch(
+        hosts=[
+            {
+                "host": host.replace("https://", ""),
+                "port": AOS_PORT,
+            }
+        ],
+        http_auth=auth,
+        use_ssl=True,
+        verify_certs=True,
+        connection_class=RequestsHttpConnection,
+        pool_maxsize=AOS_POOL_MAXSIZE,
+    )
+
+
+class AOSConnectionManager:
+    """Resolve the OpenSearch endpoint and credentials once per container.
+
+    The master user comes from Secrets Manager, falling back to IAM auth
+    when there is no secret, and the endpoint from AOS_ENDPOINT or
+    describe_domain. The first call resolves them, later calls after
+    `ttl` get the cached values while they are refreshed in the background.
+    A single pooled OpenSearch client is shared by every caller and only
+    rebuilt when the endpoint or the master user changes.
+    """
+
+    def __init__(
+        self,
+        endpoint=AOS_ENDPOINT,
+        domain_name=AOS_DOMAIN_NAME,
+        secret_name=AOS_SECRET_NAME,
+        ttl=AOS_CONNECTION_TTL,
+        retry_interval=AOS_CONNECTION_RETRY_INTERVAL,
+    ):
+        self.endpoint = endpoint
+        self.domain_name = domain_name
+        self.secret_name = secret_name
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self._connection = None
+        self._client = None
+        self._client_key = None
+        self._expire_at = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def resolve_auth(self):
+        sm_client = boto3.client("secretsmanager")
+        try:
+            master_user = sm_client.get_secret_value(SecretId=self.secret_name)[
+                "SecretString"
+            ]
+        except sm_client.exceptions.ResourceNotFoundException:
+            logger.info(
+                f"Secret '{self.secret_name}' not found in Secrets Manager")
+            return None
+        except sm_client.exceptions.InvalidRequestException:
+            logger.info("InvalidRequestException. It might caused by getting secret value from a deleting secret")
+            logger.info("Fallback to authentication with IAM")
+            return None
+        cred = json.loads(master_user)
+        return (cred.get("username"), cred.get("password"))
+
+    def resolve_endpoint(self):
+        if self.endpoint:
+            return self.endpoint
+        opensearch_client = boto3.client("opensearch")
+        response = opensearch_client.describe_domain(
+            DomainName=self.domain_name)
+        return response["DomainStatus"]["Endpoint"]
+
+    def resolve_connection(self):
+        """Resolve (endpoint, master user), the master user is None for IAM auth"""
+        auth = self.resolve_auth()
+        return self.resolve_endpoint(), auth
+
+    def _refresh(self):
+        try:
+            connection = self.resolve_connection()
+            with self._lock:
+                self._connection = connection
+                self._expire_at = time.monotonic() + self.ttl
+        except Exception as e:
+            logger.error(f"failed to refresh the OpenSearch connection: {e}")
+            with self._lock:
+                self._expire_at = time.monotonic() + self.retry_interval
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get_connection(self):
+        with self._lock:
+            if self._connection is None:
+                try:
+                    self._connection = self.resolve_connection()
+                except Exception as e:
+                    logger.error(
+                        f"Error retrieving the OpenSearch connection: {str(e)}")
+                    raise
+                self._expire_at = time.monotonic() + self.ttl
+            elif not self._refreshing and time.monotonic() >= self._expire_at:
+                self._refreshing = True
+                threading.Thread(
+                    target=self._refresh, name="aos_connection_refresh", daemon=True
+                ).start()
+            return self._connection
+
+    def get_client(self):
+        connection = self.get_connection()
+        with self._lock:
+            if self._client is None or self._client_key != connection:
+                endpoint, auth = connection
+                self._client = create_opensearch_client(
+                    endpoint, auth if auth is not None else get_iam_auth()
+                )
+                self._client_key = connection
+            return self._client
+
+
+aos_connection = AOSConnectionManager()
 
 IMPORT_OPENSEARCH_PY_ERROR = (
     "Could not import OpenSearch. Please install it with `pip install opensearch-py`."
@@ -35,7 +174,7 @@ def _import_not_found_error():
 class LLMBotOpenSearchClient:
     instance = None
 
-    def __new__(cls, host, auth=None):
+    def __new__(cls, host=None, auth=None):
         with open_search_client_lock:
             if cls.instance is not None and cls.instance.host == host:
                 return cls.instance
@@ -43,30 +182,34 @@ class LLMBotOpenSearchClient:
             cls.instance = obj
             return obj
 
-    def __init__(self, host, auth=None):
+    def __init__(self, host=None, auth=None):
         """
-        Initialize OpenSearch client using OpenSearch Endpoint
+        Initialize OpenSearch client using OpenSearch Endpoint, without a
+        host the shared client of aos_connection is used
         """
+        if getattr(self, "host", False) == host and hasattr(self, "_client"):
+            # same instance returned by __new__, keep its client
+            return
         self.host = host
-        self.client = OpenSearch(
-            hosts=[
-                {
-                    "host": host.replace("https://", ""),
-                    "port": int(os.environ.get("AOS_PORT", 443)),
-                }
-            ],
-            http_auth=auth if auth is not None else awsauth,
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection,
-        )
+        self._client = None
+        if host is not None:
+            self._client = create_opensearch_client(
+                host, auth if auth is not None else get_iam_auth()
+            )
         self.query_match = {
             "knn": self._build_knn_search_query,
             "exact": self._build_exactly_match_query,
             "fuzzy": self._build_fuzzy_search_query,
             "basic": self._build_basic_search_query,
+            "terms": self._build_terms_search_query,
         }
 
+    @property
+    def client(self):
+        if self._client is not None:
+            return self._client
+        return aos_connection.get_client()
+
     def _build_basic_search_query(
         self, index_name, query_term, field, size, filter=None
     ):
@@ -94,6 +237,33 @@ class LLMBotOpenSearchClient:
 
         return query
 
+    def _build_terms_search_query(
+        self, index_name, query_term, field, size, filter=None
+    ):
+        """
+        Build terms search query, matching any of several exact values
+
+        :param index_name: Target Index Name
+        :param query_term: list of values to match, field should be mapped as keyword
+        :param field: search field
+        :param size: number of results to return from aos
+
+        :return: aos response json
+        """
+        query = {
+            "size": size,
+            "query": {
+                "bool": {
+                    "filter": [{"terms": {field: list(query_term)}}],
+                }
+            },
+            "_source": {"excludes": ["*.additional_vecs", "vector_field"]},
+        }
+        if filter:
+            query["query"]["bool"]["filter"].extend(filter)
+
+        return query
+
     def _build_fuzzy_search_query(
         self, index_name, query_term, field, size, filter=None
     ):
@@ -113,7 +283,9 @@ class LLMBotOpenSearchClient:
             "_source": {"excludes": ["*.additional_vecs", "vector_field"]},
         }
         if filter:
-            query["query"]["bool"]["filter"] = filter
+            query["query"] = {
+                "bool": {"must": [query["query"]], "filter": filter}
+            }
 
         return query
 
@@ -215,3 +387,31 @@ class LLMBotOpenSearchClient:
         )
         response = self.client.search(body=query, index=index_name)
         return response
+
+    def multi_search(self, index_name, searches):
+        """
+        Perform several searches on one index in a single msearch request
+
+        :param index_name: Target Index Name
+        :param searches: list of dict with the query_type, query_term, field,
+            size and filter arguments of search
+
+        :return: list of aos response json, a failed search has an error key
+        """
+        not_found_error = _import_not_found_error()
+        try:
+            self.client.indices.get(index=index_name)
+        except not_found_error:
+            return [[] for _ in searches]
+        body = []
+        for search in searches:
+            query = self.query_match[search["query_type"]](
+                index_name,
+                search["query_term"],
+                search.get("field", "text"),
+                search.get("size", 10),
+                search.get("filter"),
+            )
+            body.extend([{"index": index_name}, query])
+        response = self.client.msearch(body=body)
+        return response["responses"]
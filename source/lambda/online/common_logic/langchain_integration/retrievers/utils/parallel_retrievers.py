@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import wait
+from typing import Dict, List
+
+from common_logic.common_utils.async_utils import executor, run_in_executor
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain.docstore.document import Document
+from langchain.retrievers.merger_retriever import MergerRetriever
+
+logger = logging.getLogger("parallel_retrievers")
+logger.setLevel(logging.INFO)
+
+RETRIEVER_TIMEOUT = float(os.environ.get("RETRIEVER_TIMEOUT", 30))
+
+
+def interleave_documents(retriever_docs: List[List[Document]]) -> List[Document]:
+    """Merge documents rank by rank across retrievers, as MergerRetriever does"""
+    merged_documents = []
+    max_docs = max(map(len, retriever_docs), default=0)
+    for i in range(max_docs):
+        for docs in retriever_docs:
+            if i < len(docs):
+                merged_documents.append(docs[i])
+    return merged_documents
+
+
+class ParallelMergerRetriever(MergerRetriever):
+    """MergerRetriever that runs its retrievers concurrently.
+
+    The query is embedded once per (embedding model, prompt variant) before
+    the fan-out, and retrievers that do not finish within `timeout` seconds
+    are dropped from the merged results. Documents are merged in the same
+    order as MergerRetriever. The sync path runs retrievers on the shared
+    executor, the async path awaits their `ainvoke`.
+    """
+
+    timeout: float = RETRIEVER_TIMEOUT
+
+    def _embedding_retrievers(self) -> Dict:
+        embedding_retrievers = {}
+        for retriever in self.retrievers:
+            embedding_key = getattr(retriever, "embedding_key", None)
+            if embedding_key is not None:
+                embedding_retrievers.setdefault(embedding_key, retriever)
+        return embedding_retrievers
+
+    def prepare_query_embeddings(self, question: Dict) -> Dict:
+        futures = {
+            embedding_key: executor.submit(
+                retriever.embed_query, question["query"]
+            )
+            for embedding_key, retriever in self._embedding_retrievers().items()
+        }
+        query_embeddings = {}
+        for embedding_key, future in futures.items():
+            try:
+                query_embeddings[embedding_key] = future.result()
+            except Exception as e:
+                # the retriever will embed the query itself and surface the error
+                logger.error(f"failed to embed query with {embedding_key}: {e}")
+        return query_embeddings
+
+    async def aprepare_query_embeddings(self, question: Dict) -> Dict:
+        embedding_retrievers = self._embedding_retrievers()
+        results = await asyncio.gather(
+            *[
+                run_in_executor(retriever.embed_query, question["query"])
+                for retriever in embedding_retrievers.values()
+            ],
+            return_exceptions=True,
+        )
+        query_embeddings = {}
+        for embedding_key, result in zip(embedding_retrievers.keys(), results):
+            if isinstance(result, Exception):
+                # the retriever will embed the query itself and surface the error
+                logger.error(f"failed to embed query with {embedding_key}: {result}")
+                continue
+            query_embeddings[embedding_key] = result
+        return query_embeddings
+
+    def merge_documents(
+        self, query: Dict, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if isinstance(query, dict) and "query" in query:
+            query = {
+                **query,
+                "query_embeddings": self.prepare_query_embeddings(query),
+            }
+
+        futures = [
+            executor.submit(
+                retriever.invoke,
+                query,
+                config={
+                    "callbacks": run_manager.get_child(
+                        "retriever_{}".format(i + 1)
+                    )
+                },
+            )
+            for i, retriever in enumerate(self.retrievers)
+        ]
+        _, not_done = wait(futures, timeout=self.timeout)
+
+        retriever_docs = []
+        for retriever, future in zip(self.retrievers, futures):
+            if future in not_done:
+                future.cancel()
+                logger.warning(
+                    f"retriever {retriever.__class__.__name__} timed out after {self.timeout}s"
+                )
+                retriever_docs.append([])
+                continue
+            retriever_docs.append(future.result())
+
+        return interleave_documents(retriever_docs)
+
+    async def amerge_documents(
+        self, query: Dict, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if isinstance(query, dict) and "query" in query:
+            query = {
+                **query,
+                "query_embeddings": await self.aprepare_query_embeddings(query),
+            }
+
+        tasks = [
+            asyncio.ensure_future(
+                retriever.ainvoke(
+                    query,
+                    config={
+                        "callbacks": run_manager.get_child(
+                            "retriever_{}".format(i + 1)
+                        )
+                    },
+                )
+            )
+            for i, retriever in enumerate(self.retrievers)
+        ]
+        _, not_done = await asyncio.wait(tasks, timeout=self.timeout)
+
+        retriever_docs = []
+        for retriever, task in zip(self.retrievers, tasks):
+            if task in not_done:
+                task.cancel()
+                logger.warning(
+                    f"retriever {retriever.__class__.__name__} timed out after {self.timeout}s"
+                )
+                retriever_docs.append([])
+                continue
+            retriever_docs.append(task.result())
+
+        return interleave_documents(retriever_docs)
@@ -1,10 +1,17 @@
 from sm_utils import SagemakerEndpointVectorOrCross
+from common_logic.common_utils.async_utils import (
+    run_coroutine_sync,
+    run_in_executor,
+)
+from common_logic.common_utils.cache_utils import LRUCache
 from langchain.retrievers.document_compressors.base import BaseDocumentCompressor
 from langchain.schema import Document
 from langchain.callbacks.manager import Callbacks
 from typing import Dict, Optional, Sequence, Any
+import hashlib
 import json
 import os
+import re
 import time
 import logging
 import asyncio
@@ -14,36 +21,74 @@ logger.setLevel(logging.INFO)
 
 
 rerank_model_endpoint = os.environ.get("RERANK_ENDPOINT", "")
+# the reranker endpoint truncates every pair to this many tokens
+RERANK_MAX_LENGTH = 512
+RERANK_BATCH_TOKEN_BUDGET = int(
+    os.environ.get("RERANK_BATCH_TOKEN_BUDGET", 32 * RERANK_MAX_LENGTH))
+RERANK_CACHE_SIZE = int(os.environ.get("RERANK_CACHE_SIZE", 4096))
+
+rerank_score_cache = LRUCache(maxsize=RERANK_CACHE_SIZE)
+cjk_char_pattern = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def estimate_token_num(text: str):
+    """Roughly estimate the token number, one token per CJK char or four other chars"""
+    cjk_char_num = len(cjk_char_pattern.findall(text))
+    return cjk_char_num + (len(text) - cjk_char_num + 3) // 4
+
+
+def colbert_scores(query_reps, doc_reps_list, dtype=np.float32):
+    """Compute the ColBERT MaxSim score of the query against every document.
+
+    All document token vectors are concatenated so the similarities come from
+    a single matmul, then the max over each document's tokens is taken with a
+    segmented reduce. float16 inputs are computed in float32 since numpy has
+    no BLAS kernels for half precision.
+
+    Args:
+        query_reps: query token vectors, shape (query_len, dim)
+        doc_reps_list: list of document token vectors, each (doc_len, dim)
+        dtype: float32 or float16
+
+    Returns:
+        np.ndarray of shape (len(doc_reps_list),) with the scores
+    """
+    compute_dtype = np.float32 if np.dtype(dtype) == np.float16 else dtype
+    query_reps = np.asarray(query_reps, dtype=dtype).astype(
+        compute_dtype, copy=False)
+    scores = np.zeros(len(doc_reps_list), dtype=compute_dtype)
+    doc_lengths = np.array([len(doc_reps) for doc_reps in doc_reps_list])
+    non_empty = np.flatnonzero(doc_lengths)
+    if len(non_empty) == 0 or len(query_reps) == 0:
+        return scores
+    doc_reps = np.concatenate(
+        [np.asarray(doc_reps_list[i], dtype=dtype) for i in non_empty]
+    ).astype(compute_dtype, copy=False)
+    # (query_len, total_doc_len)
+    token_scores = query_reps @ doc_reps.T
+    offsets = np.concatenate(([0], np.cumsum(doc_lengths[non_empty])[:-1]))
+    max_scores = np.maximum.reduceat(token_scores, offsets, axis=1)
+    scores[non_empty] = max_scores.sum(axis=0)
+    return scores
 
-"""Document compressor that uses BGE reranker model."""
 
+def top_k_indices(scores, top_k=None):
+    """Indices of the top_k highest scores in descending order"""
+    if top_k is None or top_k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    candidate_indices = np.argpartition(-scores, top_k - 1)[:top_k]
+    return candidate_indices[np.argsort(-scores[candidate_indices], kind="stable")]
 
-class BGEM3Reranker(BaseDocumentCompressor):
 
-    """Number of documents to return."""
+"""Document compressor that uses BGE M3 colbert score."""
 
-    def _colbert_score_np(self, q_reps, p_reps):
-        token_scores = np.einsum('nik,njk->nij', q_reps, p_reps)
-        scores = token_scores.max(-1)
-        scores = np.sum(scores) / q_reps.shape[0]
-        return scores
 
-    async def __ainvoke_rerank_model(self, query_batch, doc_batch, loop):
-        return await loop.run_in_executor(None,
-                                          self._colbert_score_np,
-                                          np.asarray(query_batch),
-                                          np.asarray(doc_batch))
-
-    async def __spawn_task(self, query_colbert_list, doc_colbert_list):
-        batch_size = 1
-        task_list = []
-        loop = asyncio.get_event_loop()
-        for batch_start in range(0, len(query_colbert_list), batch_size):
-            task = asyncio.create_task(self.__ainvoke_rerank_model(
-                query_colbert_list[batch_start:batch_start + batch_size],
-                doc_colbert_list[batch_start:batch_start + batch_size], loop))
-            task_list.append(task)
-        return await asyncio.gather(*task_list)
+class BGEM3Reranker(BaseDocumentCompressor):
+
+    """Number of documents to return, all documents when not set."""
+    top_k: Optional[int] = None
+    """Dtype of the colbert vectors, float32 or float16."""
+    colbert_dtype: str = "float32"
 
     def compress_documents(
         self,
@@ -69,35 +114,38 @@ class BGEM3Reranker(BaseDocumentCompressor):
         _docs = [d.metadata["retrieval_data"]['colbert'] for d in doc_list]
 
         rerank_text_length = 1024 * 10
-        query_colbert_list = []
-        doc_colbert_list = []
-        for doc in _docs:
-            query_colbert_list.append(query["colbert"][:rerank_text_length])
-            doc_colbert_list.append(doc[:rerank_text_length])
-        score_list = []
+        query_colbert = query["colbert"][:rerank_text_length]
+        doc_colbert_list = [doc[:rerank_text_length] for doc in _docs]
         logger.info(
-            f'rerank pair num {len(query_colbert_list)}, m3 method: colbert score')
-        score_list = asyncio.run(self.__spawn_task(
-            query_colbert_list, doc_colbert_list))
+            f'rerank pair num {len(doc_colbert_list)}, m3 method: colbert score')
+        score_list = colbert_scores(
+            query_colbert, doc_colbert_list, dtype=np.dtype(self.colbert_dtype))
         final_results = []
         debug_info = query["debug_info"]
         debug_info["knowledge_qa_rerank"] = []
-        for doc, score in zip(doc_list, score_list):
+        for i in top_k_indices(score_list, self.top_k):
+            doc = doc_list[i]
+            score = float(score_list[i])
             doc.metadata["rerank_score"] = score
             # set common score for llm.
             doc.metadata["score"] = doc.metadata["rerank_score"]
             final_results.append(doc)
             debug_info["knowledge_qa_rerank"].append(
                 (doc.page_content, doc.metadata["retrieval_content"], doc.metadata["source"], score))
-        final_results.sort(
-            key=lambda x: x.metadata["rerank_score"], reverse=True)
-        debug_info["knowledge_qa_rerank"].sort(
-            key=lambda x: x[-1], reverse=True)
         recall_end_time = time.time()
         elpase_time = recall_end_time - start
         logger.info(f"runing time of rerank: {elpase_time}s seconds")
         return final_results
 
+    async def acompress_documents(
+        self,
+        documents: Sequence[Document],
+        query: dict,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        return await run_in_executor(
+            self.compress_documents, documents, query, callbacks)
+
 
 """Document compressor that uses BGE reranker model."""
 
@@ -110,34 +158,127 @@ class BGEReranker(BaseDocumentCompressor):
     target_model: Any
     rerank_model_endpoint: str = rerank_model_endpoint
     top_k: int = 10
+    """Estimated token budget of one endpoint request."""
+    batch_token_budget: int = RERANK_BATCH_TOKEN_BUDGET
+    """Maximum number of pairs in one endpoint request."""
+    max_batch_size: int = 128
+    """Stop scoring once the current top_k scores lead the latest batch by this margin."""
+    early_stop_margin: Optional[float] = None
+
+    def __init__(
+        self,
+        enable_debug=False,
+        rerank_model_endpoint=rerank_model_endpoint,
+        target_model=None,
+        top_k=10,
+        batch_token_budget=RERANK_BATCH_TOKEN_BUDGET,
+        max_batch_size=128,
+        early_stop_margin=None,
+    ):
+        super().__init__(
+            enable_debug=enable_debug,
+            rerank_model_endpoint=rerank_model_endpoint,
+            target_model=target_model,
+            top_k=top_k,
+            batch_token_budget=batch_token_budget,
+            max_batch_size=max_batch_size,
+            early_stop_margin=early_stop_margin,
+        )
+
+    def _pair_cache_key(self, rerank_pair):
+        pair_hash = hashlib.sha1(
+            json.dumps(rerank_pair, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        return (self.rerank_model_endpoint, self.target_model, pair_hash)
+
+    def _split_batches(self, rerank_pairs):
+        """Split pairs into batches bounded by the estimated token budget"""
+        batches = []
+        batch = []
+        batch_token_num = 0
+        for rerank_pair in rerank_pairs:
+            pair_token_num = min(
+                estimate_token_num(rerank_pair[0]) +
+                estimate_token_num(rerank_pair[1]),
+                RERANK_MAX_LENGTH,
+            )
+            if batch and (
+                batch_token_num + pair_token_num > self.batch_token_budget
+                or len(batch) >= self.max_batch_size
+            ):
+                batches.append(batch)
+                batch = []
+                batch_token_num = 0
+            batch.append(rerank_pair)
+            batch_token_num += pair_token_num
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _invoke_rerank_model(self, batch):
+        logging.info("invoke endpoint")
+        response = SagemakerEndpointVectorOrCross(
+            json.dumps(batch),
+            self.rerank_model_endpoint,
+            None,
+            "rerank",
+            None,
+            self.target_model,
+        )
+        scores = json.loads(response)
+        # the endpoint returns a bare score for a single pair
+        if not isinstance(scores, list):
+            scores = [scores]
+        for rerank_pair, score in zip(batch, scores):
+            rerank_score_cache.set(self._pair_cache_key(rerank_pair), score)
+        return scores
 
-    def __init__(self, enable_debug=False, rerank_model_endpoint=rerank_model_endpoint, target_model=None, top_k=10):
-        super().__init__()
-        self.enable_debug = enable_debug
-        self.rerank_model_endpoint = rerank_model_endpoint
-        self.target_model = target_model
-        self.top_k = top_k
+    async def _ascore_pairs(self, rerank_pairs):
+        """Score unique pairs, returning a dict from pair index to score.
 
-    async def __ainvoke_rerank_model(self, batch, loop):
-        logging.info("invoke endpoint")
-        return await loop.run_in_executor(None,
-                                          SagemakerEndpointVectorOrCross,
-                                          json.dumps(batch),
-                                          self.rerank_model_endpoint,
-                                          None,
-                                          "rerank",
-                                          None,
-                                          self.target_model)
-
-    async def __spawn_task(self, rerank_pair):
-        batch_size = 128
-        task_list = []
-        loop = asyncio.get_event_loop()
-        for batch_start in range(0, len(rerank_pair), batch_size):
-            task = asyncio.create_task(self.__ainvoke_rerank_model(
-                rerank_pair[batch_start:batch_start + batch_size], loop))
-            task_list.append(task)
-        return await asyncio.gather(*task_list)
+        Pairs are scored in their retrieval order. With early_stop_margin set,
+        batches are sent one at a time and the remaining pairs are skipped once
+        the top_k scores lead the best score of the latest batch by the margin.
+        """
+        pair_scores = {}
+        pending_indexes = []
+        for pair_index, rerank_pair in enumerate(rerank_pairs):
+            score = rerank_score_cache.get(self._pair_cache_key(rerank_pair))
+            if score is None:
+                pending_indexes.append(pair_index)
+            else:
+                pair_scores[pair_index] = score
+        index_batches = []
+        for batch in self._split_batches([rerank_pairs[i] for i in pending_indexes]):
+            index_batches.append(pending_indexes[:len(batch)])
+            pending_indexes = pending_indexes[len(batch):]
+        logger.info(
+            f"rerank pair num {len(rerank_pairs)}, cached {len(pair_scores)}, batch num {len(index_batches)}")
+
+        if self.early_stop_margin is None:
+            response_list = await asyncio.gather(*[
+                run_in_executor(
+                    self._invoke_rerank_model,
+                    [rerank_pairs[i] for i in batch]
+                )
+                for batch in index_batches
+            ])
+            for batch, scores in zip(index_batches, response_list):
+                pair_scores.update(zip(batch, scores))
+            return pair_scores
+
+        for batch in index_batches:
+            scores = await run_in_executor(
+                self._invoke_rerank_model, [rerank_pairs[i] for i in batch])
+            pair_scores.update(zip(batch, scores))
+            if len(pair_scores) < self.top_k:
+                continue
+            top_k_score = sorted(pair_scores.values(), reverse=True)[self.top_k - 1]
+            if top_k_score - max(scores) >= self.early_stop_margin:
+                logger.info(
+                    f"rerank early stop after {len(pair_scores)} of {len(rerank_pairs)} pairs")
+                break
+        return pair_scores
 
     def compress_documents(
         self,
@@ -148,6 +289,20 @@ class BGEReranker(BaseDocumentCompressor):
         """
         Compress documents using BGE rerank model.
 
+        Sync facade of acompress_documents, running on the shared event loop.
+        """
+        return run_coroutine_sync(
+            self.acompress_documents(documents, query, callbacks))
+
+    async def acompress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        """
+        Compress documents using BGE rerank model.
+
         Args:
             documents: A sequence of documents to compress.
             query: The query to use for compressing the documents.
@@ -162,20 +317,29 @@ class BGEReranker(BaseDocumentCompressor):
         doc_list = list(documents)
         _docs = [d.metadata["retrieval_content"] for d in doc_list]
 
-        rerank_pair = []
+        # identical passages from different retrievers are scored once
         rerank_text_length = 1024 * 10
+        rerank_pairs = []
+        pair_index_map = {}
+        doc_pair_indexes = []
         for doc in _docs:
-            rerank_pair.append([query["query"], doc[:rerank_text_length]])
-        score_list = []
+            rerank_pair = [query["query"], doc[:rerank_text_length]]
+            pair_key = tuple(rerank_pair)
+            if pair_key not in pair_index_map:
+                pair_index_map[pair_key] = len(rerank_pairs)
+                rerank_pairs.append(rerank_pair)
+            doc_pair_indexes.append(pair_index_map[pair_key])
         logger.info(
-            f'rerank pair num {len(rerank_pair)}, endpoint_name: {self.rerank_model_endpoint}')
-        response_list = asyncio.run(self.__spawn_task(rerank_pair))
-        for response in response_list:
-            score_list.extend(json.loads(response))
+            f'rerank doc num {len(doc_list)}, endpoint_name: {self.rerank_model_endpoint}')
+        pair_scores = await self._ascore_pairs(rerank_pairs)
         final_results = []
         debug_info = query["debug_info"]
         debug_info["knowledge_qa_rerank"] = []
-        for doc, score in zip(doc_list, score_list):
+        for doc, pair_index in zip(doc_list, doc_pair_indexes):
+            if pair_index not in pair_scores:
+                # skipped by early stop
+                continue
+            score = pair_scores[pair_index]
             doc.metadata["rerank_score"] = score
             # set common score for llm.
             doc.metadata["retrieval_score"] = doc.metadata["retrieval_score"]
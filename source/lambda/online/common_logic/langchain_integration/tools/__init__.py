@@ -1,15 +1,13 @@
 from typing import Optional, Union
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, create_model
 import platform
+import hashlib
 import json
 import inspect
+import keyword
 from functools import wraps
 import types
 
-from datamodel_code_generator import DataModelType, PythonVersion
-from datamodel_code_generator.format import DatetimeClassType
-from datamodel_code_generator.model import get_data_model_types
-from datamodel_code_generator.parser.jsonschema import JsonSchemaParser
 from langchain.tools.base import StructuredTool as _StructuredTool, BaseTool
 from common_logic.common_utils.constant import SceneType
 from common_logic.common_utils.lambda_invoke_utils import invoke_with_lambda
@@ -29,14 +27,74 @@ class ToolIdentifier(BaseModel):
         return f"{self.scene}__{self.name}"
 
 
+# json schema types that can be mapped to python types directly
+SIMPLE_JSON_SCHEMA_TYPES = {
+    "string": str,
+    "integer": int,
+    "number": float,
+    "boolean": bool,
+}
+SIMPLE_PROPERTY_KEYS = {"type", "description"}
+
+
+def get_tool_def_hash(tool_def: dict):
+    tool_def_str = json.dumps(tool_def, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(tool_def_str.encode("utf-8")).hexdigest()
+
+
+def is_flat_tool_def(tool_def: dict):
+    """Whether every property is a described primitive, so no codegen is needed"""
+    if set(tool_def.keys()) - {"description", "properties", "required", "type", "title"}:
+        return False
+    properties = tool_def.get("properties", {})
+    if not isinstance(properties, dict):
+        return False
+    for property_name, property_def in properties.items():
+        if not property_name.isidentifier() or property_name.startswith("_") \
+                or keyword.iskeyword(property_name):
+            return False
+        if not isinstance(property_def, dict) \
+                or set(property_def.keys()) - SIMPLE_PROPERTY_KEYS \
+                or property_def.get("type") not in SIMPLE_JSON_SCHEMA_TYPES:
+            return False
+    return set(tool_def.get("required", [])).issubset(properties.keys())
+
+
 class ToolManager:
     tool_map = {}
+    # pydantic models generated from tool definitions, keyed by tool definition hash
+    tool_def_model_map = {}
 
     @staticmethod
-    def convert_tool_def_to_pydantic(tool_id, tool_def: Union[dict, BaseModel]):
-        if not isinstance(tool_def, dict):
-            return tool_def
-        # convert tool definition to pydantic model
+    def create_flat_tool_model(tool_def: dict):
+        required = set(tool_def.get("required", []))
+        fields = {}
+        for property_name, property_def in tool_def.get("properties", {}).items():
+            python_type = SIMPLE_JSON_SCHEMA_TYPES[property_def["type"]]
+            if property_name in required:
+                fields[property_name] = (
+                    python_type,
+                    Field(..., description=property_def.get("description"))
+                )
+            else:
+                fields[property_name] = (
+                    Optional[python_type],
+                    Field(None, description=property_def.get("description"))
+                )
+        return create_model(
+            "Model",
+            __doc__=tool_def.get("description"),
+            **fields
+        )
+
+    @staticmethod
+    def generate_tool_model(tool_id, tool_def: dict):
+        # codegen is slow to import and only needed for nested tool definitions
+        from datamodel_code_generator import DataModelType, PythonVersion
+        from datamodel_code_generator.format import DatetimeClassType
+        from datamodel_code_generator.model import get_data_model_types
+        from datamodel_code_generator.parser.jsonschema import JsonSchemaParser
+
         current_python_version = ".".join(
             platform.python_version().split(".")[:-1])
         data_model_types = get_data_model_types(
@@ -60,6 +118,23 @@ class ToolManager:
         model_cls = new_tool_module.Model
         return model_cls
 
+    @classmethod
+    def convert_tool_def_to_pydantic(cls, tool_id, tool_def: Union[dict, BaseModel]):
+        if not isinstance(tool_def, dict):
+            return tool_def
+        # convert tool definition to pydantic model, models are reused
+        # across requests as long as the tool definition is unchanged
+        tool_def_hash = get_tool_def_hash(tool_def)
+        model_cls = cls.tool_def_model_map.get(tool_def_hash)
+        if model_cls is not None:
+            return model_cls
+        if is_flat_tool_def(tool_def):
+            model_cls = cls.create_flat_tool_model(tool_def)
+        else:
+            model_cls = cls.generate_tool_model(tool_id, tool_def)
+        cls.tool_def_model_map[tool_def_hash] = model_cls
+        return model_cls
+
     @staticmethod
     def get_tool_identifier(scene=None, name=None, tool_identifier=None):
         if tool_identifier is None:
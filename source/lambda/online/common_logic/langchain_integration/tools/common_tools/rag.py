@@ -5,7 +5,6 @@ from common_logic.common_utils.constant import (
     Threshold
 )
 from common_logic.common_utils.lambda_invoke_utils import send_trace
-from common_logic.langchain_integration.retrievers.retriever import lambda_handler as retrieve_fn
 from common_logic.langchain_integration.chains import LLMChain
 from common_logic.common_utils.monitor_utils import format_rag_data
 from typing import Iterable
@@ -81,6 +80,7 @@ def filter_response(res: Iterable, state: dict):
 
 
 def rag_tool(retriever_config: dict, query=None):
+    from common_logic.langchain_integration.retrievers.retriever import lambda_handler as retrieve_fn
     state = StateContext.get_current_state()
     context_list = []
     # Add QQ match results
@@ -4,7 +4,6 @@ import os
 
 from common_logic.common_utils.logger_utils import get_logger
 from common_logic.common_utils.lambda_invoke_utils import chatbot_lambda_call_wrapper, invoke_lambda
-from common_logic.langchain_integration.retrievers.retriever import lambda_handler as retrieve_fn
 
 logger = get_logger("intention")
 kb_enabled = os.environ["KNOWLEDGE_BASE_ENABLED"].lower() == "true"
@@ -23,6 +22,8 @@ def get_intention_results(query: str, intention_config: dict, intent_threshold:
     Returns:
         intent_fewshot_examples (dict): retrieved few shot examples
     """
+    from common_logic.langchain_integration.retrievers.retriever import lambda_handler as retrieve_fn
+
     event_body = {
         "query": query,
         "type": "qq",
@@ -10,7 +10,6 @@ import threading
 # import re
 from functools import lru_cache
 
-import boto3
 from langchain.docstore.document import Document
 
 # from functools import partial
@@ -24,7 +23,9 @@ from langchain_community.vectorstores.opensearch_vector_search import (
 # from langchain_community.embeddings.sagemaker_endpoint import (
 #     SagemakerEndpointEmbeddings
 # )
-from requests_aws4auth import AWS4Auth
+from common_logic.langchain_integration.retrievers.utils.aos_utils import (
+    aos_connection,
+)
 
 
 # from ..retriever import QueryDocumentRetriever, QueryQuestionRetriever,index_results_format
@@ -50,7 +51,7 @@ class LangchainOpenSearchClient:
         cls,
         index_name,
         embedding_endpoint_name,
-        host=os.environ.get("AOS_ENDPOINT", None),
+        host=None,
     ):
         identity = f"{index_name}_{host}_{embedding_endpoint_name}"
         with opensearch_client_lock:
@@ -66,27 +67,27 @@ class LangchainOpenSearchClient:
         cls,
         index_name,
         embedding_endpoint_name,
-        host=os.environ.get("AOS_ENDPOINT", None),
+        host=None,
         region_name=os.environ["AWS_REGION"],
     ):
+        """Without a host, the endpoint and the pooled OpenSearch client are
+        shared with the retrievers through aos_connection"""
         embedding = BGEM3EmbeddingSagemakerEndpoint(
             endpoint_name=embedding_endpoint_name, region_name=region_name
         )
+        shared_client = host is None
+        if shared_client:
+            host, _ = aos_connection.get_connection()
+        host = host.replace("https://", "")
         port = int(os.environ.get("AOS_PORT", 443))
         opensearch_url = f"https://{host}:{port}"
-        credentials = boto3.Session().get_credentials()
-        awsauth = AWS4Auth(
-            credentials.access_key,
-            credentials.secret_key,
-            region_name,
-            "es",
-            session_token=credentials.token,
-        )
         opensearch_client = OpenSearchVectorSearch(
             index_name=index_name,
             embedding_function=embedding,
             opensearch_url=opensearch_url,
         )
+        if shared_client:
+            opensearch_client.client = aos_connection.get_client()
         return opensearch_client
 
 
@@ -96,7 +97,7 @@ class IntentRecognitionAOSIndex:
         intent_example_path=intent_example_path,
         index_name=None,
         embedding_endpoint_name=None,
-        host=os.environ.get("AOS_ENDPOINT", None),
+        host=None,
     ):
         if index_name is None:
             index_name = self.create_index_name(
@@ -5,6 +5,8 @@ from datetime import datetime, timezone
 
 import boto3
 from botocore.exceptions import ClientError
+from common_logic.common_utils.async_utils import executor
+from common_logic.common_utils.chatbot_utils import ChatbotManager
 from common_logic.common_utils.constant import EntryType
 from common_logic.common_utils.ddb_utils import DynamoDBChatMessageHistory
 from common_logic.common_utils.lambda_invoke_utils import (
@@ -13,6 +15,7 @@ from common_logic.common_utils.lambda_invoke_utils import (
     send_trace
 )
 from common_logic.common_utils.logger_utils import get_logger
+from common_logic.common_utils.prompt_utils import preload_prompt_templates
 from common_logic.common_utils.websocket_utils import load_ws_client
 from lambda_main.main_utils.online_entries import get_entry
 from common_logic.common_utils.response_utils import process_response
@@ -184,6 +187,59 @@ def compose_connect_body(event_body: dict, context: dict):
     return agent_flow_body
 
 
+def get_chat_history(ddb_history_obj: DynamoDBChatMessageHistory, chatbot_config: dict):
+    """Load only the newest history rounds kept in memory by the chatbot
+
+    Args:
+        ddb_history_obj (DynamoDBChatMessageHistory): The chat history of the session
+        chatbot_config (dict): The chatbot config of the request
+
+    Returns:
+        list: The chat history, oldest first
+    """
+    if str(chatbot_config.get("use_history", "true")).lower() != "true":
+        return []
+    max_rounds = chatbot_config.get("max_rounds_in_memory")
+    return ddb_history_obj.get_messages_as_langchain(
+        max_rounds=int(max_rounds) if max_rounds is not None else None
+    )
+
+
+def bootstrap_request(ddb_history_obj: DynamoDBChatMessageHistory, assembled_body: dict, chatbot_config: dict):
+    """Load the chat history, chatbot and prompt templates of a request concurrently
+
+    The chatbot lands in the ChatbotManager cache and the prompt templates in
+    the prompt template manager, so the graph reads them from memory.
+
+    Args:
+        ddb_history_obj (DynamoDBChatMessageHistory): The chat history of the session
+        assembled_body (dict): The assembled event body
+        chatbot_config (dict): The chatbot config of the request
+
+    Returns:
+        list: The chat history, oldest first
+    """
+    group_name = assembled_body["group_name"]
+    chatbot_id = assembled_body["chatbot_id"]
+    history_future = executor.submit(
+        get_chat_history, ddb_history_obj, chatbot_config)
+    prefetch_futures = {
+        "chatbot": executor.submit(
+            ChatbotManager.from_environ().get_chatbot, group_name, chatbot_id),
+        # some nodes read the prompts of the admin chatbot
+        "prompt templates": executor.submit(
+            preload_prompt_templates, group_name,
+            list(dict.fromkeys([chatbot_id, "admin"]))),
+    }
+    for name, future in prefetch_futures.items():
+        try:
+            future.result()
+        except Exception:
+            # loaded again, and the error surfaced, where it is used
+            logger.error(f"failed to prefetch {name}: {traceback.format_exc()}")
+    return history_future.result()
+
+
 def assemble_event_body(event_body: dict, context: dict):
     """
     Assembles the event body for processing based on the provided event body and context.
@@ -277,7 +333,8 @@ def restapi_event_handler(event_body: dict, context: dict, entry_executor):
 
     ddb_history_obj = create_ddb_history_obj(
         assembled_body["session_id"], assembled_body["user_id"], assembled_body["client_type"], assembled_body["group_name"], assembled_body["chatbot_id"])
-    chat_history = ddb_history_obj.messages_as_langchain
+    chat_history = bootstrap_request(
+        ddb_history_obj, assembled_body, event_body.get("chatbot_config", {}))
 
     standard_event_body = {
         "query": event_body["query"],
@@ -331,7 +388,8 @@ def default_event_handler(event_body: dict, context: dict, entry_executor):
 
     ddb_history_obj = create_ddb_history_obj(
         assembled_body["session_id"], assembled_body["user_id"], assembled_body["client_type"], assembled_body["group_name"], assembled_body["chatbot_id"])
-    chat_history = ddb_history_obj.messages_as_langchain
+    chat_history = bootstrap_request(
+        ddb_history_obj, assembled_body, event_body.get("chatbot_config", {}))
 
     event_body["stream"] = context["stream"]
     event_body["chat_history"] = chat_history
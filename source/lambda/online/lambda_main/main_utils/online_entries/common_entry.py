@@ -6,6 +6,7 @@ from typing import Annotated, Any, TypedDict, List, Union
 
 from common_logic.common_utils.chatbot_utils import ChatbotManager
 from common_logic.common_utils.constant import (
+    ChatbotMode,
     IndexType,
     LLMTaskType,
     SceneType,
@@ -31,14 +32,12 @@ from common_logic.common_utils.serialization_utils import JSONEncoder
 from common_logic.common_utils.monitor_utils import format_intention_output, format_preprocess_output, format_qq_data
 from common_logic.common_utils.ddb_utils import custom_index_desc
 from lambda_main.main_utils.parse_config import CommonConfigParser
-from langgraph.graph import END, StateGraph
-from common_logic.langchain_integration.retrievers.retriever import lambda_handler as retrieve_fn
+from langgraph.graph import END, START, StateGraph
 from common_logic.common_utils.monitor_utils import (
     format_preprocess_output,
     format_qq_data,
     format_intention_output
 )
-from lambda_intention_detection.intention import get_intention_results
 from lambda_query_preprocess.query_preprocess import conversation_query_rewrite
 from common_logic.langchain_integration.chains import LLMChain
 from common_logic.common_utils.serialization_utils import JSONEncoder
@@ -47,6 +46,18 @@ from common_logic.common_utils.serialization_utils import JSONEncoder
 logger = get_logger("common_entry")
 
 
+# the retriever and intention modules bootstrap OpenSearch clients and
+# embedding endpoints, they are only imported by requests that retrieve
+def retrieve_fn(event_body: dict):
+    from common_logic.langchain_integration.retrievers.retriever import lambda_handler
+    return lambda_handler(event_body)
+
+
+def get_intention_results(query: str, intention_config: dict, intent_threshold: float):
+    from lambda_intention_detection.intention import get_intention_results
+    return get_intention_results(query, intention_config, intent_threshold=intent_threshold)
+
+
 class ChatbotState(TypedDict):
     ########### input/output states ###########
     # inputs
@@ -83,6 +94,8 @@ class ChatbotState(TypedDict):
     query_rewrite: str = None
 
     ########### intention detection states ###########
+    # lookups run on the raw query in parallel with query rewrite
+    speculative_intention: dict = None
     # intention type of retrieved intention samples in search engine, e.g. OpenSearch
     intent_type: str = None
     # retrieved intention samples in search engine, e.g. OpenSearch
@@ -155,20 +168,103 @@ def query_preprocess(state: ChatbotState):
     return {"query_rewrite": output}
 
 
+def get_lookup_queries(state: dict) -> dict:
+    """Queries used by the qq match, intention and knowledge lookups"""
+    chatbot_config = state["chatbot_config"]
+    queries = {}
+    for lookup_name, config_key in [
+        ("qq_match", "qq_match_config"),
+        ("intention", "intention_config"),
+        ("private_knowledge", "private_knowledge_config"),
+    ]:
+        query_key = chatbot_config.get(config_key, {}).get(
+            "retriever_config", {}).get("query_key", "query")
+        queries[lookup_name] = state.get(query_key)
+    return queries
+
+
+def run_intention_lookups(chatbot_config: dict, queries: dict) -> dict:
+    """Run the qq match, intention and knowledge retrievals.
+
+    The retriever configs are copied rather than updated in place, so the
+    lookups can safely run alongside other nodes of the graph.
+    """
+    qq_match_config = chatbot_config["qq_match_config"]
+    output = retrieve_fn({**qq_match_config, "query": queries["qq_match"]})
+    lookups = {"qq_match_docs": output["result"]["docs"]}
+
+    qq_match_found = any(
+        doc["retrieval_score"] > qq_match_config["qq_match_threshold"]
+        for doc in lookups["qq_match_docs"]
+    )
+    if qq_match_found or chatbot_config["agent_config"]["only_use_rag_tool"]:
+        return lookups
+
+    # get intention results from aos
+    intention_config = chatbot_config.get("intention_config", {})
+    intent_fewshot_examples, intention_ready = get_intention_results(
+        queries["intention"],
+        {
+            **intention_config,
+        },
+        intent_threshold=intention_config['intent_threshold']
+    )
+    lookups["intent_fewshot_examples"] = intent_fewshot_examples
+    lookups["intention_ready"] = intention_ready
+
+    group_name = chatbot_config["group_name"]
+    chatbot_id = chatbot_config["chatbot_id"]
+    custom_qd_index = custom_index_desc(group_name, chatbot_id)
+
+    # TODO need to modify with new intent logic
+    if not intention_ready and not custom_qd_index:
+        # retrieve all knowledge
+        output = retrieve_fn({
+            **chatbot_config["private_knowledge_config"],
+            "query": queries["private_knowledge"]
+        })
+        lookups["all_knowledge_docs"] = output["result"]["docs"]
+    return lookups
+
+
+def speculative_intention_detection(state: ChatbotState):
+    # runs alongside query_preprocess on the raw query, intention_detection
+    # reuses the lookups if the rewrite leaves the lookup queries unchanged.
+    # not monitored: its traces would interleave with query_preprocess and
+    # show up even when the result is discarded, the lookups are traced by
+    # intention_detection when they are used
+    if state["chatbot_config"]["chatbot_mode"] != ChatbotMode.agent:
+        return {}
+
+    queries = {lookup_name: state["query"]
+               for lookup_name in get_lookup_queries(state)}
+    try:
+        lookups = run_intention_lookups(state["chatbot_config"], queries)
+    except Exception as e:
+        logger.error(f"speculative intention detection failed: {e}")
+        return {}
+    return {"speculative_intention": {"queries": queries, "lookups": lookups}}
+
+
 @node_monitor_wrapper
 def intention_detection(state: ChatbotState):
-    retriever_params = state["chatbot_config"]["qq_match_config"]
-    retriever_params["query"] = state[
-        retriever_params.get("retriever_config", {}).get("query_key", "query")
-    ]
+    chatbot_config = state["chatbot_config"]
+    queries = get_lookup_queries(state)
+    speculative_intention = state.get("speculative_intention") or {}
+    if speculative_intention.get("queries") == queries:
+        lookups = speculative_intention["lookups"]
+    else:
+        if speculative_intention:
+            logger.info(
+                "query rewrite changed the lookup queries, discard the speculative intention detection")
+        lookups = run_intention_lookups(chatbot_config, queries)
 
-    output = retrieve_fn(retriever_params)
     context_list = []
     qq_match_contexts = []
-    qq_match_threshold = retriever_params["qq_match_threshold"]
-    qq_in_rag_context_threshold = retriever_params["qq_in_rag_context_threshold"]
+    qq_match_threshold = chatbot_config["qq_match_config"]["qq_match_threshold"]
+    qq_in_rag_context_threshold = chatbot_config["qq_match_config"]["qq_in_rag_context_threshold"]
 
-    for doc in output["result"]["docs"]:
+    for doc in lookups["qq_match_docs"]:
         if doc["retrieval_score"] > qq_match_threshold:
             doc_md = format_qq_data(doc)
             send_trace(
@@ -190,26 +286,15 @@ def intention_detection(state: ChatbotState):
             context_list.append(f"问题: {question}, \n答案：{answer}")
             qq_match_contexts.append(doc)
 
-    if state["chatbot_config"]["agent_config"]["only_use_rag_tool"]:
+    if chatbot_config["agent_config"]["only_use_rag_tool"]:
         return {
             "qq_match_results": context_list,
             "intent_type": "intention detected"
         }
 
-    # get intention results from aos
-    intention_config = state["chatbot_config"].get("intention_config", {})
-    query_key = intention_config.get(
-        "retriever_config", {}).get("query_key", "query")
-    query = state[query_key]
-    intent_threshold = intention_config['intent_threshold']
+    intention_config = chatbot_config.get("intention_config", {})
     all_knowledge_in_agent_threshold = intention_config['all_knowledge_in_agent_threshold']
-    intent_fewshot_examples, intention_ready = get_intention_results(
-        query,
-        {
-            **intention_config,
-        },
-        intent_threshold=intent_threshold
-    )
+    intent_fewshot_examples = lookups["intent_fewshot_examples"]
 
     intent_fewshot_tools: list[str] = list(
         set([e["intent"] for e in intent_fewshot_examples])
@@ -217,24 +302,9 @@ def intention_detection(state: ChatbotState):
     all_knowledge_retrieved_list = []
     markdown_table = format_intention_output(intent_fewshot_examples)
 
-    group_name = state["chatbot_config"]["group_name"]
-    chatbot_id = state["chatbot_config"]["chatbot_id"]
-    custom_qd_index = custom_index_desc(group_name, chatbot_id)
-
-    # TODO need to modify with new intent logic
-    if not intention_ready and not custom_qd_index:
-        # if not intention_ready:
-        # retrieve all knowledge
-        retriever_params = state["chatbot_config"]["private_knowledge_config"]
-        retriever_params["query"] = state[
-            retriever_params.get("retriever_config", {}).get(
-                "query_key", "query")
-        ]
-        output = retrieve_fn(retriever_params)
-
+    if "all_knowledge_docs" in lookups:
         info_to_log = []
-        all_knowledge_retrieved_list = []
-        for doc in output["result"]["docs"]:
+        for doc in lookups["all_knowledge_docs"]:
             if doc['score'] >= all_knowledge_in_agent_threshold:
                 all_knowledge_retrieved_list.append(doc["page_content"])
             info_to_log.append(
@@ -496,6 +566,8 @@ def build_graph(chatbot_state_cls):
 
     # add node for all chat/rag/agent mode
     workflow.add_node("query_preprocess", query_preprocess)
+    workflow.add_node("speculative_intention_detection",
+                      speculative_intention_detection)
     # chat mode
     workflow.add_node("llm_direct_results_generation",
                       llm_direct_results_generation)
@@ -512,7 +584,11 @@ def build_graph(chatbot_state_cls):
     workflow.add_node("final_results_preparation", final_results_preparation)
 
     # add all edges
-    workflow.set_entry_point("query_preprocess")
+    # intention lookups on the raw query run in parallel with query rewrite,
+    # nodes of the next step wait for both to finish
+    workflow.add_edge(START, "query_preprocess")
+    workflow.add_edge(START, "speculative_intention_detection")
+    workflow.add_edge("speculative_intention_detection", END)
     # chat mode
     workflow.add_edge("llm_direct_results_generation",
                       "final_results_preparation")
@@ -677,7 +753,9 @@ def common_entry(event_body):
     query = event_body["query"]
     use_history = chatbot_config["use_history"]
     max_rounds_in_memory = event_body["chatbot_config"]["max_rounds_in_memory"]
-    chat_history = event_body["chat_history"][:max_rounds_in_memory] if use_history else []
+    # a round is a question and its answer, keep the newest rounds
+    chat_history = event_body["chat_history"][-2 * max_rounds_in_memory:] \
+        if use_history and max_rounds_in_memory > 0 else []
     stream = event_body["stream"]
     message_id = event_body["custom_message_id"]
     ws_connection_id = event_body["ws_connection_id"]
@@ -0,0 +1,104 @@
+"""Measure the cold start import cost of the online lambda.
+
+Each module is imported in a fresh interpreter with `python -X importtime`,
+so nothing is shared with a previous import, the same as a lambda cold start.
+
+Usage, from source/lambda/online:
+    python lambda_main/test/cold_start_benchmark.py
+    python lambda_main/test/cold_start_benchmark.py --top 30 lambda_main.main
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ONLINE_DIR = os.path.dirname(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_MODULES = [
+    "lambda_main.main",
+    "lambda_main.main_utils.online_entries.common_entry",
+    "common_logic.langchain_integration.retrievers.retriever",
+]
+
+# modules that chat-only and agent-without-RAG requests should never load
+RETRIEVAL_ONLY_MODULES = [
+    "opensearchpy",
+    "datamodel_code_generator",
+    "common_logic.langchain_integration.retrievers.retriever",
+    "common_logic.langchain_integration.retrievers.utils.aos_retrievers",
+    "lambda_intention_detection.intention",
+]
+
+# environment variables read at import time
+DEFAULT_ENV = {
+    "AWS_REGION": "us-east-1",
+    "KNOWLEDGE_BASE_ENABLED": "true",
+    "KNOWLEDGE_BASE_TYPE": "{}",
+}
+
+
+def parse_import_times(stderr: str):
+    """Parse `-X importtime` output into {module: (self_us, cumulative_us)}"""
+    import_times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        import_times[module.strip()] = (int(self_us), int(cumulative_us))
+    return import_times
+
+
+def benchmark_module(module: str):
+    env = {**DEFAULT_ENV, **os.environ}
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [ONLINE_DIR, env.get("PYTHONPATH")]))
+    check_modules = ",".join(RETRIEVAL_ONLY_MODULES)
+    code = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in '{check_modules}'.split(',') if m in sys.modules))"
+    )
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ONLINE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1]
+        raise RuntimeError(f"failed to import {module}: {error}")
+    loaded = [m for m in result.stdout.strip().split(",") if m]
+    return elapsed, parse_import_times(result.stderr), loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=20,
+                        help="number of slowest modules to report")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        try:
+            elapsed, import_times, loaded = benchmark_module(module)
+        except RuntimeError as e:
+            print(e)
+            continue
+        total_us = import_times.get(module, (0, 0))[1]
+        print(f"\n{module}: {total_us / 1e6:.2f}s import, "
+              f"{elapsed:.2f}s interpreter wall time, {len(import_times)} modules")
+        print(f"{'cumulative [s]':>15} {'self [s]':>10}  module")
+        slowest = sorted(import_times.items(),
+                         key=lambda x: x[1][1], reverse=True)
+        for name, (self_us, cumulative_us) in slowest[:args.top]:
+            print(f"{cumulative_us / 1e6:>15.3f} {self_us / 1e6:>10.3f}  {name}")
+        if loaded:
+            print(f"retrieval only modules loaded: {', '.join(loaded)}")
+
+
+if __name__ == "__main__":
+    main()
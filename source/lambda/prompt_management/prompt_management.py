@@ -8,6 +8,8 @@ from botocore.paginate import TokenEncoder
 from common_logic.common_utils.prompt_utils import (
     EXPORT_MODEL_IDS,
     EXPORT_SCENES,
+    PROMPT_VERSION_SORT_KEY,
+    bump_prompt_version,
     get_all_templates,
 )
 
@@ -60,6 +62,8 @@ def __put_prompt(event, group_name):
             "LastModifiedTime": str(int(time.time())),
         }
     )
+    # invalidate the prompt caches of the chat lambdas
+    bump_prompt_version(group_name)
     return {"Message": "OK"}
 
 
@@ -99,6 +103,8 @@ def __list_prompt(event, group_name):
         page_items = page["Items"]
         page_json = []
         for item in page_items:
+            if item["SortKey"]["S"] == PROMPT_VERSION_SORT_KEY:
+                continue
             item_json = {}
             for key in list(item.keys()):
                 if key in ["Prompt"]:
@@ -145,6 +151,7 @@ def __delete_prompt(event, group_name):
     response = prompt_table.delete_item(
         Key={"GroupName": group_name, "SortKey": sort_key}
     )
+    bump_prompt_version(group_name)
     return {"Message": "OK"}
 
 
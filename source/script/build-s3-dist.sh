@@ -25,6 +25,7 @@ echo "--------------------------------------------"
 mkdir -p "$lambda_source_dir"/prompt_management/common_logic/common_utils
 cp "$lambda_source_dir"/online/common_logic/common_utils/constant.py "$lambda_source_dir"/prompt_management/common_logic/common_utils
 cp "$lambda_source_dir"/online/common_logic/common_utils/prompt_utils.py "$lambda_source_dir"/prompt_management/common_logic/common_utils
+cp "$lambda_source_dir"/online/common_logic/common_utils/cache_utils.py "$lambda_source_dir"/prompt_management/common_logic/common_utils
 cd "$lambda_source_dir"/prompt_management || exit 1
 zip -q -r9 "$lambda_build_dist_dir"/prompt_management.zip .
 